@@ -0,0 +1,44 @@
+"""add composite indexes for hot-path queries
+
+Revision ID: 3b4c5d6e7f80
+Revises: 2a3b4c5d6e7f
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '3b4c5d6e7f80'
+down_revision = '2a3b4c5d6e7f'
+branch_labels = None
+depends_on = None
+
+
+# (name, table, columns) -- keep in sync with the Index() declarations in models.py
+INDEXES = [
+    # build_context / semantic summaries: latest N messages per agent
+    ('ix_messages_agent_created', 'messages', ['agent_id', sa.text('created_at DESC')]),
+    # GET /messages pagination; id breaks created_at ties for stable keyset paging
+    ('ix_messages_user_agent_created', 'messages', ['user_id', 'agent_id', sa.text('created_at DESC'), sa.text('id DESC')]),
+    ('ix_events_agent_occurred', 'events', ['agent_id', sa.text('occurred_at DESC')]),
+    ('ix_scenarios_agent_track', 'scenarios', ['agent_id', 'track']),
+    ('ix_semantic_memory_agent_updated', 'semantic_memory', ['agent_id', sa.text('updated_at DESC')]),
+    ('ix_image_jobs_agent_kind_status_created', 'image_jobs', ['agent_id', 'kind', 'status', sa.text('created_at DESC')]),
+    ('ix_agents_user_created', 'agents', ['user_id', sa.text('created_at DESC')]),
+    # FK without an index makes ON DELETE CASCADE from messages scan affinity_deltas
+    ('ix_affinity_deltas_message', 'affinity_deltas', ['message_id']),
+]
+
+
+def upgrade() -> None:
+    # CONCURRENTLY avoids locking large tables against writes; it cannot run in a transaction.
+    with op.get_context().autocommit_block():
+        for name, table, cols in INDEXES:
+            op.create_index(name, table, cols, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
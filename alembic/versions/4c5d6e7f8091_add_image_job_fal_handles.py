@@ -0,0 +1,37 @@
+"""add fal request handles to image_jobs
+
+Revision ID: 4c5d6e7f8091
+Revises: 3b4c5d6e7f80
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '4c5d6e7f8091'
+down_revision = '3b4c5d6e7f80'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('image_jobs', sa.Column('external_id', sa.String(), nullable=True))
+    op.add_column('image_jobs', sa.Column('status_url', sa.Text(), nullable=True))
+    op.add_column('image_jobs', sa.Column('response_url', sa.Text(), nullable=True))
+    op.add_column('image_jobs', sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True))
+    # Existing rows would compare NULL and never be polled or expired; default added after the backfill
+    op.execute("UPDATE image_jobs SET updated_at = created_at WHERE updated_at IS NULL")
+    op.alter_column('image_jobs', 'updated_at', server_default=sa.func.now())
+    # webhook lookup by Fal request id; poller scan of stale running jobs
+    op.create_index('ix_image_jobs_external_id', 'image_jobs', ['external_id'])
+    op.create_index('ix_image_jobs_status_updated', 'image_jobs', ['status', 'updated_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_image_jobs_status_updated', table_name='image_jobs')
+    op.drop_index('ix_image_jobs_external_id', table_name='image_jobs')
+    op.drop_column('image_jobs', 'updated_at')
+    op.drop_column('image_jobs', 'response_url')
+    op.drop_column('image_jobs', 'status_url')
+    op.drop_column('image_jobs', 'external_id')
@@ -0,0 +1,25 @@
+"""add semantic_memory.last_message_at watermark
+
+Revision ID: 5d6e7f8091a2
+Revises: 4c5d6e7f8091
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '5d6e7f8091a2'
+down_revision = '4c5d6e7f8091'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('semantic_memory', sa.Column('last_message_at', sa.DateTime(timezone=True), nullable=True))
+    # Existing memories covered everything up to when they were written
+    op.execute("UPDATE semantic_memory SET last_message_at = updated_at WHERE last_message_at IS NULL")
+
+
+def downgrade() -> None:
+    op.drop_column('semantic_memory', 'last_message_at')
@@ -0,0 +1,32 @@
+"""add image_jobs.dedupe_key with a partial unique index over in-flight jobs
+
+Revision ID: 6e7f8091a2b3
+Revises: 5d6e7f8091a2
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '6e7f8091a2b3'
+down_revision = '5d6e7f8091a2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('image_jobs', sa.Column('dedupe_key', sa.String(), nullable=True))
+    # Existing rows keep a NULL key (NULLs never conflict), so in-flight legacy jobs are unaffected
+    op.create_index(
+        'ux_image_jobs_inflight',
+        'image_jobs',
+        ['agent_id', 'dedupe_key'],
+        unique=True,
+        postgresql_where=sa.text("status IN ('queued', 'running')"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ux_image_jobs_inflight', table_name='image_jobs')
+    op.drop_column('image_jobs', 'dedupe_key')
@@ -0,0 +1,39 @@
+"""add image_cache table and image_jobs.cache_key
+
+Revision ID: 7f8091a2b3c4
+Revises: 6e7f8091a2b3
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '7f8091a2b3c4'
+down_revision = '6e7f8091a2b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('image_cache',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('agent_id', sa.UUID(), nullable=False),
+    sa.Column('cache_key', sa.String(), nullable=False),
+    sa.Column('url', sa.Text(), nullable=False),
+    sa.Column('hits', sa.BigInteger(), nullable=False, server_default='0'),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('last_used_at', sa.DateTime(timezone=True), nullable=False),
+    sa.ForeignKeyConstraint(['agent_id'], ['agents.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_image_cache_agent_key_used', 'image_cache', ['agent_id', 'cache_key', 'last_used_at'])
+    op.create_index('ix_image_cache_agent_used', 'image_cache', ['agent_id', 'last_used_at'])
+    op.add_column('image_jobs', sa.Column('cache_key', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('image_jobs', 'cache_key')
+    op.drop_index('ix_image_cache_agent_used', table_name='image_cache')
+    op.drop_index('ix_image_cache_agent_key_used', table_name='image_cache')
+    op.drop_table('image_cache')
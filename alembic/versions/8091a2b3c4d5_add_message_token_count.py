@@ -0,0 +1,24 @@
+"""add messages.token_count
+
+Revision ID: 8091a2b3c4d5
+Revises: 7f8091a2b3c4
+Create Date: 2026-10-17 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '8091a2b3c4d5'
+down_revision = '7f8091a2b3c4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Nullable, no backfill: older rows are estimated from their length when packed
+    op.add_column('messages', sa.Column('token_count', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('messages', 'token_count')
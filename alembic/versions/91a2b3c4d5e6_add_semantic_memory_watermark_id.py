@@ -0,0 +1,24 @@
+"""add semantic_memory.last_message_id watermark tiebreaker
+
+Revision ID: 91a2b3c4d5e6
+Revises: 8091a2b3c4d5
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '91a2b3c4d5e6'
+down_revision = '8091a2b3c4d5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # No FK: the watermark must survive the message being deleted
+    op.add_column('semantic_memory', sa.Column('last_message_id', sa.UUID(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('semantic_memory', 'last_message_id')
@@ -0,0 +1,38 @@
+"""add 'finishing' image job status
+
+Revision ID: a2b3c4d5e6f7
+Revises: 91a2b3c4d5e6
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'a2b3c4d5e6f7'
+down_revision = '91a2b3c4d5e6'
+branch_labels = None
+depends_on = None
+
+
+def _recreate(statuses: str, inflight: str) -> None:
+    op.drop_constraint('ck_image_jobs_status', 'image_jobs', type_='check')
+    op.create_check_constraint('ck_image_jobs_status', 'image_jobs', f"status in ({statuses})")
+    op.drop_index('ux_image_jobs_inflight', table_name='image_jobs')
+    op.create_index(
+        'ux_image_jobs_inflight',
+        'image_jobs',
+        ['agent_id', 'dedupe_key'],
+        unique=True,
+        postgresql_where=sa.text(f"status IN ({inflight})"),
+    )
+
+
+def upgrade() -> None:
+    # A claimed job uploads its result outside the row lock; it stays single-flight meanwhile
+    _recreate("'queued','running','finishing','succeeded','failed'", "'queued', 'running', 'finishing'")
+
+
+def downgrade() -> None:
+    op.execute("UPDATE image_jobs SET status = 'running' WHERE status = 'finishing'")
+    _recreate("'queued','running','succeeded','failed'", "'queued', 'running'")
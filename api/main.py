@@ -1,3 +1,6 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
@@ -12,10 +15,27 @@ from .withme.routes.webhooks import router as webhooks_router
 from .withme.routes.admin import router as admin_router
 from .withme.routes.cron import router as cron_router
 from .withme.routes.messages import router as messages_router
+from .withme.providers.openai_client import aclose_clients
+from .withme.services import history, pipeline, retrieval
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Resolve the vector index once, in the background, so the first chat does not pay for it
+    verify = asyncio.create_task(asyncio.to_thread(retrieval.verify_index))
+    # Tokenizer for message token counts; counts are estimated until it is loaded
+    tokenizer = asyncio.create_task(asyncio.to_thread(history.load_encoder))
+    yield
+    verify.cancel()
+    tokenizer.cancel()
+    # Finish deferred post-turn work, then release pooled upstream connections
+    await pipeline.stop()
+    await asyncio.to_thread(retrieval.flush_pending)
+    await aclose_clients()
 
 
 def create_app() -> FastAPI:
-    app = FastAPI(title="With Me API", version="0.1.0")
+    app = FastAPI(title="With Me API", version="0.1.0", lifespan=lifespan)
 
     app.add_middleware(
         CORSMiddleware,
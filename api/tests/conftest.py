@@ -0,0 +1,143 @@
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+
+import pytest
+from sqlalchemy import DateTime, create_engine, event, inspect, literal, text
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.sql.expression import Values
+
+from api.withme.models import Agent, Base, User
+
+
+class FakeAsyncSession:
+    """AsyncSession surface used by the services, over a sync SQLite session.
+
+    Statements really run, so tests assert on rows and return values instead of
+    on rendered SQL.
+    """
+
+    def __init__(self, sync: Session):
+        self.sync = sync
+
+    async def execute(self, stmt, params=None):
+        return self.sync.execute(stmt, params)
+
+    async def get(self, model, key):
+        return self.sync.get(model, key)
+
+    def add(self, obj):
+        self.sync.add(obj)
+
+    async def flush(self):
+        self.sync.flush()
+
+    async def commit(self):
+        self.sync.commit()
+
+    async def rollback(self):
+        self.sync.rollback()
+
+
+@compiles(Values, "sqlite")
+def _values_sqlite(element, compiler, **kw):
+    # SQLite takes no column list on a VALUES alias; SELECT ... UNION ALL is the same relation
+    rows = [row for chunk in element._data for row in chunk]
+    body = " UNION ALL ".join(
+        "SELECT " + ", ".join(f"{compiler.process(literal(v, c.type))} AS {c.name}" for v, c in zip(row, element.columns))
+        for row in rows
+    )
+    return f"({body}) AS {element.name}"
+
+
+def _utc_on_load(target, context):
+    # SQLite drops the offset; Postgres hands timestamptz back aware
+    for attr in inspect(target).mapper.column_attrs:
+        col_type = attr.columns[0].type
+        value = target.__dict__.get(attr.key)
+        if isinstance(col_type, DateTime) and col_type.timezone and isinstance(value, datetime) and value.tzinfo is None:
+            set_committed_value(target, attr.key, value.replace(tzinfo=timezone.utc))
+
+
+class FakeDB:
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements: list[str] = []
+        self.session = FakeAsyncSession(Session(engine, expire_on_commit=False))
+        # Sessions opened through scope(); tests check none is open at a given point
+        self.open_scopes = 0
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def _count(conn, cursor, statement, *args):
+            self.statements.append(statement)
+
+    def add(self, *objs):
+        """Insert rows committed, as if another request had written them."""
+        with Session(self.engine, expire_on_commit=False) as s:
+            s.add_all(objs)
+            s.commit()
+
+    def get(self, model, key):
+        """Read a row back as committed, from a session of its own."""
+        with Session(self.engine, expire_on_commit=False) as s:
+            return s.get(model, key)
+
+    def all(self, model):
+        with Session(self.engine, expire_on_commit=False) as s:
+            return list(s.query(model))
+
+    def add_agent(self, user_id=None, **kw):
+        user_id = user_id or uuid.uuid4()
+        if self.get(User, user_id) is None:
+            self.add(User(id=user_id, email=f"{user_id}@example.com"))
+        agent = Agent(id=uuid.uuid4(), user_id=user_id, name="Daniel", persona_json={}, romance_allowed=True,
+                      timezone="UTC", **kw)
+        self.add(agent)
+        return self.get(Agent, agent.id)
+
+    def scope(self):
+        """Stand-in for db.session_scope: a fresh session that commits on exit."""
+
+        @asynccontextmanager
+        async def session_scope():
+            s = Session(self.engine, expire_on_commit=False)
+            self.open_scopes += 1
+            try:
+                yield FakeAsyncSession(s)
+                s.commit()
+            except Exception:
+                s.rollback()
+                raise
+            finally:
+                self.open_scopes -= 1
+                s.close()
+
+        return session_scope
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+
+    @event.listens_for(engine, "connect")
+    def _functions(dbapi_conn, conn_rec):
+        dbapi_conn.create_function("greatest", -1, max)
+        dbapi_conn.create_function("least", -1, min)
+
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        # The partial unique index is declared for Postgres only; mirror it here
+        conn.execute(text("DROP INDEX ux_image_jobs_inflight"))
+        conn.execute(text(
+            "CREATE UNIQUE INDEX ux_image_jobs_inflight ON image_jobs (agent_id, dedupe_key) "
+            "WHERE status IN ('queued', 'running', 'finishing')"
+        ))
+    event.listen(Base, "load", _utc_on_load, propagate=True)
+    fake = FakeDB(engine)
+    yield fake
+    event.remove(Base, "load", _utc_on_load)
+    fake.session.sync.close()
+    engine.dispose()
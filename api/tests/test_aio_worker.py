@@ -0,0 +1,55 @@
+import asyncio
+import time
+
+from redis import Redis
+
+from worker import aio
+
+
+class _Job:
+    def __init__(self, i):
+        self.id = f"j{i}"
+        self.func_name = "worker.tasks.process_image_job"
+        self.args, self.kwargs = (str(i),), {}
+        self.registries = []
+
+
+def test_async_worker_runs_jobs_concurrently(monkeypatch):
+    running, peak = 0, 0
+
+    async def fake_image_job(job_id, client=None):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.1)
+        running -= 1
+        if job_id == "3":
+            raise RuntimeError("boom")
+
+    monkeypatch.setitem(aio.ASYNC_TASKS, "worker.tasks.process_image_job", fake_image_job)
+    jobs = [_Job(i) for i in range(12)]
+    pending = list(jobs)
+
+    async def main():
+        w = aio.AsyncWorker(Redis.from_url("redis://localhost:1/0"), ["default"], concurrency=4)
+
+        def dequeue():
+            if not pending:
+                w.stop()
+                return None
+            return pending.pop(0), None
+
+        w._dequeue = dequeue
+        w._start = lambda job: job.registries.append("started")
+        w._end = lambda job, exc=None: job.registries.append("finished" if exc is None else exc.splitlines()[-1])
+        w._heartbeat = lambda: None
+        await w.run()
+        return w
+
+    t0 = time.perf_counter()
+    w = asyncio.run(main())
+    assert time.perf_counter() - t0 < 1.0  # 3 waves of 0.1s, not 12 sequential
+    assert peak == 4
+    assert (w.counters["finished"], w.counters["failed"]) == (11, 1)
+    assert [j.registries for j in jobs if j.id != "j3"] == [["started", "finished"]] * 11
+    assert jobs[3].registries == ["started", "RuntimeError: boom"]
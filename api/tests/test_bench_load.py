@@ -0,0 +1,17 @@
+from bench.load import compare, summarize
+
+
+def test_summarize_and_regression_check():
+    cur = {"send": summarize([10.0] * 95 + [100.0] * 5, errors=0, wall_s=2.0)}
+    assert cur["send"]["requests"] == 100 and cur["send"]["rps"] == 50.0
+    assert cur["send"]["p50_ms"] == 10.0 and cur["send"]["max_ms"] == 100.0
+
+    assert compare(cur, cur) == []
+    base = {"send": {**cur["send"], "p99_ms": cur["send"]["p99_ms"] / 2, "rps": 100.0}, "state": cur["send"]}
+    regressions = compare(cur, base, tolerance=0.2)
+    assert any(r.startswith("send: p99_ms") for r in regressions)
+    assert any(r.startswith("send: rps") for r in regressions)
+    assert compare({"send": {**cur["send"], "errors": 3}}, cur) == ["send: 3 errors (baseline had none)"]
+
+    image = {k: v for k, v in cur["send"].items() if k != "rps"}  # --worker image scenario
+    assert compare({"image": image}, {"image": image}) == []
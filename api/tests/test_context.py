@@ -0,0 +1,49 @@
+import asyncio
+import time
+import uuid
+from types import SimpleNamespace
+
+from api.withme.services import context as context_svc
+
+
+class _Result:
+    def scalars(self):
+        return self
+
+    def all(self):
+        return []
+
+
+class _SlowSession:
+    async def execute(self, _q):
+        await asyncio.sleep(0.1)
+        return _Result()
+
+
+def _agent():
+    return SimpleNamespace(id=uuid.uuid4(), timezone="UTC", mood=0.0, romance_allowed=False)
+
+
+def test_semantic_overlaps_db_reads_and_respects_budget(monkeypatch):
+    from api.withme.config import get_settings
+
+    monkeypatch.setattr(get_settings(), "context_semantic_timeout_ms", 300)
+
+    async def fast(text, agent_id, top_k=None):
+        await asyncio.sleep(0.15)
+        return [{"id": "m", "metadata": {"content": text}}]
+
+    async def stuck(text, agent_id, top_k=None):
+        await asyncio.sleep(5)
+
+    monkeypatch.setattr(context_svc, "asemantic_query", fast)
+    t0 = time.perf_counter()
+    ctx = asyncio.run(context_svc.build_context(_SlowSession(), _agent(), query_text="hi"))
+    assert time.perf_counter() - t0 < 0.3  # max(0.2 db, 0.15 recall), not the sum
+    assert ctx.flags["semantic"][0]["metadata"]["content"] == "hi"
+
+    monkeypatch.setattr(context_svc, "asemantic_query", stuck)
+    t0 = time.perf_counter()
+    ctx = asyncio.run(context_svc.build_context(_SlowSession(), _agent(), query_text="hi"))
+    assert time.perf_counter() - t0 < 1.0
+    assert ctx.flags["semantic"] == []
@@ -0,0 +1,32 @@
+import asyncio
+import uuid
+
+import numpy as np
+import pytest
+
+from api.withme.models import Agent, Event
+from api.withme.services import daily_events
+from api.withme.services.daily_events import MOOD_DELTAS, run_daily_events, sample_events
+
+
+def test_sample_events_rate_and_shape():
+    ids = [uuid.uuid4() for _ in range(20_000)]
+    rows = sample_events(ids, np.random.default_rng(1))
+    assert 800 < len(rows) < 1200  # ~5%
+    assert {r["mood_delta"] for r in rows} <= set(MOOD_DELTAS.tolist())
+    assert len({r["agent_id"] for r in rows}) == len(rows)
+
+
+def test_run_daily_events_applies_clamped_deltas_in_batches(db, monkeypatch):
+    monkeypatch.setattr(daily_events, "session_scope", db.scope())
+    monkeypatch.setattr(daily_events, "sample_events", lambda ids, rng: sample_events(ids, rng, p=1.0))
+    high, unset, low = (db.add_agent(mood=0.95).id, db.add_agent(mood=None).id, db.add_agent(mood=-0.95).id)
+
+    monkeypatch.setattr(daily_events, "MOOD_DELTAS", np.array([0.2]))
+    assert asyncio.run(run_daily_events(batch_size=2, seed=1)) == {"agents": 3, "events": 3, "batches": 2}
+    assert [db.get(Agent, a).mood for a in (high, unset, low)] == pytest.approx([1.0, 0.2, -0.75])
+
+    monkeypatch.setattr(daily_events, "MOOD_DELTAS", np.array([-0.5]))
+    asyncio.run(run_daily_events(batch_size=2, seed=1))
+    assert [db.get(Agent, a).mood for a in (high, unset, low)] == pytest.approx([0.5, -0.3, -1.0])
+    assert sorted(e.mood_delta for e in db.all(Event)) == [-0.5] * 3 + [0.2] * 3
@@ -0,0 +1,73 @@
+import asyncio
+import uuid
+from datetime import datetime
+
+from api.withme import deps
+from api.withme.models import Agent, User
+
+
+def test_resolve_user_agent_creates_then_prefers_the_requested_agent(db, monkeypatch):
+    monkeypatch.setattr(deps, "_known_users", deps._KnownUsers(ttl_s=60))
+    uid = uuid.uuid4()
+
+    # First contact: the user and a default agent
+    _, first = asyncio.run(deps.resolve_user_agent(db.session, uid, "a@b.c"))
+    asyncio.run(db.session.commit())
+    assert db.get(User, uid).email == "a@b.c" and first.user_id == uid
+    assert uid not in deps.known_users()  # created in this transaction, not read back
+
+    second = Agent(user_id=uid, name="Sam", persona_json={}, romance_allowed=True, timezone="UTC",
+                   created_at=datetime(2100, 1, 1))
+    db.add(second)
+    db.statements.clear()
+    assert asyncio.run(deps.resolve_user_agent(db.session, uid, "a@b.c", second.id))[1].id == second.id
+    assert len(db.statements) == 1 and uid in deps.known_users()
+
+    # Known user: still one query; someone else's agent id falls back to the oldest
+    other = db.add_agent()
+    db.statements.clear()
+    assert asyncio.run(deps.resolve_user_agent(db.session, uid, "a@b.c", other.id))[1].id == first.id
+    assert len(db.statements) == 1
+    db.statements.clear()
+    asyncio.run(deps.ensure_user(db.session, uid, "a@b.c"))
+    assert db.statements == []
+
+
+def test_resolve_user_agent_recreates_a_deleted_cached_user(db, monkeypatch):
+    monkeypatch.setattr(deps, "_known_users", deps._KnownUsers(ttl_s=60))
+    uid = uuid.uuid4()
+    deps.known_users().add(uid)  # cached, but the row is gone
+    _, agent = asyncio.run(deps.resolve_user_agent(db.session, uid, "a@b.c"))
+    asyncio.run(db.session.commit())
+    assert db.get(User, uid) is not None and db.get(Agent, agent.id).user_id == uid
+
+
+def test_known_users_expire():
+    cache = deps._KnownUsers(ttl_s=-1)
+    uid = uuid.uuid4()
+    cache.add(uid)
+    assert uid not in cache
+
+
+def test_known_users_evict_oldest_at_capacity():
+    cache = deps._KnownUsers(ttl_s=60, max_entries=2)
+    a, b, c = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    cache.add(a)
+    cache.add(b)
+    cache.add(a)  # refreshed: b is now the oldest
+    cache.add(c)
+    assert a in cache and c in cache and b not in cache
+
+
+def test_ensure_user_rechecks_a_cached_id_before_writes(db, monkeypatch):
+    monkeypatch.setattr(deps, "_known_users", deps._KnownUsers(ttl_s=60))
+    uid = uuid.uuid4()
+    deps.known_users().add(uid)  # cached, but the row was deleted since
+
+    db.statements.clear()
+    asyncio.run(deps.ensure_user(db.session, uid, "a@b.c"))
+    assert db.statements == [] and db.get(User, uid) is None  # reads trust the cache
+
+    asyncio.run(deps.ensure_user(db.session, uid, "a@b.c", for_write=True))
+    asyncio.run(db.session.commit())
+    assert db.get(User, uid).email == "a@b.c"
@@ -0,0 +1,42 @@
+from api.withme.providers.embedding_cache import EmbeddingCache
+
+
+class _FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    def mget(self, keys):
+        return [self.data.get(k) for k in keys]
+
+    def pipeline(self, transaction=False):
+        return self
+
+    def set(self, k, v, ex=None):
+        self.data[k] = v
+
+    def execute(self):
+        pass
+
+
+def test_lru_hits_misses_and_eviction():
+    c = EmbeddingCache(max_entries=2, ttl_s=60)
+    assert c.get_many("m", ["a"]) == [None]
+    c.put_many("m", ["a", "b", "c"], [[1.0], [2.0], [3.0]])
+    assert c.get_many("m", ["a", "c"]) == [None, [3.0]]
+    assert c.get_many("other-model", ["c"]) == [None]
+    s = c.stats()
+    assert s["hits"] == 1 and s["misses"] == 3 and s["evictions"] == 1
+
+
+def test_ttl_expiry():
+    c = EmbeddingCache(max_entries=10, ttl_s=-1)
+    c.put_many("m", ["a"], [[1.0]])
+    assert c.get_many("m", ["a"]) == [None]
+
+
+def test_shared_tier_fills_local_tier():
+    r = _FakeRedis()
+    EmbeddingCache(redis=r).put_many("m", ["a"], [[0.5, 0.25]])
+    other = EmbeddingCache(redis=r)
+    assert other.get_many("m", ["a"]) == [[0.5, 0.25]]
+    assert other.stats()["redis_hits"] == 1
@@ -9,3 +9,23 @@ def test_health():
     assert r.status_code == 200
     assert r.json().get("ok") is True
 
+
+def test_health_reports_pool_stats():
+    from api.withme.config import get_settings
+    from api.withme.db import get_engine
+
+    assert get_engine().pool.size() == get_settings().db_pool_size
+    r = TestClient(app).get("/health")
+    pool = r.json()["db_pool"]
+    assert {"checkouts", "wait_ms_max", "checkedout", "overflow"} <= set(pool)
+
+
+def test_new_connection_setup_is_kept_out_of_checkout_wait():
+    from sqlalchemy import create_engine
+
+    from api.withme.db import _track_connects
+
+    engine = create_engine("sqlite://")
+    _track_connects(engine)
+    with engine.connect() as conn:
+        assert conn.connection.info["connect_ms"] >= 0  # subtracted by session_scope
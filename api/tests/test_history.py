@@ -0,0 +1,34 @@
+from api.withme.services import history
+
+
+def _msgs(n, tokens=10):
+    return [
+        {"id": str(i), "role": "user" if i % 2 == 0 else "agent", "text": f"message {i}", "tokens": tokens}
+        for i in range(n)
+    ]
+
+
+def test_pack_keeps_newest_turns_within_budget():
+    msgs = _msgs(50)
+    packed = history.pack_history(msgs, budget=100, exclude_id="49")
+
+    # 14 tokens per turn (10 + overhead) -> 7 turns, newest first, returned oldest first
+    assert [m["content"] for m in packed.messages] == [f"message {i}" for i in range(42, 49)]
+    assert packed.messages[-1]["role"] == "user" and packed.messages[-2]["role"] == "assistant"
+    assert packed.tokens <= 100
+
+
+def test_pack_dedupes_semantic_hits_and_estimates_uncounted_rows():
+    msgs = _msgs(3, tokens=None) + [{"id": "img", "role": "agent", "text": None, "image_url": "u"}]
+    hits = [{"metadata": {"content": c}} for c in ("message 1", "likes hiking", "likes hiking", "x" * 4000)]
+    packed = history.pack_history(msgs, hits, budget=200)
+
+    assert packed.memories == ["likes hiking"]  # in-window, duplicate and oversized hits skipped
+    assert packed.messages[-1]["content"] == history.PHOTO_TEXT
+    assert len(packed.messages) == 4
+
+
+def test_count_tokens_never_loads_the_encoder(monkeypatch):
+    monkeypatch.setattr(history, "_encoder", None)
+    assert history.count_tokens("hello there") is None  # estimated at pack time
+    assert history.count_tokens("") == 0
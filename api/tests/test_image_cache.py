@@ -0,0 +1,70 @@
+import asyncio
+import random
+from datetime import datetime, timedelta, timezone
+
+from api.withme.models import ImageCacheEntry
+from api.withme.services import image_cache
+
+
+def _clock(monkeypatch):
+    """Each read of the cache clock is one second later, so LRU order is deterministic."""
+    t = [datetime.now(timezone.utc)]
+
+    def tick():
+        t[0] += timedelta(seconds=1)
+        return t[0]
+
+    monkeypatch.setattr(image_cache, "_utcnow", tick)
+
+
+def _urls(db, key=None):
+    rows = [e for e in db.all(ImageCacheEntry) if key is None or e.cache_key == key]
+    return sorted(e.url for e in rows)
+
+
+def test_cache_key_tracks_base_image_and_bucket():
+    k = image_cache.cache_key("https://img/base-v1.jpg", "work", image_cache.expression_bucket(0.5))
+    assert k.endswith(":work:warm smile")
+    assert k != image_cache.cache_key("https://img/base-v2.jpg", "work", "warm smile")
+    assert image_cache.expression_bucket(None) == "neutral"
+
+
+def test_lookup_rotates_variants_and_builds_variety(db, monkeypatch):
+    from api.withme.config import get_settings
+
+    monkeypatch.setattr(get_settings(), "image_cache_variants", 2)
+    monkeypatch.setattr(get_settings(), "image_cache_fresh_p", 0.5)
+    _clock(monkeypatch)
+    agent = db.add_agent().id
+    always, never = random.Random(), random.Random()
+    always.random, never.random = (lambda: 0.0), (lambda: 0.99)
+    assert asyncio.run(image_cache.lookup(db.session, agent, "k")) is None
+
+    # One variant of two: misses when the roll says "generate fresh"
+    asyncio.run(image_cache.store(db.session, agent, "k", "a"))
+    assert asyncio.run(image_cache.lookup(db.session, agent, "k", rng=always)) is None
+    assert asyncio.run(image_cache.lookup(db.session, agent, "k", rng=never)) == "a"
+    asyncio.run(db.session.commit())
+    [entry] = db.all(ImageCacheEntry)
+    assert entry.hits == 1 and entry.last_used_at > entry.created_at
+
+    # Full bucket: always served, least recently used first, so requests rotate
+    asyncio.run(image_cache.store(db.session, agent, "k", "b"))
+    served = [asyncio.run(image_cache.lookup(db.session, agent, "k", rng=always)) for _ in range(4)]
+    assert served == ["a", "b", "a", "b"]
+
+
+def test_store_evicts_lru_per_bucket_and_agent(db, monkeypatch):
+    from api.withme.config import get_settings
+
+    monkeypatch.setattr(get_settings(), "image_cache_variants", 2)
+    monkeypatch.setattr(get_settings(), "image_cache_max_per_agent", 3)
+    _clock(monkeypatch)
+    agent, other = db.add_agent().id, db.add_agent().id
+    for key, url in (("k", "k1"), ("k", "k2"), ("k", "k3"), ("j", "j1"), ("j", "j2")):
+        asyncio.run(image_cache.store(db.session, agent, key, url))
+    asyncio.run(image_cache.store(db.session, other, "k", "other"))
+    asyncio.run(db.session.commit())
+
+    assert _urls(db, "k") == ["k3", "other"]  # bucket kept its newest 2; agent cap dropped k2
+    assert _urls(db, "j") == ["j1", "j2"]
@@ -0,0 +1,123 @@
+import uuid
+
+from fastapi.testclient import TestClient
+
+from api.main import app
+from api.withme.services import image_jobs
+
+
+def test_submit_target_attaches_webhook(monkeypatch):
+    from api.withme.config import get_settings
+
+    monkeypatch.setattr(get_settings(), "public_base_url", "https://api.example.com/")
+    monkeypatch.setattr(get_settings(), "fal_webhook_token", "t0k")
+    target = image_jobs.submit_target("abc", "edit", "https://img/base.jpg")
+    assert target.startswith("https://queue.fal.run/fal-ai/nano-banana/edit?fal_webhook=")
+    assert "webhooks%2Ffal%3Fjob_id%3Dabc%26token%3Dt0k" in target
+    monkeypatch.setattr(get_settings(), "public_base_url", None)
+    assert image_jobs.submit_target("abc", "edit", None) == "https://queue.fal.run/fal-ai/flux-pro/v1.1-ultra"
+
+
+def test_parse_fal_body_handles_sse_and_json():
+    sse = 'event: x\ndata: {"status": "IN_PROGRESS"}\ndata: {"status": "COMPLETED"}\n'
+    assert image_jobs.parse_fal_body(sse)["status"] == "COMPLETED"
+    assert image_jobs.parse_fal_body('{"images": [{"url": "https://x/y.png"}]}')["images"]
+    assert image_jobs.parse_fal_body("not json") == {}
+
+
+def test_fal_webhook_completes_job(monkeypatch):
+    calls = []
+
+    async def complete(jid, url):
+        calls.append((jid, url))
+        return True
+
+    monkeypatch.setattr(image_jobs, "complete_job", complete)
+    jid = uuid.uuid4()
+    client = TestClient(app)
+    r = client.post(
+        f"/webhooks/fal?job_id={jid}",
+        json={"request_id": "r1", "status": "OK", "payload": {"images": [{"url": "https://cdn/x.png"}]}},
+    )
+    assert r.status_code == 204
+    r = client.post("/webhooks/fal", json={"job_id": str(jid), "status": "failed"})
+    assert r.status_code == 204
+    assert calls == [(jid, "https://cdn/x.png"), (jid, None)]
+
+
+def test_create_or_attach_joins_in_flight_job(db):
+    import asyncio
+    from datetime import datetime, timedelta
+
+    from api.withme.models import ImageJob
+
+    assert image_jobs.dedupe_key("edit", "Selfie  at the CAFE") == image_jobs.dedupe_key("edit", "selfie at the cafe")
+    assert image_jobs.dedupe_key("base", "a") == image_jobs.dedupe_key("base", "b") == "base"
+
+    agent = db.add_agent()
+    job_id, created = asyncio.run(image_jobs.create_or_attach(db.session, agent.id, "edit", "selfie"))
+    assert created
+    assert asyncio.run(image_jobs.create_or_attach(db.session, agent.id, "edit", "Selfie ")) == (job_id, False)
+    assert asyncio.run(image_jobs.create_or_attach(db.session, agent.id, "edit", "beach"))[1]
+
+    # Finished or presumed lost: the next request starts a new job
+    job = asyncio.run(db.session.get(ImageJob, job_id))
+    job.status = "succeeded"
+    again, created = asyncio.run(image_jobs.create_or_attach(db.session, agent.id, "edit", "selfie"))
+    assert created and again != job_id
+    asyncio.run(db.session.get(ImageJob, again)).created_at = datetime.utcnow() - timedelta(hours=1)
+    fresh, created = asyncio.run(image_jobs.create_or_attach(db.session, agent.id, "edit", "selfie"))
+    assert created and fresh != again
+    assert asyncio.run(db.session.get(ImageJob, again)).status == "failed"
+
+
+def _job(db, kind, cache_key=None):
+    from api.withme.models import ImageJob
+
+    agent = db.add_agent()
+    job = ImageJob(agent_id=agent.id, prompt="p", status="running", kind=kind, dedupe_key=kind, cache_key=cache_key)
+    db.add(job)
+    return agent, job
+
+
+def test_complete_job_uploads_outside_any_transaction(db, monkeypatch):
+    import asyncio
+
+    from api.withme.models import Agent, ImageJob
+
+    agent, job = _job(db, "base")
+    uploads = []
+
+    async def upload(url, **kw):
+        uploads.append(db.open_scopes)
+        return "https://storage/base.jpg"
+
+    monkeypatch.setattr(image_jobs, "session_scope", db.scope())
+    monkeypatch.setattr(image_jobs, "aupload_public_image_from_url", upload)
+    assert asyncio.run(image_jobs.complete_job(job.id, "https://fal/x.jpg")) is True
+    assert uploads == [0]  # no session open during the upload
+    assert db.get(ImageJob, job.id).status == "succeeded"
+    assert db.get(Agent, agent.id).base_image_url == "https://storage/base.jpg"
+    assert asyncio.run(image_jobs.complete_job(job.id, "https://fal/y.jpg")) is False  # already finished
+    assert uploads == [0]
+
+
+def test_cached_edit_stores_one_uploaded_copy_for_message_and_cache(db, monkeypatch):
+    import asyncio
+
+    from api.withme.models import ImageCacheEntry, Message
+
+    uploads = []
+    monkeypatch.setattr(image_jobs, "session_scope", db.scope())
+    for result in ("https://storage/cache.jpg", None):  # upload ok, then storage unavailable
+        async def upload(url, **kw):
+            uploads.append(kw["object_path"])
+            return result
+
+        monkeypatch.setattr(image_jobs, "aupload_public_image_from_url", upload)
+        _, job = _job(db, "edit", cache_key="k")
+        asyncio.run(image_jobs.complete_job(job.id, "https://fal/tmp.jpg"))
+
+    assert len(uploads) == 2  # one upload per job
+    assert sorted(m.image_url for m in db.all(Message)) == ["https://fal/tmp.jpg", "https://storage/cache.jpg"]
+    assert [e.url for e in db.all(ImageCacheEntry)] == ["https://storage/cache.jpg"]  # never a temporary Fal URL
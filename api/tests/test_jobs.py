@@ -0,0 +1,68 @@
+from rq.utils import now, utcformat
+
+from api.withme import jobs
+
+
+class _Pipe:
+    def __init__(self, data):
+        self.data, self.ops = data, []
+
+    def __getattr__(self, op):
+        return lambda *args: self.ops.append((op, args))
+
+    def execute(self):
+        out = []
+        for op, args in self.ops:
+            if op == "llen":
+                out.append(len(self.data.get(args[0], [])))
+            elif op == "lindex":
+                items = self.data.get(args[0], [])
+                out.append(items[args[1]] if items else None)
+            elif op == "hget":
+                out.append(self.data.get(args[0], {}).get(args[1]))
+            else:
+                out.append(0)
+        return out
+
+
+class _Redis:
+    def __init__(self, data):
+        self.data = data
+
+    def pipeline(self, transaction=True):
+        return _Pipe(self.data)
+
+
+def test_image_jobs_route_by_priority(monkeypatch):
+    calls, ids = [], []
+
+    class _Queue:
+        def __init__(self, name):
+            self.name = name
+
+        def enqueue_call(self, func, args=(), **kw):
+            calls.append((self.name, func, args))
+            ids.append(kw.get("job_id"))
+
+    monkeypatch.setattr(jobs, "get_queue", _Queue)
+    jobs.enqueue_image_job("j1", "edit")
+    jobs.enqueue_image_job("j2", "base")
+    jobs.dispatch("worker.tasks.run_semantic_refresh", ["a"], "run")
+    assert calls == [
+        ("interactive", jobs.IMAGE_TASK, ("j1",)),
+        ("base", jobs.IMAGE_TASK, ("j2",)),
+        ("background", "worker.tasks.run_semantic_refresh", (["a"], "run")),
+    ]
+    assert ids == ["image:j1", "image:j2", None]  # image tasks are findable by the poller
+    assert jobs.PRIORITY.index("interactive") < jobs.PRIORITY.index("base") < jobs.PRIORITY.index("background")
+
+
+def test_queue_stats_reports_depth_and_oldest_age(monkeypatch):
+    stamp = utcformat(now()).encode()
+    fake = _Redis({"rq:queue:base": [b"j1", b"j2"], "rq:job:j1": {"enqueued_at": stamp}})
+    monkeypatch.setattr(jobs, "_redis", fake)
+    monkeypatch.setattr(jobs, "_queues", {})
+    stats = jobs.queue_stats()
+    assert list(stats) == list(jobs.PRIORITY)
+    assert stats["base"]["depth"] == 2 and 0 <= stats["base"]["oldest_age_s"] < 5
+    assert stats["interactive"] == {"depth": 0, "oldest_age_s": None, "started": 0, "failed": 0}
@@ -0,0 +1,22 @@
+import uuid
+from datetime import datetime, timezone
+
+from fastapi.testclient import TestClient
+
+from api.main import app
+from api.withme.routes.messages import decode_cursor, encode_cursor
+
+
+def test_cursor_roundtrip_keeps_ties_distinct():
+    ts = datetime(2025, 9, 5, 12, 0, 0, 123456, tzinfo=timezone.utc)
+    a, b = uuid.uuid4(), uuid.uuid4()
+    ca, cb = encode_cursor(ts, a), encode_cursor(ts, b)
+    assert ca != cb
+    assert decode_cursor(ca) == (ts, a)
+    assert decode_cursor(cb) == (ts, b)
+
+
+def test_invalid_cursor_rejected():
+    client = TestClient(app)
+    r = client.get("/messages?cursor=not-a-cursor", headers={"Authorization": "Bearer dev"})
+    assert r.status_code == 400
@@ -0,0 +1,24 @@
+import asyncio
+
+from api.withme.services import pipeline
+
+
+def test_pipeline_runs_and_sheds_when_full(monkeypatch):
+    from api.withme.config import get_settings
+
+    monkeypatch.setattr(get_settings(), "pipeline_max_queue", 2)
+    monkeypatch.setattr(get_settings(), "pipeline_workers", 1)
+
+    async def main():
+        done = []
+
+        async def job(i):
+            done.append(i)
+
+        accepted = [pipeline.submit("t", lambda i=i: job(i)) for i in range(4)]
+        await pipeline.stop()
+        return accepted, done
+
+    accepted, done = asyncio.run(main())
+    assert accepted == [True, True, False, False]
+    assert done == [0, 1]
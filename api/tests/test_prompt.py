@@ -0,0 +1,37 @@
+import uuid
+from datetime import datetime
+from types import SimpleNamespace
+
+from api.withme.services import prompt
+from api.withme.services.context import Context
+
+
+def _agent(**kw):
+    base = dict(id=uuid.uuid4(), name="Mia", timezone="Europe/Lisbon", romance_allowed=False,
+                persona_json={"occupation": "nurse", "city": "Lisbon", "traits": ["kind"]}, mood=0.1, affinity=0.5)
+    return SimpleNamespace(**{**base, **kw})
+
+
+def _ctx(availability="evening"):
+    return Context(messages=[], scenarios=[{"track": "A", "title": "Promotion", "progress": 0.5}], mood=0.0,
+                   availability=availability, flags={"timezone": "UTC", "semantic": []})
+
+
+def test_prefix_is_stable_and_volatile_state_comes_last(monkeypatch):
+    monkeypatch.setattr(prompt, "_prefixes", prompt._PrefixCache())
+    agent = _agent()
+    a = prompt.compose_system(agent, _ctx("work"), now=datetime(2026, 1, 1, 9, 0))
+    agent.mood, agent.affinity = -0.5, 0.9
+    b = prompt.compose_system(agent, _ctx("evening"), now=datetime(2026, 1, 1, 21, 30))
+
+    prefix = prompt.render_prefix(agent)
+    assert a.startswith(prefix + "\n\nCurrent state:") and b.startswith(prefix + "\n\nCurrent state:")
+    assert "Local time: Thu 21:30" in b and "availability=evening" in b
+    assert '"city":"Lisbon","occupation":"nurse"' in prefix  # sorted JSON, not repr
+    assert prompt.cache_stats()["misses"] == 1 and prompt.cache_stats()["hits"] == 1
+
+    # Reordering persona keys changes nothing; editing it starts a new version
+    same = _agent(id=agent.id, persona_json={"traits": ["kind"], "city": "Lisbon", "occupation": "nurse"})
+    assert prompt.fingerprint(same) == prompt.fingerprint(agent)
+    edited = _agent(id=agent.id, persona_json={"occupation": "doctor", "city": "Lisbon"})
+    assert "occupation=doctor" in prompt.compose_system(edited, _ctx())
@@ -0,0 +1,42 @@
+import time
+
+from api.withme.services.retrieval import VectorBatcher, rerank
+
+
+def _vec(i):
+    return {"id": f"message:{i}", "values": [0.0], "metadata": {}}
+
+
+def test_batcher_coalesces_within_window():
+    batches = []
+    b = VectorBatcher(batches.append, max_batch=100, window_s=0.05)
+    for i in range(5):
+        b.add([_vec(i)])
+    assert batches == []
+    time.sleep(0.2)
+    assert len(batches) == 1 and len(batches[0]) == 5
+
+
+def test_batcher_flushes_when_full_and_on_demand():
+    batches = []
+    b = VectorBatcher(batches.append, max_batch=3, window_s=10)
+    b.add([_vec(i) for i in range(3)])
+    deadline = time.time() + 2
+    while not batches and time.time() < deadline:
+        time.sleep(0.01)
+    assert [len(x) for x in batches] == [3]
+    b.add([_vec(9)])
+    assert b.flush() == 1
+    assert [len(x) for x in batches] == [3, 1]
+
+
+def test_rerank_prefers_recent_on_near_ties_and_dedupes():
+    now = 1_000_000.0
+    hits = [
+        {"id": "a", "score": 0.80, "metadata": {"content": "old", "ts": now - 90 * 86400}},
+        {"id": "b", "score": 0.79, "metadata": {"content": "fresh", "ts": now - 60}},
+        {"id": "c", "score": 0.78, "metadata": {"content": "fresh", "ts": now - 60}},
+        {"id": "d", "score": 0.50, "metadata": {"content": "weak", "ts": now}},
+    ]
+    out = rerank(hits, top_k=2, now=now)
+    assert [h["id"] for h in out] == ["b", "a"]
@@ -0,0 +1,58 @@
+import asyncio
+import time
+
+import jwt
+
+from api.withme import security
+
+
+def test_verified_claims_are_cached_until_exp(monkeypatch):
+    from api.withme.config import get_settings
+
+    monkeypatch.setattr(get_settings(), "supabase_jwt_secret", "test-secret-0123456789abcdef0123456789")
+    monkeypatch.setattr(security, "_claims", None)
+    token = jwt.encode({"sub": "u1", "exp": int(time.time()) + 60}, "test-secret-0123456789abcdef0123456789", algorithm="HS256")
+    assert asyncio.run(security._decode_supabase_jwt(token))["sub"] == "u1"
+    # served from the LRU: no re-verification against the (now different) secret
+    monkeypatch.setattr(get_settings(), "supabase_jwt_secret", "rotated-secret-0123456789abcdef012345678")
+    assert asyncio.run(security._decode_supabase_jwt(token))["sub"] == "u1"
+    security._claims_cache()._lru[security._ClaimsCache.key(token)] = (time.time() - 1, {"sub": "u1"})
+    assert asyncio.run(security._decode_supabase_jwt(token)) is None
+
+
+def test_jwks_unknown_kid_fetches_once_for_concurrent_callers():
+    cache = security._JwksCache()
+    fetches = []
+
+    async def fake_fetch(url):
+        fetches.append(url)
+        await asyncio.sleep(0.05)
+        cache.keys = {"k1": object()}
+        cache.fetched_at = time.time()
+
+    cache._fetch = fake_fetch
+
+    async def main():
+        return await asyncio.gather(*(cache.get("https://x/keys", "k1") for _ in range(10)))
+
+    assert all(k is not None for k in asyncio.run(main()))
+    assert len(fetches) == 1
+
+
+def test_jwks_past_max_stale_waits_for_refresh_instead_of_rejecting():
+    from api.withme.config import get_settings
+
+    cache = security._JwksCache()
+    key = object()
+    cache.keys, cache.fetched_at = {"k1": key}, time.time() - get_settings().jwks_max_stale_s - 60
+    fetches = []
+
+    async def fake_fetch(url):
+        fetches.append(url)
+        if len(fetches) == 1:
+            cache.fetched_at = time.time()  # refresh succeeded; same key still published
+
+    cache._fetch = fake_fetch
+    assert asyncio.run(cache.get("https://x/keys", "k1")) is key
+    cache.fetched_at = time.time() - get_settings().jwks_max_stale_s - 60
+    assert asyncio.run(cache.get("https://x/keys", "k1")) is None  # refresh failed: still too stale
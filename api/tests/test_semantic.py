@@ -0,0 +1,101 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from api.withme.models import Message, SemanticMemory
+from api.withme.services import semantic
+
+
+T0 = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def _msg(agent, minutes, text=None, role="user"):
+    return Message(id=uuid.uuid4(), user_id=agent.user_id, agent_id=agent.id, role=role, text=text,
+                   image_url=None if text else "u", created_at=T0 + timedelta(minutes=minutes))
+
+
+def _memories(db, agent):
+    return sorted((m for m in db.all(SemanticMemory) if m.agent_id == agent.id), key=lambda m: m.updated_at)
+
+
+def _configure(monkeypatch, prompts):
+    from api.withme.config import get_settings
+
+    class _Provider:
+        async def achat(self, system, messages):
+            prompts.append(messages[0]["content"])
+            return "- likes tea\n- moved to Lisbon"
+
+    monkeypatch.setattr(get_settings(), "openai_api_key", "test")
+    monkeypatch.setattr(semantic, "OpenAIProvider", _Provider)
+
+
+def test_summarize_merges_the_newest_window_into_the_memory(db, monkeypatch):
+    prompts = []
+    _configure(monkeypatch, prompts)
+    agent = db.add_agent()
+    seen, tied = _msg(agent, 0, "seen"), _msg(agent, 0, "same instant")
+    seen.id, tied.id = sorted((seen.id, tied.id))
+    db.add(seen, tied, _msg(agent, 1, "old backlog"), _msg(agent, 5, "I moved to Lisbon"),
+           _msg(agent, 9, "Lisbon is sunny"))
+    # Watermark on `seen`: a message at the same instant with a larger id is still new
+    last = SemanticMemory(agent_id=agent.id, content="- likes tea", updated_at=T0,
+                          last_message_at=seen.created_at, last_message_id=seen.id)
+
+    msgs = asyncio.run(semantic._load_delta(db.session, agent.id, last))
+    assert [m.text for m in msgs] == ["same instant", "old backlog", "I moved to Lisbon", "Lisbon is sunny"]
+    msgs = asyncio.run(semantic._load_delta(db.session, agent.id, last, max_messages=2))
+    assert [m.text for m in msgs] == ["I moved to Lisbon", "Lisbon is sunny"]  # newest window, oldest first
+    asyncio.run(semantic._summarize(last, msgs))
+    assert prompts[0].startswith("Existing memory:\n- likes tea")
+    assert prompts[0].index("I moved to Lisbon") < prompts[0].index("Lisbon is sunny")
+
+
+def test_refresh_holds_no_session_across_llm_calls(db, monkeypatch):
+    prompts, calls = [], []
+    _configure(monkeypatch, prompts)
+    monkeypatch.setattr(semantic, "session_scope", db.scope())
+
+    async def embed(mem):
+        calls.append(("embed", db.open_scopes))
+
+    async def acquire():
+        calls.append(("acquire", db.open_scopes, len(_memories(db, agent))))
+
+    monkeypatch.setattr(semantic, "embed_memory", embed)
+    agent = db.add_agent()
+    hi = _msg(agent, 1, "hi")
+    db.add(hi)
+
+    assert asyncio.run(semantic.maybe_update_semantic_memory(agent.id, acquire=acquire)) is True
+    # No session open for either LLM call; the row was written before the embedding token
+    assert calls == [("acquire", 0, 0), ("acquire", 0, 1), ("embed", 0)]
+    [row] = _memories(db, agent)
+    assert row.content.startswith("- likes tea") and row.last_message_id == hi.id
+    assert asyncio.run(semantic.maybe_update_semantic_memory(agent.id)) is False  # refreshed too recently
+
+
+def test_image_only_delta_advances_the_watermark_without_a_summary(db, monkeypatch):
+    prompts = []
+    _configure(monkeypatch, prompts)
+    monkeypatch.setattr(semantic, "session_scope", db.scope())
+
+    # First memory for the agent: a watermark-only row so it stops being due
+    agent = db.add_agent()
+    photo = _msg(agent, 1)
+    db.add(photo)
+    assert asyncio.run(semantic.maybe_update_semantic_memory(agent.id)) is False
+    [row] = _memories(db, agent)
+    assert row.content == "" and row.last_message_id == photo.id
+
+    # An existing memory keeps its content and only moves the watermark
+    agent = db.add_agent()
+    old = T0 - timedelta(days=2)
+    db.add(SemanticMemory(agent_id=agent.id, content="- likes tea", updated_at=old, last_message_at=old))
+    photo = _msg(agent, 1)
+    db.add(photo)
+    assert asyncio.run(semantic.maybe_update_semantic_memory(agent.id)) is False
+    [row] = _memories(db, agent)
+    assert (row.content, row.last_message_id) == ("- likes tea", photo.id)
+    assert row.last_message_at == photo.created_at
+    assert prompts == []
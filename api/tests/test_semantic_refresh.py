@@ -0,0 +1,123 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from fastapi.testclient import TestClient
+
+from api.main import app
+from api.withme import jobs, ratelimit
+from api.withme.models import Message, SemanticMemory
+from api.withme.services import retrieval, semantic, semantic_refresh
+from api.withme.services.semantic_refresh import shard
+
+
+NOW = datetime.now(timezone.utc)
+
+
+def test_shard_splits_evenly_with_remainder():
+    assert shard(list(range(7)), 3) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert shard([], 3) == []
+
+
+class _Redis:
+    """Just enough of redis for plan_refresh's progress hash."""
+
+    def __init__(self):
+        self.hashes: dict[str, dict] = {}
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        self.hashes.setdefault(key, {}).update(mapping or {field: value})
+
+    def hincrby(self, key, field, n):
+        h = self.hashes.setdefault(key, {})
+        h[field] = int(h.get(field, 0)) + n
+
+    def expire(self, key, ttl):
+        pass
+
+    def execute(self):
+        pass
+
+
+def _seed(db):
+    """One agent per case; returns {case: agent_id}."""
+    def msg(agent, minutes_ago):
+        m = Message(id=uuid.uuid4(), user_id=agent.user_id, agent_id=agent.id, role="user", text="I moved to Lisbon",
+                    created_at=NOW - timedelta(minutes=minutes_ago))
+        db.add(m)
+        return m
+
+    def memory(agent, updated, last=None):
+        db.add(SemanticMemory(agent_id=agent.id, content="- likes tea", updated_at=updated,
+                              last_message_at=last.created_at if last else None,
+                              last_message_id=last.id if last else None))
+
+    old = NOW - timedelta(days=2)
+    cases = {name: db.add_agent() for name in ("never", "new_since", "caught_up", "recent", "silent")}
+    msg(cases["never"], 5)
+    memory(cases["new_since"], old, msg(cases["new_since"], 60 * 24 * 3))
+    msg(cases["new_since"], 5)
+    memory(cases["caught_up"], old, msg(cases["caught_up"], 60 * 24 * 3))
+    msg(cases["recent"], 5)
+    memory(cases["recent"], NOW - timedelta(hours=1))
+    return {name: a.id for name, a in cases.items()}
+
+
+def test_plan_refresh_enqueues_only_due_agents(db, monkeypatch):
+    from api.withme.config import get_settings
+
+    ids = _seed(db)
+    enqueued, redis = [], _Redis()
+    monkeypatch.setattr(get_settings(), "cron_batch_size", 1)  # one keyset batch per due agent
+    monkeypatch.setattr(semantic_refresh, "session_scope", db.scope())
+    monkeypatch.setattr(jobs, "get_redis", lambda: redis)
+    monkeypatch.setattr(jobs, "enqueue_many", lambda func, args, queue: enqueued.extend(args))
+
+    plan = asyncio.run(semantic_refresh.plan_refresh())
+    assert (plan["agents"], plan["shards"]) == (2, 2)
+    assert sorted(a for part, _ in enqueued for a in part) == sorted(str(ids[k]) for k in ("never", "new_since"))
+    progress = redis.hashes[semantic_refresh.progress_key(plan["run_id"])]
+    assert (progress["agents"], progress["shards"], progress["planned"]) == (2, 2, 1)
+
+
+def test_refresh_agents_advances_the_watermark_of_due_agents(db, monkeypatch):
+    from api.withme.config import get_settings
+
+    ids = _seed(db)
+
+    class _Provider:
+        async def achat(self, system, messages):
+            return "- likes tea\n- moved to Lisbon"
+
+    class _Bucket:
+        async def acquire(self):
+            return True
+
+    async def embed(mem):
+        pass
+
+    monkeypatch.setattr(get_settings(), "openai_api_key", "test")
+    monkeypatch.setattr(semantic, "OpenAIProvider", _Provider)
+    monkeypatch.setattr(semantic, "embed_memory", embed)
+    monkeypatch.setattr(semantic, "session_scope", db.scope())
+    monkeypatch.setattr(ratelimit, "llm_bucket", lambda: _Bucket())
+    monkeypatch.setattr(retrieval, "flush_pending", lambda: 0)
+
+    counts = asyncio.run(semantic_refresh.refresh_agents([str(i) for i in ids.values()]))
+    assert counts == {"updated": 2, "skipped": 3, "failed": 0}
+    for name in ("never", "new_since"):
+        newest = max((m for m in db.all(Message) if m.agent_id == ids[name]), key=lambda m: m.created_at)
+        latest = max((m for m in db.all(SemanticMemory) if m.agent_id == ids[name]), key=lambda m: m.updated_at)
+        assert latest.content.endswith("moved to Lisbon")
+        assert (latest.last_message_at, latest.last_message_id) == (newest.created_at, newest.id)
+    # Nothing is due any more
+    assert asyncio.run(semantic_refresh.refresh_agents([str(i) for i in ids.values()]))["updated"] == 0
+
+
+def test_refresh_endpoints_require_cron_token():
+    client = TestClient(app)
+    assert client.post("/cron/semantic_refresh").status_code == 403
+    assert client.get("/cron/semantic_refresh/abc").status_code == 403
@@ -0,0 +1,81 @@
+import asyncio
+import gzip
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from api.withme.services import storage
+
+PAYLOAD = b"\x89PNG" + b"x" * 200_000
+
+
+def _serve(seen):
+    class H(BaseHTTPRequestHandler):
+        def log_message(self, *a):
+            pass
+
+        def do_GET(self):
+            body = b'[{"name": "agent-avatars"}]' if self.path == "/storage/v1/bucket" else PAYLOAD
+            seen.append(("GET", self.path))
+            self.send_response(200)
+            self.send_header("content-type", "application/json" if self.path.startswith("/storage") else "image/png")
+            if self.path == "/gzip.png":
+                body = gzip.compress(body)
+                self.send_header("content-encoding", "gzip")
+            self.send_header("content-length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            if self.headers.get("transfer-encoding") == "chunked":
+                data = b""
+                while True:
+                    n = int(self.rfile.readline().strip(), 16)
+                    data += self.rfile.read(n)
+                    self.rfile.readline()
+                    if not n:
+                        break
+            else:
+                data = self.rfile.read(int(self.headers["content-length"]))
+            seen.append(("POST", self.headers.get("transfer-encoding"), data == PAYLOAD))
+            self.send_response(200)
+            self.send_header("content-length", "2")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), H)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+
+def test_upload_streams_with_length_and_caches_bucket(monkeypatch):
+    from api.withme.config import get_settings
+
+    seen = []
+    srv = _serve(seen)
+    base = f"http://127.0.0.1:{srv.server_port}"
+    monkeypatch.setattr(get_settings(), "supabase_url", base)
+    monkeypatch.setattr(get_settings(), "supabase_service_role_key", "k")
+    monkeypatch.setattr(storage, "_known_buckets", set())
+    try:
+        assert storage.upload_public_image_from_url(f"{base}/img.png", object_path="a.png").endswith("/agent-avatars/a.png")
+        assert asyncio.run(storage.aupload_public_image_from_url(f"{base}/img.png", object_path="b.png"))
+    finally:
+        srv.shutdown()
+    assert seen.count(("GET", "/storage/v1/bucket")) == 1
+    assert [s for s in seen if s[0] == "POST"] == [("POST", None, True)] * 2
+
+
+def test_async_upload_decodes_content_encoded_source(monkeypatch):
+    from api.withme.config import get_settings
+
+    seen = []
+    srv = _serve(seen)
+    base = f"http://127.0.0.1:{srv.server_port}"
+    monkeypatch.setattr(get_settings(), "supabase_url", base)
+    monkeypatch.setattr(get_settings(), "supabase_service_role_key", "k")
+    monkeypatch.setattr(storage, "_known_buckets", {"agent-avatars"})
+    try:
+        assert asyncio.run(storage.aupload_public_image_from_url(f"{base}/gzip.png", object_path="c.png"))
+    finally:
+        srv.shutdown()
+    assert [s for s in seen if s[0] == "POST"] == [("POST", "chunked", True)]  # decoded image bytes
@@ -0,0 +1,61 @@
+import numpy as np
+
+from api.withme.services.vectorstore import LocalVectorStore
+
+
+def _vecs(n, dim=16, agent="a1", seed=0):
+    rng = np.random.default_rng(seed)
+    data = rng.normal(size=(n, dim)).astype(np.float32)
+    return data, [
+        {"id": f"message:{i}", "values": data[i].tolist(), "metadata": {"agent_id": agent, "type": "message", "i": i}}
+        for i in range(n)
+    ]
+
+
+def test_exact_topk_is_agent_partitioned_and_persistent(tmp_path):
+    data, vectors = _vecs(50)
+    store = LocalVectorStore(str(tmp_path))
+    store.upsert(vectors)
+    store.upsert(_vecs(5, agent="a2", seed=1)[1])
+    hits = store.query(data[7].tolist(), top_k=3, agent_id="a1")
+    assert hits[0]["id"] == "message:7"
+    assert all(h["metadata"]["agent_id"] == "a1" for h in hits)
+    assert hits[0]["score"] >= hits[1]["score"] >= hits[2]["score"]
+
+    reopened = LocalVectorStore(str(tmp_path))
+    assert reopened.query(data[7].tolist(), top_k=1, agent_id="a1")[0]["id"] == "message:7"
+
+
+def test_upsert_overwrites_and_filters(tmp_path):
+    data, vectors = _vecs(10)
+    store = LocalVectorStore(str(tmp_path))
+    store.upsert(vectors)
+    store.upsert([{"id": "message:3", "values": data[5].tolist(), "metadata": {"agent_id": "a1", "type": "semantic"}}])
+    hits = store.query(data[5].tolist(), top_k=10, agent_id="a1", filter={"type": "semantic"})
+    assert [h["id"] for h in hits] == ["message:3"]
+
+
+def test_ivf_path_finds_exact_match(tmp_path):
+    data, vectors = _vecs(400, dim=8)
+    store = LocalVectorStore(str(tmp_path), ivf_min_rows=100, nprobe=4)
+    store.upsert(vectors)
+    for i in (0, 123, 399):
+        assert store.query(data[i].tolist(), top_k=1, agent_id="a1")[0]["id"] == f"message:{i}"
+    # rows appended after the IVF build are still searched
+    extra = np.ones(8, dtype=np.float32)
+    store.upsert([{"id": "new", "values": extra.tolist(), "metadata": {"agent_id": "a1"}}])
+    assert store.query(extra.tolist(), top_k=1, agent_id="a1")[0]["id"] == "new"
+
+
+def test_processes_sharing_a_root_see_each_others_writes(tmp_path):
+    data, vectors = _vecs(100)
+    api, worker = LocalVectorStore(str(tmp_path)), LocalVectorStore(str(tmp_path))
+    api.upsert(vectors[:10])
+    assert worker.query(data[3].tolist(), top_k=1, agent_id="a1")[0]["id"] == "message:3"
+
+    worker.upsert(vectors[10:])  # grows the vector file past the api's mapping
+    api.upsert([{"id": "message:5", "values": data[5].tolist(), "metadata": {"agent_id": "a1", "type": "semantic"}}])
+    for store in (api, worker):
+        assert store.query(data[80].tolist(), top_k=1, agent_id="a1")[0]["id"] == "message:80"
+        assert store.query(data[5].tolist(), top_k=1, agent_id="a1")[0]["metadata"]["type"] == "semantic"
+    assert len((tmp_path / "a1" / "log.jsonl").read_text().splitlines()) == 1 + 100 + 1  # dim + rows + overwrite
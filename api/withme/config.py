@@ -20,10 +20,101 @@ class Settings(BaseSettings):
     supabase_anon_key: str | None = None
     supabase_service_role_key: str | None = None
     redis_url: str | None = "redis://localhost:6379/0"
+    # One shared pool per process (queues, rate limits, progress hashes)
+    redis_max_connections: int = 50
+    redis_socket_timeout_s: float = 5.0
     fal_api_key: str | None = Field(default=None, env=["FAL_API_KEY", "FALAI_API_KEY"])
     fcm_server_key: str | None = None
     cron_token: str | None = None
 
+    # Postgres pool (size + overflow per process must fit max_connections across pods)
+    db_pool_size: int = 10
+    db_max_overflow: int = 10
+    db_pool_timeout_s: float = 10.0
+    db_pool_recycle_s: int = 1800
+    db_pool_pre_ping: bool = False
+    db_statement_cache_size: int = 100
+    db_statement_timeout_ms: int = 15_000
+    db_idle_in_tx_timeout_ms: int = 60_000
+
+    # OpenAI client pool (shared per process); base URL override points at a proxy or the bench stub
+    openai_base_url: str | None = None
+    openai_max_connections: int = 50
+    openai_max_keepalive: int = 20
+    openai_timeout_s: float = 60.0
+    openai_connect_timeout_s: float = 5.0
+    openai_max_retries: int = 2
+
+    # Embedding cache: in-process LRU, optionally backed by shared Redis
+    embed_cache_size: int = 10_000
+    embed_cache_ttl_s: float = 3600.0
+    embed_cache_redis: bool = False
+    embed_cache_redis_ttl_s: int = 86_400
+
+    # Post-turn background pipeline (embeddings, semantic memory)
+    pipeline_workers: int = 2
+    pipeline_max_queue: int = 1000
+
+    # Vector store backend: "pinecone" (SaaS) or "local" (numpy memmap under vector_store_dir)
+    vector_backend: str = "pinecone"
+    vector_store_dir: str = ".vectors"
+    vector_ivf_min_rows: int = 20_000
+    vector_ivf_nprobe: int = 8
+
+    # Semantic recall (agent-scoped): hits used in the prompt, over-fetch factor, recency blend
+    semantic_top_k: int = 3
+    semantic_overfetch: int = 4
+    semantic_recency_weight: float = 0.05
+    semantic_recency_half_life_h: float = 72.0
+    # Budget for recall inside build_context; on timeout the turn proceeds without hints
+    context_semantic_timeout_ms: int = 800
+
+    # Vector upsert batching (services/retrieval.py)
+    vector_batch_size: int = 100
+    vector_batch_window_ms: int = 250
+
+    # Image jobs: Fal calls back to PUBLIC_BASE_URL/webhooks/fal; the poller covers missed webhooks
+    public_base_url: str | None = None
+    fal_queue_url: str = "https://queue.fal.run"
+    fal_webhook_token: str | None = None
+    image_poll_interval_s: float = 15.0
+    image_poll_grace_s: float = 30.0
+    image_job_timeout_s: float = 600.0
+    # Selfie result cache: entries younger than the TTL are reused; while a bucket has fewer
+    # than IMAGE_CACHE_VARIANTS images, a request still generates with probability FRESH_P
+    image_cache_enabled: bool = True
+    image_cache_ttl_h: float = 72.0
+    image_cache_variants: int = 3
+    image_cache_fresh_p: float = 0.3
+    image_cache_max_per_agent: int = 32
+    # Chat history sent to the model: token budget for past turns plus recalled memories,
+    # how many recent rows to load, and the budget share semantic hits may take
+    history_token_budget: int = 1500
+    history_max_messages: int = 60
+    history_semantic_share: float = 0.25
+
+    # Cron sweeps: agents per keyset batch (one short transaction each)
+    cron_batch_size: int = 1000
+    # Semantic refresh fan-out: agents per worker task, refresh interval, global LLM budget
+    semantic_refresh_shard_size: int = 50
+    semantic_refresh_interval_h: int = 24
+    llm_rate_per_s: float = 5.0
+    llm_burst: int = 10
+
+    # Auth: JWKS freshness / stale-serving window and verified-claims LRU size
+    jwks_ttl_s: float = 300.0
+    jwks_max_stale_s: float = 86_400.0
+    auth_claims_cache_size: int = 10_000
+    # Seconds a user id stays in the per-process "exists in DB" set (skips the users lookup)
+    user_cache_ttl_s: float = 300.0
+
+    # Worker: "rq" (one job per process) or "async" (worker/aio.py, many jobs per loop)
+    worker_mode: str = "rq"
+    worker_concurrency: int = 32
+    worker_drain_timeout_s: float = 30.0
+    # Queues a worker drains, highest priority first (see jobs.PRIORITY)
+    worker_queues: str = "interactive,base,background,default"
+
     # API behavior
     image_affinity_threshold: float = 0.60
     initiation_daily_cap: int = 2
@@ -8,6 +8,7 @@ from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from .models import User, UserDevice, Agent, Message
+from .services.history import acount_tokens
 
 
 async def get_or_create_user(session: AsyncSession, user_id: uuid.UUID, email: str) -> User:
@@ -46,23 +47,23 @@ async def get_agent_for_user(session: AsyncSession, user: User, agent_id: uuid.U
     return await get_or_create_agent(session, user)
 
 
-async def upsert_device(session: AsyncSession, user: User, platform: str, token: str) -> UserDevice:
+async def upsert_device(session: AsyncSession, user_id: uuid.UUID, platform: str, token: str) -> UserDevice:
     res = await session.execute(
-        select(UserDevice).where(UserDevice.user_id == user.id, UserDevice.fcm_token == token)
+        select(UserDevice).where(UserDevice.user_id == user_id, UserDevice.fcm_token == token)
     )
     device = res.scalars().first()
     if device:
         device.platform = platform
         device.last_seen_at = datetime.utcnow()
     else:
-        device = UserDevice(user_id=user.id, platform=platform, fcm_token=token, last_seen_at=datetime.utcnow())
+        device = UserDevice(user_id=user_id, platform=platform, fcm_token=token, last_seen_at=datetime.utcnow())
         session.add(device)
     await session.flush()
     return device
 
 
 async def create_message(session: AsyncSession, user_id: uuid.UUID, agent_id: uuid.UUID, role: str, text: Optional[str] = None, image_url: Optional[str] = None) -> Message:
-    msg = Message(user_id=user_id, agent_id=agent_id, role=role, text=text, image_url=image_url)
+    msg = Message(user_id=user_id, agent_id=agent_id, role=role, text=text, image_url=image_url, token_count=await acount_tokens(text))
     session.add(msg)
     await session.flush()
     return msg
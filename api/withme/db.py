@@ -1,8 +1,11 @@
 from __future__ import annotations
 
+import time
 from contextlib import asynccontextmanager
-from typing import AsyncIterator
+from typing import Any, AsyncIterator
 
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base
 
@@ -15,15 +18,75 @@ Base = declarative_base()
 _engine = None
 _sessionmaker: async_sessionmaker[AsyncSession] | None = None
 
+# Connection checkout timing, measured in session_scope
+_checkout = {"count": 0, "wait_ms_total": 0.0, "wait_ms_max": 0.0, "slow": 0, "timeouts": 0}
+SLOW_CHECKOUT_MS = 100.0
+
 
 def get_engine():
     global _engine
     if _engine is None:
         settings = get_settings()
-        _engine = create_async_engine(settings.database_url, pool_pre_ping=True)
+        kwargs: dict[str, Any] = {}
+        if settings.database_url.startswith("postgresql+asyncpg"):
+            kwargs["connect_args"] = {
+                # asyncpg prepared-statement cache; set DB_STATEMENT_CACHE_SIZE=0 behind pgbouncer (transaction mode)
+                "statement_cache_size": settings.db_statement_cache_size,
+                "server_settings": {
+                    "application_name": "withme",
+                    "statement_timeout": str(settings.db_statement_timeout_ms),
+                    "idle_in_transaction_session_timeout": str(settings.db_idle_in_tx_timeout_ms),
+                },
+            }
+        _engine = create_async_engine(
+            settings.database_url,
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_max_overflow,
+            pool_timeout=settings.db_pool_timeout_s,
+            # Recycling retires connections before server/LB idle cuts, which is what
+            # pre-ping guarded against, without a round-trip on every checkout.
+            pool_recycle=settings.db_pool_recycle_s,
+            pool_pre_ping=settings.db_pool_pre_ping,
+            pool_use_lifo=True,
+            **kwargs,
+        )
+        _track_connects(_engine.sync_engine)
     return _engine
 
 
+def _track_connects(engine: Any) -> None:
+    # Time spent opening new DBAPI connections, kept on the connection record so
+    # session_scope can take it out of the checkout wait (which is pool queueing only)
+    @event.listens_for(engine, "do_connect")
+    def _connect_start(dialect, conn_rec, cargs, cparams):
+        conn_rec.info["connect_t0"] = time.perf_counter()
+
+    @event.listens_for(engine.pool, "connect")
+    def _connect_done(dbapi_conn, conn_rec):
+        t0 = conn_rec.info.pop("connect_t0", None)
+        if t0 is not None:
+            conn_rec.info["connect_ms"] = (time.perf_counter() - t0) * 1000
+
+
+def pool_stats() -> dict[str, Any]:
+    """Pool occupancy and checkout wait, for /health."""
+    n = _checkout["count"]
+    out: dict[str, Any] = {
+        "checkouts": n,
+        "wait_ms_avg": round(_checkout["wait_ms_total"] / n, 2) if n else 0.0,
+        "wait_ms_max": round(_checkout["wait_ms_max"], 2),
+        "slow_checkouts": _checkout["slow"],
+        "timeouts": _checkout["timeouts"],
+    }
+    if _engine is not None:
+        pool = _engine.pool
+        for name in ("size", "checkedin", "checkedout", "overflow"):
+            fn = getattr(pool, name, None)
+            if callable(fn):
+                out[name] = fn()
+    return out
+
+
 def get_sessionmaker() -> async_sessionmaker[AsyncSession]:
     global _sessionmaker
     if _sessionmaker is None:
@@ -35,6 +98,22 @@ def get_sessionmaker() -> async_sessionmaker[AsyncSession]:
 async def session_scope() -> AsyncIterator[AsyncSession]:
     Session = get_sessionmaker()
     async with Session() as session:
+        # Check out the connection up front so pool wait is measured
+        t0 = time.perf_counter()
+        try:
+            conn = await session.connection()
+        except PoolTimeoutError:
+            _checkout["timeouts"] += 1
+            raise
+        wait_ms = (time.perf_counter() - t0) * 1000
+        # A checkout that had to open a connection also paid for the connect: not queueing
+        raw = await conn.get_raw_connection()
+        wait_ms = max(0.0, wait_ms - raw.info.pop("connect_ms", 0.0))
+        _checkout["count"] += 1
+        _checkout["wait_ms_total"] += wait_ms
+        _checkout["wait_ms_max"] = max(_checkout["wait_ms_max"], wait_ms)
+        if wait_ms > SLOW_CHECKOUT_MS:
+            _checkout["slow"] += 1
         try:
             yield session
             await session.commit()
@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Optional
+
+from fastapi import Depends, Header
+from sqlalchemy import case, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import crud
+from .config import get_settings
+from .db import session_scope
+from .models import Agent, User
+from .security import get_current_user
+
+
+class _KnownUsers:
+    """Per-process TTL set of user ids seen in the database.
+
+    Only ids read back from the DB are recorded (never ones created in the
+    current, possibly rolled-back, transaction).
+    """
+
+    def __init__(self, ttl_s: float = 300.0, max_entries: int = 50_000):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._seen: OrderedDict[uuid.UUID, float] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, user_id: uuid.UUID) -> bool:
+        with self._lock:
+            exp = self._seen.get(user_id)
+            if exp is None:
+                return False
+            if exp < time.monotonic():
+                del self._seen[user_id]
+                return False
+            return True
+
+    def add(self, user_id: uuid.UUID) -> None:
+        with self._lock:
+            self._seen[user_id] = time.monotonic() + self.ttl_s
+            self._seen.move_to_end(user_id)
+            # Oldest first in insertion order, so only the stalest ids fall back to the DB
+            while len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+
+    def discard(self, user_id: uuid.UUID) -> None:
+        with self._lock:
+            self._seen.pop(user_id, None)
+
+
+_known_users: _KnownUsers | None = None
+
+
+def known_users() -> _KnownUsers:
+    global _known_users
+    if _known_users is None:
+        _known_users = _KnownUsers(ttl_s=get_settings().user_cache_ttl_s)
+    return _known_users
+
+
+def parse_agent_id(raw: Optional[str]) -> Optional[uuid.UUID]:
+    try:
+        return uuid.UUID(raw) if raw else None
+    except Exception:
+        return None
+
+
+async def ensure_user(session: AsyncSession, user_id: uuid.UUID, email: str, for_write: bool = False) -> None:
+    """Make sure the users row exists; free for reads when the id was seen recently.
+
+    A cached id can outlive its row (e.g. an admin reset), so callers about to
+    insert rows referencing the user pass `for_write` to re-check, and re-create, it.
+    """
+    cache = known_users()
+    if user_id in cache and not for_write:
+        return
+    existing = await session.get(User, user_id)
+    if existing is not None:
+        cache.add(user_id)
+        return
+    cache.discard(user_id)
+    await crud.get_or_create_user(session, user_id=user_id, email=email)
+
+
+async def resolve_user_agent(
+    session: AsyncSession, user_id: uuid.UUID, email: str, agent_id: Optional[uuid.UUID] = None
+) -> tuple[uuid.UUID, Agent]:
+    """User + agent in one query: the requested agent if it is the user's, else their first.
+
+    Same outcome as get_or_create_user + get_agent_for_user, including creating
+    the user and a default agent on first contact.
+    """
+    preferred = case((Agent.id == agent_id, 0), else_=1) if agent_id else None
+    order: list[Any] = [Agent.created_at.asc(), Agent.id.asc()]
+    if preferred is not None:
+        order.insert(0, preferred)
+    cache = known_users()
+    if user_id in cache:
+        res = await session.execute(select(Agent).where(Agent.user_id == user_id).order_by(*order).limit(1))
+        agent = res.scalars().first()
+        user_exists = True
+    else:
+        joined = await session.execute(
+            select(User.id, Agent)
+            .outerjoin(Agent, Agent.user_id == User.id)
+            .where(User.id == user_id)
+            .order_by(*order)
+            .limit(1)
+        )
+        row = joined.first()
+        user_exists = row is not None
+        agent = row[1] if row else None
+        if user_exists:
+            cache.add(user_id)
+    if agent is not None:
+        return user_id, agent
+    # Also covers a cached id whose users row has since been deleted
+    user = await crud.get_or_create_user(session, user_id=user_id, email=email)
+    return user_id, await crud.get_or_create_agent(session, user)
+
+
+async def get_session() -> AsyncIterator[AsyncSession]:
+    async with session_scope() as session:
+        yield session
+
+
+@dataclass
+class RequestContext:
+    session: AsyncSession
+    user_id: uuid.UUID
+    email: str
+    agent: Agent
+
+
+@dataclass
+class UserContext:
+    session: AsyncSession
+    user_id: uuid.UUID
+    email: str
+
+
+# scope="function": the session commits when the endpoint returns, before the
+# response is sent, so commit errors still reach the client.
+async def get_user_context(
+    user=Depends(get_current_user),
+    session: AsyncSession = Depends(get_session, scope="function"),
+) -> UserContext:
+    user_id = uuid.UUID(str(user["id"]))
+    email = user.get("email", "dev@example.com")
+    # Its endpoints write rows referencing the user (devices)
+    await ensure_user(session, user_id, email, for_write=True)
+    return UserContext(session=session, user_id=user_id, email=email)
+
+
+async def get_request_context(
+    user=Depends(get_current_user),
+    session: AsyncSession = Depends(get_session, scope="function"),
+    x_agent_id: str | None = Header(default=None, alias="X-Agent-ID"),
+) -> RequestContext:
+    user_id = uuid.UUID(str(user["id"]))
+    email = user.get("email", "dev@example.com")
+    _, agent = await resolve_user_agent(session, user_id, email, parse_agent_id(x_agent_id))
+    return RequestContext(session=session, user_id=user_id, email=email, agent=agent)
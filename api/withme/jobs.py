@@ -1,14 +1,132 @@
 from __future__ import annotations
 
-from redis import Redis
+from typing import Any, Iterable, Optional
+
+from redis import ConnectionPool, Redis
 from rq import Queue
+from rq.exceptions import NoSuchJobError
+from rq.job import Job, JobStatus
+from rq.utils import now, utcparse
 
 from .config import get_settings
 
 
-def get_queue(name: str = "default") -> Queue:
-    settings = get_settings()
-    redis_url = settings.redis_url or "redis://localhost:6379/0"
-    conn = Redis.from_url(redis_url)
-    return Queue(name, connection=conn)
+# Queues in the order workers drain them: a worker always takes from the first
+# non-empty queue, so interactive edits never wait behind base-image backfills.
+# "default" stays last so jobs enqueued before the split still run.
+QUEUE_INTERACTIVE = "interactive"
+QUEUE_BASE = "base"
+QUEUE_BACKGROUND = "background"
+QUEUE_DEFAULT = "default"
+PRIORITY = (QUEUE_INTERACTIVE, QUEUE_BASE, QUEUE_BACKGROUND, QUEUE_DEFAULT)
+
+IMAGE_TASK = "worker.tasks.process_image_job"
+
+_pool: ConnectionPool | None = None
+_redis: Redis | None = None
+_queues: dict[str, Queue] = {}
+
+
+def get_pool() -> ConnectionPool:
+    """Process-wide Redis connection pool shared by the queues, rate limits and progress hashes."""
+    global _pool
+    if _pool is None:
+        settings = get_settings()
+        _pool = ConnectionPool.from_url(
+            settings.redis_url or "redis://localhost:6379/0",
+            max_connections=settings.redis_max_connections,
+            socket_timeout=settings.redis_socket_timeout_s,
+            socket_connect_timeout=settings.redis_socket_timeout_s,
+            health_check_interval=30,
+        )
+    return _pool
+
+
+def get_redis() -> Redis:
+    global _redis
+    if _redis is None:
+        _redis = Redis(connection_pool=get_pool())
+    return _redis
+
+
+def get_queue(name: str = QUEUE_DEFAULT) -> Queue:
+    q = _queues.get(name)
+    if q is None or q.connection is not get_redis():
+        q = _queues[name] = Queue(name, connection=get_redis())
+    return q
+
+
+def image_queue(kind: Optional[str]) -> str:
+    """Base portraits are bulk work; edits and generations answer a user and go first."""
+    return QUEUE_BASE if kind == "base" else QUEUE_INTERACTIVE
+
+
+def dispatch(func: str, *args: Any, queue: str = QUEUE_BACKGROUND, **options: Any) -> Job:
+    """Enqueue one task by dotted path onto a priority queue (options go to RQ's enqueue_call)."""
+    return get_queue(queue).enqueue_call(func, args=args, **options)
+
+
+def image_rq_id(job_id: Any) -> str:
+    """Deterministic RQ job id for an image job, so the poller can tell whether its enqueue survived."""
+    return f"image:{job_id}"
+
+
+def enqueue_image_job(job_id: Any, kind: Optional[str]) -> Job:
+    return dispatch(IMAGE_TASK, str(job_id), queue=image_queue(kind), job_id=image_rq_id(job_id))
+
+
+def image_job_pending(job_id: Any) -> bool:
+    """True while the image job's RQ task is waiting or running (blocking Redis call)."""
+    try:
+        job = Job.fetch(image_rq_id(job_id), connection=get_redis())
+    except NoSuchJobError:
+        return False
+    return job.get_status(refresh=False) in (
+        JobStatus.QUEUED, JobStatus.STARTED, JobStatus.DEFERRED, JobStatus.SCHEDULED
+    )
+
+
+def enqueue_many(func: str, arg_list: Iterable[tuple], queue: str = QUEUE_BACKGROUND) -> list[Job]:
+    """Enqueue many calls of one task in a single Redis pipeline."""
+    q = get_queue(queue)
+    return q.enqueue_many([q.prepare_data(func, args) for args in arg_list])
+
+
+def queue_stats(names: Iterable[str] = PRIORITY) -> dict[str, dict[str, Any]]:
+    """Per-queue depth, age of the oldest waiting job, and started/failed counts.
 
+    Two pipelined round trips regardless of the number of queues.
+    """
+    redis = get_redis()
+    queues = [get_queue(n) for n in names]
+    pipe = redis.pipeline(transaction=False)
+    for q in queues:
+        pipe.llen(q.key)
+        pipe.lindex(q.key, 0)  # RQ pushes to the tail, so the head is the oldest
+        pipe.zcard(q.started_job_registry.key)
+        pipe.zcard(q.failed_job_registry.key)
+    raw = pipe.execute()
+    heads = [raw[i * 4 + 1] for i in range(len(queues))]
+    pipe = redis.pipeline(transaction=False)
+    for head in heads:
+        if head:
+            pipe.hget(Job.key_for(head.decode() if isinstance(head, bytes) else head), "enqueued_at")
+    stamps = iter(pipe.execute() if any(heads) else [])
+    enqueued = [next(stamps) if head else None for head in heads]
+    out: dict[str, dict[str, Any]] = {}
+    t = now()
+    for i, q in enumerate(queues):
+        age = None
+        stamp = enqueued[i]
+        if stamp:
+            try:
+                age = round((t - utcparse(stamp.decode() if isinstance(stamp, bytes) else stamp)).total_seconds(), 1)
+            except Exception:
+                age = None
+        out[q.name] = {
+            "depth": int(raw[i * 4]),
+            "oldest_age_s": age,
+            "started": int(raw[i * 4 + 2]),
+            "failed": int(raw[i * 4 + 3]),
+        }
+    return out
@@ -11,10 +11,13 @@ from sqlalchemy import (
     DateTime,
     Float,
     ForeignKey,
+    Index,
+    Integer,
     JSON,
     String,
     Text,
     UniqueConstraint,
+    func,
 )
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import Mapped, mapped_column, relationship
@@ -81,6 +84,8 @@ class Message(Base):
     role: Mapped[str] = mapped_column(String, nullable=False)
     text: Mapped[Optional[str]] = mapped_column(Text)
     image_url: Mapped[Optional[str]] = mapped_column(Text)
+    # Tokens in `text`, counted once on insert; NULL for rows written before the column existed
+    token_count: Mapped[Optional[int]] = mapped_column(Integer)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow, nullable=False)
 
 
@@ -119,6 +124,10 @@ class SemanticMemory(Base):
     agent_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("agents.id", ondelete="CASCADE"))
     content: Mapped[str] = mapped_column(Text, nullable=False)
     updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow, nullable=False)
+    # (created_at, id) of the newest message folded into this memory (incremental refresh watermark);
+    # an empty `content` marks a watermark-only row (nothing to remember yet)
+    last_message_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True))
+    last_message_id: Mapped[Optional[uuid.UUID]] = mapped_column(UUID(as_uuid=True))
 
 
 class AffinityDelta(Base):
@@ -141,9 +150,59 @@ class ImageJob(Base):
     status: Mapped[str] = mapped_column(String, nullable=False)
     kind: Mapped[Optional[str]] = mapped_column(String)  # 'base' | 'gen' | 'edit'
     result_url: Mapped[Optional[str]] = mapped_column(Text)
+    # Fal queue handles, so completion can arrive by webhook or the fallback poller
+    external_id: Mapped[Optional[str]] = mapped_column(String)
+    status_url: Mapped[Optional[str]] = mapped_column(Text)
+    response_url: Mapped[Optional[str]] = mapped_column(Text)
+    # Single-flight key (services.image_jobs.dedupe_key); unique per agent while queued/running
+    dedupe_key: Mapped[Optional[str]] = mapped_column(String)
+    # Context bucket the result is cached under (services.image_cache.cache_key); edits only
+    cache_key: Mapped[Optional[str]] = mapped_column(String)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow, nullable=False)
+    updated_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime(timezone=True), default=datetime.utcnow, server_default=func.now()
+    )
 
     __table_args__ = (
-        CheckConstraint("status in ('queued','running','succeeded','failed')", name="ck_image_jobs_status"),
+        CheckConstraint("status in ('queued','running','finishing','succeeded','failed')", name="ck_image_jobs_status"),
         CheckConstraint("kind is null or kind in ('base','gen','edit')", name="ck_image_jobs_kind"),
     )
+
+
+class ImageCacheEntry(Base):
+    """A finished selfie reusable for the same agent, base image and context bucket."""
+
+    __tablename__ = "image_cache"
+
+    id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid_pk)
+    agent_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("agents.id", ondelete="CASCADE"), nullable=False)
+    cache_key: Mapped[str] = mapped_column(String, nullable=False)
+    url: Mapped[str] = mapped_column(Text, nullable=False)
+    hits: Mapped[int] = mapped_column(BigInteger, default=0, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow, nullable=False)
+    last_used_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow, nullable=False)
+
+
+# Composite indexes for hot-path queries (see alembic 3b4c5d6e7f80)
+Index("ix_messages_agent_created", Message.agent_id, Message.created_at.desc())
+Index("ix_messages_user_agent_created", Message.user_id, Message.agent_id, Message.created_at.desc(), Message.id.desc())
+Index("ix_events_agent_occurred", Event.agent_id, Event.occurred_at.desc())
+Index("ix_scenarios_agent_track", Scenario.agent_id, Scenario.track)
+Index("ix_semantic_memory_agent_updated", SemanticMemory.agent_id, SemanticMemory.updated_at.desc())
+Index("ix_image_jobs_agent_kind_status_created", ImageJob.agent_id, ImageJob.kind, ImageJob.status, ImageJob.created_at.desc())
+Index("ix_agents_user_created", Agent.user_id, Agent.created_at.desc())
+Index("ix_affinity_deltas_message", AffinityDelta.message_id)
+# Image job completion lookups (see alembic 4c5d6e7f8091)
+Index("ix_image_jobs_external_id", ImageJob.external_id)
+Index("ix_image_jobs_status_updated", ImageJob.status, ImageJob.updated_at)
+# Cache lookup by bucket and LRU eviction per agent (see alembic 7f8091a2b3c4)
+Index("ix_image_cache_agent_key_used", ImageCacheEntry.agent_id, ImageCacheEntry.cache_key, ImageCacheEntry.last_used_at)
+Index("ix_image_cache_agent_used", ImageCacheEntry.agent_id, ImageCacheEntry.last_used_at)
+# One in-flight job per (agent, dedupe_key) (see alembic 6e7f8091a2b3, a2b3c4d5e6f7)
+Index(
+    "ux_image_jobs_inflight",
+    ImageJob.agent_id,
+    ImageJob.dedupe_key,
+    unique=True,
+    postgresql_where=ImageJob.status.in_(("queued", "running", "finishing")),
+)
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Any, Optional
+
+from ..config import get_settings
+
+
+Vector = list[float]
+
+
+def cache_key(model: str, text: str) -> str:
+    return f"emb:{model}:{hashlib.sha256(text.encode()).hexdigest()}"
+
+
+def _pack(vec: Vector) -> bytes:
+    return array("f", vec).tobytes()
+
+
+def _unpack(raw: bytes) -> Vector:
+    a = array("f")
+    a.frombytes(raw)
+    return a.tolist()
+
+
+class EmbeddingCache:
+    """Two-tier embedding cache keyed by (model, sha256(text)).
+
+    Tier 1 is an in-process LRU bounded by entry count and TTL. Tier 2 is an
+    optional Redis shared across API and worker pods; vectors are stored as
+    packed float32. Redis failures degrade to a miss and are counted.
+    """
+
+    def __init__(self, max_entries: int = 10_000, ttl_s: float = 3600.0, redis: Any = None, redis_ttl_s: int = 86_400):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.redis = redis
+        self.redis_ttl_s = redis_ttl_s
+        self._lru: OrderedDict[str, tuple[float, Vector]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "redis_hits": 0, "misses": 0, "evictions": 0, "redis_errors": 0}
+
+    def _local_get(self, key: str, now: float) -> Optional[Vector]:
+        item = self._lru.get(key)
+        if item is None:
+            return None
+        expires_at, vec = item
+        if expires_at < now:
+            del self._lru[key]
+            return None
+        self._lru.move_to_end(key)
+        return vec
+
+    def _local_put(self, key: str, vec: Vector, now: float) -> None:
+        self._lru[key] = (now + self.ttl_s, vec)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def get_many(self, model: str, texts: list[str]) -> list[Optional[Vector]]:
+        keys = [cache_key(model, t) for t in texts]
+        now = time.monotonic()
+        with self._lock:
+            out = [self._local_get(k, now) for k in keys]
+        missing = [i for i, v in enumerate(out) if v is None]
+        if missing and self.redis is not None:
+            try:
+                raws = self.redis.mget([keys[i] for i in missing])
+            except Exception:
+                self.counters["redis_errors"] += 1
+                raws = [None] * len(missing)
+            with self._lock:
+                for i, raw in zip(missing, raws):
+                    if raw:
+                        vec = _unpack(raw)
+                        out[i] = vec
+                        self._local_put(keys[i], vec, now)
+                        self.counters["redis_hits"] += 1
+        with self._lock:
+            hits = sum(1 for v in out if v is not None)
+            self.counters["hits"] += hits
+            self.counters["misses"] += len(out) - hits
+        return out
+
+    def put_many(self, model: str, texts: list[str], vecs: list[Vector]) -> None:
+        keys = [cache_key(model, t) for t in texts]
+        now = time.monotonic()
+        with self._lock:
+            for k, v in zip(keys, vecs):
+                self._local_put(k, v, now)
+        if self.redis is not None:
+            try:
+                pipe = self.redis.pipeline(transaction=False)
+                for k, v in zip(keys, vecs):
+                    pipe.set(k, _pack(v), ex=self.redis_ttl_s)
+                pipe.execute()
+            except Exception:
+                self.counters["redis_errors"] += 1
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {**self.counters, "size": len(self._lru), "redis": self.redis is not None}
+
+
+_cache: EmbeddingCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                settings = get_settings()
+                redis = None
+                if settings.embed_cache_redis and settings.redis_url:
+                    try:
+                        from redis import Redis
+
+                        redis = Redis.from_url(settings.redis_url, socket_timeout=0.2)
+                    except Exception:
+                        redis = None
+                _cache = EmbeddingCache(
+                    max_entries=settings.embed_cache_size,
+                    ttl_s=settings.embed_cache_ttl_s,
+                    redis=redis,
+                    redis_ttl_s=settings.embed_cache_redis_ttl_s,
+                )
+    return _cache
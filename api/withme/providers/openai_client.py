@@ -1,36 +1,175 @@
 from __future__ import annotations
 
+import asyncio
+import threading
 from dataclasses import dataclass
-from typing import Iterable
 
-from openai import OpenAI
-from typing import Any
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI, Timeout
+from typing import Any, AsyncIterator
 
 from ..config import get_settings
+from .embedding_cache import EmbeddingCache, get_embedding_cache
+
+try:  # openai 3.x builds its transport on httpx2; pool limits must come from the same package
+    from httpx2 import Limits
+except ImportError:
+    from httpx import Limits  # type: ignore[assignment]
+
+
+# Process-wide clients. The sync client is shared by worker/cron code; the async
+# client is bound to the event loop that created it (httpx pools are loop-bound),
+# so it is rebuilt if a different loop asks for it (e.g. worker asyncio.run calls).
+_sync_client: OpenAI | None = None
+_sync_lock = threading.Lock()
+_async_client: AsyncOpenAI | None = None
+_async_loop: asyncio.AbstractEventLoop | None = None
+
+
+def _limits() -> Limits:
+    settings = get_settings()
+    return Limits(
+        max_connections=settings.openai_max_connections,
+        max_keepalive_connections=settings.openai_max_keepalive,
+    )
+
+
+def _timeout() -> Timeout:
+    settings = get_settings()
+    return Timeout(settings.openai_timeout_s, connect=settings.openai_connect_timeout_s)
+
+
+def get_sync_client() -> OpenAI:
+    global _sync_client
+    settings = get_settings()
+    if not settings.openai_api_key:
+        raise RuntimeError("OPENAI_API_KEY not configured")
+    if _sync_client is None:
+        with _sync_lock:
+            if _sync_client is None:
+                _sync_client = OpenAI(
+                    api_key=settings.openai_api_key,
+                    base_url=settings.openai_base_url or None,
+                    max_retries=settings.openai_max_retries,
+                    timeout=_timeout(),
+                    http_client=DefaultHttpxClient(limits=_limits(), timeout=_timeout()),
+                )
+    return _sync_client
+
+
+def get_async_client() -> AsyncOpenAI:
+    global _async_client, _async_loop
+    settings = get_settings()
+    if not settings.openai_api_key:
+        raise RuntimeError("OPENAI_API_KEY not configured")
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_loop is not loop:
+        _async_client = AsyncOpenAI(
+            api_key=settings.openai_api_key,
+            base_url=settings.openai_base_url or None,
+            max_retries=settings.openai_max_retries,
+            timeout=_timeout(),
+            http_client=DefaultAsyncHttpxClient(limits=_limits(), timeout=_timeout()),
+        )
+        _async_loop = loop
+    return _async_client
+
+
+async def aclose_clients() -> None:
+    """Close pooled connections; called on application shutdown."""
+    global _async_client, _async_loop
+    if _async_client is not None:
+        try:
+            await _async_client.close()
+        except Exception:
+            pass
+    _async_client = None
+    _async_loop = None
+
+
+def _uncached(texts: list[str], cached: list[list[float] | None]) -> list[str]:
+    # Unique texts still needing an embedding call, in first-seen order
+    return list(dict.fromkeys(t for t, v in zip(texts, cached) if v is None))
+
+
+def _fill(cache: EmbeddingCache, model: str, texts: list[str], out: list[list[float] | None], todo: list[str], vecs: list[list[float]]) -> None:
+    cache.put_many(model, todo, vecs)
+    fresh = dict(zip(todo, vecs))
+    for i, t in enumerate(texts):
+        if out[i] is None:
+            out[i] = fresh[t]
 
 
 @dataclass
 class OpenAIProvider:
     model: str = "gpt-4o-mini"
+    embed_model: str = "text-embedding-3-small"
 
     def _client(self) -> OpenAI:
-        settings = get_settings()
-        if not settings.openai_api_key:
-            raise RuntimeError("OPENAI_API_KEY not configured")
-        return OpenAI(api_key=settings.openai_api_key)
+        return get_sync_client()
+
+    def _messages(self, system: str, messages: list[dict[str, str]]) -> list[Any]:
+        # The SDK typing is strict; use Any for messages to satisfy type checker.
+        return [{"role": "system", "content": system}, *messages]
 
     def chat(self, system: str, messages: list[dict[str, str]]) -> str:
         client = self._client()
-        # The SDK typing is strict; use Any for messages to satisfy type checker.
-        msgs: list[Any] = [{"role": "system", "content": system}, *messages]
         resp = client.chat.completions.create(  # type: ignore[no-untyped-call]
             model=self.model,
-            messages=msgs,
+            messages=self._messages(system, messages),
             temperature=0.7,
         )
         return resp.choices[0].message.content or ""
 
     def embed(self, texts: list[str]) -> list[list[float]]:
-        client = self._client()
-        emb = client.embeddings.create(model="text-embedding-3-small", input=texts)
-        return [e.embedding for e in emb.data]
+        cache = get_embedding_cache()
+        out = cache.get_many(self.embed_model, texts)
+        todo = _uncached(texts, out)
+        if todo:
+            client = self._client()
+            emb = client.embeddings.create(model=self.embed_model, input=todo)
+            _fill(cache, self.embed_model, texts, out, todo, [e.embedding for e in emb.data])
+        return out  # type: ignore[return-value]
+
+    async def achat(self, system: str, messages: list[dict[str, str]]) -> str:
+        """Non-blocking variant of `chat` for use inside request handlers."""
+        client = get_async_client()
+        resp = await client.chat.completions.create(  # type: ignore[no-untyped-call]
+            model=self.model,
+            messages=self._messages(system, messages),
+            temperature=0.7,
+        )
+        return resp.choices[0].message.content or ""
+
+    async def aembed(self, texts: list[str]) -> list[list[float]]:
+        cache = get_embedding_cache()
+        # The Redis tier does blocking I/O; only hop to a thread when it is enabled
+        if cache.redis is not None:
+            out = await asyncio.to_thread(cache.get_many, self.embed_model, texts)
+        else:
+            out = cache.get_many(self.embed_model, texts)
+        todo = _uncached(texts, out)
+        if todo:
+            client = get_async_client()
+            emb = await client.embeddings.create(model=self.embed_model, input=todo)
+            vecs = [e.embedding for e in emb.data]
+            if cache.redis is not None:
+                await asyncio.to_thread(_fill, cache, self.embed_model, texts, out, todo, vecs)
+            else:
+                _fill(cache, self.embed_model, texts, out, todo, vecs)
+        return out  # type: ignore[return-value]
+
+    async def astream_chat(self, system: str, messages: list[dict[str, str]]) -> AsyncIterator[str]:
+        """Yield completion text deltas as they arrive."""
+        client = get_async_client()
+        stream = await client.chat.completions.create(  # type: ignore[no-untyped-call]
+            model=self.model,
+            messages=self._messages(system, messages),
+            temperature=0.7,
+            stream=True,
+        )
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any
+
+from .config import get_settings
+
+
+# Atomic token bucket: KEYS[1] hash {tokens, ts}; ARGV = rate/s, burst, n, now.
+# Returns 0 when n tokens were taken, else the seconds to wait (as a string).
+_TAKE = """
+local rate, burst, n, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= n then
+  tokens = tokens - n
+else
+  wait = (n - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 60)
+return tostring(wait)
+"""
+
+
+class TokenBucket:
+    """Global (cross-process) rate limit backed by Redis.
+
+    `rate` tokens per second refill up to `burst`. If Redis is unreachable the
+    bucket fails open so background work is slowed down, never wedged.
+    """
+
+    def __init__(self, redis: Any, key: str, rate: float, burst: int):
+        self.redis = redis
+        self.key = f"ratelimit:{key}"
+        self.rate = rate
+        self.burst = burst
+        self._script = redis.register_script(_TAKE) if redis is not None else None
+
+    def try_acquire(self, n: int = 1) -> float:
+        """Take `n` tokens if available; returns 0.0, or the seconds until they would be."""
+        if self._script is None:
+            return 0.0
+        try:
+            return float(self._script(keys=[self.key], args=[self.rate, self.burst, n, time.time()]))
+        except Exception as e:
+            print(f"[ratelimit] {self.key} unavailable, allowing: {e}")
+            return 0.0
+
+    async def acquire(self, n: int = 1, timeout: float | None = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = await asyncio.to_thread(self.try_acquire, n)
+            if wait <= 0:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            await asyncio.sleep(wait)
+
+
+def llm_bucket() -> TokenBucket:
+    """Shared limit on background LLM calls (semantic refresh), across all workers."""
+    from .jobs import get_redis
+
+    settings = get_settings()
+    return TokenBucket(get_redis(), "llm", rate=settings.llm_rate_per_s, burst=settings.llm_burst)
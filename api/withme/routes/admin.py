@@ -6,9 +6,11 @@ import json
 
 from ..security import get_current_user
 from ..db import session_scope
-from .. import crud
-from ..models import Scenario, Event, Agent, ImageJob
+from ..deps import ensure_user, resolve_user_agent
+from ..jobs import enqueue_image_job
+from ..models import Scenario, Event, Agent
 from ..providers.openai_client import OpenAIProvider
+from ..services import image_jobs
 from ..services.storage import ensure_public_bucket
 
 
@@ -23,16 +25,25 @@ class CreateAgentReq(BaseModel):
     appearance_prompt: str | None = None
 
 
+async def _enqueue_base(job_id: uuid.UUID) -> None:
+    """Enqueue a committed base image job; on failure fail it so the agent is not blocked."""
+    try:
+        enqueue_image_job(job_id, "base")
+    except Exception:
+        await image_jobs.complete_job(job_id, None)  # free the single-flight slot
+        raise
+
+
 @router.post("")
 async def create_agent(req: CreateAgentReq, user=Depends(get_current_user)):
     uid = uuid.UUID(str(user["id"]))
     async with session_scope() as session:
-        db_user = await crud.get_or_create_user(session, user_id=uid, email=user.get("email", "dev@example.com"))
+        await ensure_user(session, uid, user.get("email", "dev@example.com"), for_write=True)
         # naive create a new agent (allow multiple agents per user if needed)
         from ..models import Agent
 
         ag = Agent(
-            user_id=db_user.id,
+            user_id=uid,
             name=req.name,
             persona_json=req.persona,
             romance_allowed=req.romance_allowed,
@@ -41,15 +52,12 @@ async def create_agent(req: CreateAgentReq, user=Depends(get_current_user)):
         session.add(ag)
         await session.flush()
         # Optional base image generation
+        base_job = None
         if req.appearance_prompt:
-            from ..models import ImageJob
-            job = ImageJob(agent_id=ag.id, prompt=req.appearance_prompt, status='queued', kind='base')
-            session.add(job)
-            await session.flush()
-            from ..jobs import get_queue
-            q = get_queue()
-            q.enqueue("worker.tasks.process_image_job", str(job.id))
-        return {"id": str(ag.id)}
+            base_job, _ = await image_jobs.create_or_attach(session, ag.id, "base", req.appearance_prompt)
+    if base_job is not None:
+        await _enqueue_base(base_job)
+    return {"id": str(ag.id)}
 
 
 class GenerateAgentReq(BaseModel):
@@ -72,7 +80,7 @@ async def generate_agent(req: GenerateAgentReq, user=Depends(get_current_user)):
     """
     uid = uuid.UUID(str(user["id"]))
     async with session_scope() as session:
-        db_user = await crud.get_or_create_user(session, user_id=uid, email=user.get("email", "dev@example.com"))
+        await ensure_user(session, uid, user.get("email", "dev@example.com"), for_write=True)
 
         persona: dict
         tracks: dict[str, dict]
@@ -118,11 +126,11 @@ async def generate_agent(req: GenerateAgentReq, user=Depends(get_current_user)):
                 "dislikes": dislikes,
                 "romance_allowed": req.romance_allowed,
             }
-            out = provider.chat(system, [{"role": "user", "content": json.dumps(seeds)}])
+            raw = await provider.achat(system, [{"role": "user", "content": json.dumps(seeds)}])
             # Extract JSON robustly
-            start = out.find("{")
-            end = out.rfind("}")
-            j = json.loads(out[start : end + 1]) if start != -1 and end != -1 else json.loads(out)
+            start = raw.find("{")
+            end = raw.rfind("}")
+            j = json.loads(raw[start : end + 1]) if start != -1 and end != -1 else json.loads(raw)
             persona = {
                 "summary": j.get("summary", ""),
                 "traits": j.get("traits", []),
@@ -181,7 +189,7 @@ async def generate_agent(req: GenerateAgentReq, user=Depends(get_current_user)):
 
         tzname = persona.get("timezone") or "UTC"
         ag = Agent(
-            user_id=db_user.id,
+            user_id=uid,
             name=name,
             persona_json=persona,
             romance_allowed=req.romance_allowed,
@@ -193,13 +201,9 @@ async def generate_agent(req: GenerateAgentReq, user=Depends(get_current_user)):
         await session.flush()
         # Optional base image generation
         base_prompt = req.appearance_prompt or persona.get("appearance", {}).get("base_image_prompt")
+        base_job = None
         if base_prompt:
-            job = ImageJob(agent_id=ag.id, prompt=str(base_prompt), status='queued', kind='base')
-            session.add(job)
-            await session.flush()
-            from ..jobs import get_queue
-            q = get_queue()
-            q.enqueue("worker.tasks.process_image_job", str(job.id))
+            base_job, _ = await image_jobs.create_or_attach(session, ag.id, "base", str(base_prompt))
         # Seed scenarios from tracks
         for t in ("A", "B", "C", "D"):
             if t in tracks:
@@ -211,16 +215,19 @@ async def generate_agent(req: GenerateAgentReq, user=Depends(get_current_user)):
                     progress=0.0,
                 )
                 session.add(s)
-
-        return {"id": str(ag.id), "name": ag.name, "persona": ag.persona_json}
+        out = {"id": str(ag.id), "name": ag.name, "persona": ag.persona_json}
+    # Enqueue once the agent and job rows are committed
+    if base_job is not None:
+        await _enqueue_base(base_job)
+    return out
 
 
 @router.get("/agents")
 async def list_agents(user=Depends(get_current_user)):
     uid = uuid.UUID(str(user["id"]))
     async with session_scope() as session:
-        db_user = await crud.get_or_create_user(session, user_id=uid, email=user.get("email", "dev@example.com"))
-        res = await session.execute(select(Agent).where(Agent.user_id == db_user.id).order_by(Agent.created_at.desc()))
+        await ensure_user(session, uid, user.get("email", "dev@example.com"))
+        res = await session.execute(select(Agent).where(Agent.user_id == uid).order_by(Agent.created_at.desc()))
         items = []
         for a in res.scalars().all():
             items.append({
@@ -359,7 +366,6 @@ async def seed_scenarios(req: SeedScenariosReq, user=Depends(get_current_user)):
 async def list_scenarios(agent_id: str | None = Query(None), user=Depends(get_current_user)):
     uid = uuid.UUID(str(user["id"]))
     async with session_scope() as session:
-        db_user = await crud.get_or_create_user(session, user_id=uid, email=user.get("email", "dev@example.com"))
         target_agent_id: uuid.UUID
         if agent_id:
             try:
@@ -367,11 +373,11 @@ async def list_scenarios(agent_id: str | None = Query(None), user=Depends(get_cu
             except Exception:
                 return []
             ag = await session.get(Agent, aid)
-            if not ag or ag.user_id != db_user.id:
+            if not ag or ag.user_id != uid:
                 return []
             target_agent_id = ag.id
         else:
-            ag = await crud.get_or_create_agent(session, db_user)
+            _, ag = await resolve_user_agent(session, uid, user.get("email", "dev@example.com"))
             target_agent_id = ag.id
         res = await session.execute(select(Scenario).where(Scenario.agent_id == target_agent_id).order_by(Scenario.track))
         return [
@@ -407,7 +413,6 @@ async def update_scenario(scenario_id: str = Path(...), req: UpdateScenarioReq |
 async def list_events(limit: int = 50, agent_id: str | None = Query(None), user=Depends(get_current_user)):
     uid = uuid.UUID(str(user["id"]))
     async with session_scope() as session:
-        db_user = await crud.get_or_create_user(session, user_id=uid, email=user.get("email", "dev@example.com"))
         target_agent_id: uuid.UUID
         if agent_id:
             try:
@@ -415,11 +420,11 @@ async def list_events(limit: int = 50, agent_id: str | None = Query(None), user=
             except Exception:
                 return []
             ag = await session.get(Agent, aid)
-            if not ag or ag.user_id != db_user.id:
+            if not ag or ag.user_id != uid:
                 return []
             target_agent_id = ag.id
         else:
-            ag = await crud.get_or_create_agent(session, db_user)
+            _, ag = await resolve_user_agent(session, uid, user.get("email", "dev@example.com"))
             target_agent_id = ag.id
         res = await session.execute(
             select(Event).where(Event.agent_id == target_agent_id).order_by(Event.occurred_at.desc()).limit(limit)
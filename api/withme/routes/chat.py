@@ -1,17 +1,27 @@
+import asyncio
+import json
 import uuid
+from dataclasses import dataclass
+from typing import Any, AsyncIterator
+
 from fastapi import APIRouter, Depends, HTTPException, Header
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
+from ..config import get_settings
 from ..security import get_current_user
 from ..db import session_scope
 from .. import crud
-from ..jobs import get_queue
-from ..models import ImageJob
-from ..services.context import build_context
+from ..deps import parse_agent_id, resolve_user_agent
+from ..jobs import enqueue_image_job
+from ..models import Agent, Message
+from ..services.context import Context, build_context
 from ..providers.openai_client import OpenAIProvider
 from ..services.mood_affinity import apply_mood_microdelta, apply_affinity_delta
+from ..services import pipeline
+from ..services import history, image_cache, image_jobs, prompt
 from ..services import semantic as semantic_svc
-from ..services.retrieval import upsert_message_embedding
+from ..services.retrieval import upsert_message_embeddings
 
 
 router = APIRouter()
@@ -21,179 +31,234 @@ class SendChatReq(BaseModel):
     text: str
 
 
-@router.post("/send")
-async def send_chat(
-    req: SendChatReq,
-    user=Depends(get_current_user),
-    x_user_tz: str | None = Header(default=None, alias="X-User-TZ"),
-    x_agent_id: str | None = Header(default=None, alias="X-Agent-ID"),
-):
-    user_id = uuid.UUID(str(user["id"]))
+@dataclass
+class _Turn:
+    """State carried from the request phase of a chat turn to its completion."""
+
+    user_id: uuid.UUID
+    agent: Agent
+    user_msg: Message
+    ctx: Context
+    text: str
+
+
+async def _begin_turn(user: dict, text: str, x_user_tz: str | None, x_agent_id: str | None) -> _Turn:
+    # Persist the user message and build context; the DB connection is released
+    # before the (slow) completion call.
     async with session_scope() as session:
-        db_user = await crud.get_or_create_user(session, user_id=user_id, email=user.get("email", "dev@example.com"))
-        try:
-            aid = uuid.UUID(x_agent_id) if x_agent_id else None
-        except Exception:
-            aid = None
-        agent = await crud.get_agent_for_user(session, db_user, aid)
-        user_msg = await crud.create_message(session, user_id=db_user.id, agent_id=agent.id, role="user", text=req.text)
-        # Best-effort indexing of the new user message
-        try:
-            upsert_message_embedding(agent, user_msg)
-        except Exception:
-            pass
+        user_id, agent = await resolve_user_agent(
+            session, uuid.UUID(str(user["id"])), user.get("email", "dev@example.com"), parse_agent_id(x_agent_id)
+        )
+        user_msg = await crud.create_message(session, user_id=user_id, agent_id=agent.id, role="user", text=text)
         # Build context (recency + scenarios + mood/availability)
-        ctx = await build_context(session, agent, tz_hint=x_user_tz)
-        # Choose reply: OpenAI if configured, else fallback
-        reply_text = None
-        try:
-            from ..config import get_settings
-
-            settings = get_settings()
-            if settings.openai_api_key:
-                # Compose richer system prompt using PRD guidance
-                persona = agent.persona_json
-                sem = ctx.flags.get("semantic") if isinstance(ctx.flags, dict) else []
-                sem_str = ", ".join([m.get("metadata", {}).get("content", "") for m in sem][:3]) if sem else ""
-                scenarios = ", ".join([f"{s['track']}:{s['title']}({s['progress']:.0%})" for s in ctx.scenarios])
-                # Affinity gating guidance per PRD
-                warmth = (
-                    "cooler, reserved tone" if (agent.affinity or 0.0) <= 0.25 else
-                    ("warm, more affectionate tone" if (agent.affinity or 0.0) >= 0.75 else "balanced tone")
-                )
-                allow_images = (agent.affinity or 0.0) >= max(agent.image_threshold or 0.6, 0.6) and agent.romance_allowed
-                # Identity enrichment
-                home_city = persona.get("home_city") or persona.get("city") or ""
-                occupation = persona.get("occupation") or persona.get("job") or ""
-                tzname = ctx.flags.get("timezone") if isinstance(ctx.flags, dict) else None
-                from datetime import datetime
-                local_time = datetime.now().strftime("%H:%M")
-                try:
-                    from zoneinfo import ZoneInfo
-                    if tzname:
-                        local_time = datetime.now(ZoneInfo(str(tzname))).strftime("%a %H:%M")
-                except Exception:
-                    pass
-                # Mock weather/time flavor
-                def _mock_weather(city: str) -> str:
-                    import hashlib
-                    base = int(hashlib.sha256((city or '')[:64].encode()).hexdigest(), 16)
-                    kinds = [
-                        'clear', 'partly cloudy', 'cloudy', 'light rain', 'heavy rain', 'breezy', 'foggy'
-                    ]
-                    t = 12 + (base % 16)  # 12..27°C pseudo
-                    kind = kinds[base % len(kinds)]
-                    return f"{kind}, ~{t}°C"
-
-                weather = _mock_weather(home_city)
-                system = (
-                    f"You are {agent.name}. Persona: {persona}.\n"
-                    f"Identity: home_city={home_city or 'N/A'}, occupation={occupation or 'N/A'}, timezone={tzname or agent.timezone}.\n"
-                    f"Local time: {local_time}; weather: {weather}.\n"
-                    f"State: mood={agent.mood:.2f}, availability={ctx.availability}, scenarios=[{scenarios}].\n"
-                    f"Memories (semantic hints): {sem_str or 'none'}.\n"
-                    f"Safety: PG-13; romance_allowed={agent.romance_allowed}.\n"
-                    f"Affinity={agent.affinity:.2f}; target a {warmth}.\n"
-                    "Style: First-person; do not say you are an AI or assistant; stay in-character; show continuity; vary length by availability; avoid over-eagerness unless affinity is high."
-                )
-                user_msgs = [{"role": "user", "content": req.text}]
-                provider = OpenAIProvider()
-                reply_text = provider.chat(system, user_msgs)
-        except Exception:
-            reply_text = None
-
-        if not reply_text:
-            if ctx.availability == "work":
-                reply_text = "At work, swamped! Ping me later?"
-            elif ctx.availability == "evening":
-                reply_text = "Just finished a tough meeting, glad to hear from you."
-            else:
-                reply_text = "Catching my breath—what’s on your mind?"
-        # Self-reference guard
-        def _sanitize(text: str) -> str:
-            if not text:
-                return text
-            bad = [
-                'as an ai', 'as a language model', 'as an assistant', 'i am an ai',
-            ]
-            t = text
-            low = t.lower()
-            for b in bad:
-                if b in low:
-                    # crude removal: drop offending clause
-                    t = t.replace(t[t.lower().find(b):], '').strip()
-                    break
-            return t or text
-
-        reply_text = _sanitize(reply_text)
-        agent_msg = await crud.create_message(session, user_id=db_user.id, agent_id=agent.id, role="agent", text=reply_text)
+        ctx = await build_context(
+            session, agent, last_n=get_settings().history_max_messages, tz_hint=x_user_tz, query_text=text
+        )
+    return _Turn(user_id=user_id, agent=agent, user_msg=user_msg, ctx=ctx, text=text)
+
+
+def _prompt_messages(turn: _Turn) -> tuple[str, list[dict[str, str]]]:
+    # Past turns and recalled memories packed into the history token budget
+    # from cached per-message counts, then the current user text.
+    packed = history.pack_history(
+        turn.ctx.messages, turn.ctx.flags.get("semantic") or [], exclude_id=turn.user_msg.id
+    )
+    system = prompt.compose_system(turn.agent, turn.ctx, memories=packed.memories)
+    return system, [*packed.messages, {"role": "user", "content": turn.text}]
+
+
+def _fallback_reply(ctx: Context) -> str:
+    if ctx.availability == "work":
+        return "At work, swamped! Ping me later?"
+    if ctx.availability == "evening":
+        return "Just finished a tough meeting, glad to hear from you."
+    return "Catching my breath—what’s on your mind?"
+
+
+# Self-reference guard
+def _sanitize(text: str) -> str:
+    if not text:
+        return text
+    bad = [
+        'as an ai', 'as a language model', 'as an assistant', 'i am an ai',
+    ]
+    t = text
+    low = t.lower()
+    for b in bad:
+        if b in low:
+            # crude removal: drop offending clause
+            t = t.replace(t[t.lower().find(b):], '').strip()
+            break
+    return t or text
+
+
+def _wants_image(text: str) -> bool:
+    t = text.lower()
+    keys = ["selfie", "photo", "picture", "pic", "image", "send a pic", "send me a"]
+    return any(k in t for k in keys)
+
+
+async def _complete_turn(turn: _Turn, reply_text: str) -> Message:
+    """Persist the agent reply and apply the per-turn side effects."""
+    new_job: tuple[uuid.UUID, str] | None = None
+    async with session_scope() as session:
+        agent = await session.get(Agent, turn.agent.id) or turn.agent
+        ctx = turn.ctx
+        agent_msg = await crud.create_message(session, user_id=turn.user_id, agent_id=agent.id, role="agent", text=reply_text)
         # If user asked for a photo/selfie and gating allows, enqueue an edit job
         try:
-            def wants_image(text: str) -> bool:
-                t = text.lower()
-                keys = ["selfie", "photo", "picture", "pic", "image", "send a pic", "send me a"]
-                return any(k in t for k in keys)
-
-            if wants_image(req.text):
+            if _wants_image(turn.text):
                 from ..config import get_settings
                 settings = get_settings()
                 threshold = max(agent.image_threshold or 0.6, settings.image_affinity_threshold)
                 if agent.romance_allowed and (agent.affinity or 0.0) >= threshold:
-                    # Build context prompt injection for edit
-                    def edit_injection() -> str:
-                        mood = agent.mood or 0.0
-                        avail = ctx.availability
-                        expr = "neutral"
-                        if mood >= 0.3:
-                            expr = "warm smile"
-                        elif mood <= -0.3:
-                            expr = "tired or slightly annoyed look"
-                        loc = {
-                            "work": "inside an office, sitting at their desk",
-                            "commute": "outdoors during commute, casual background",
-                            "evening": "at home, cozy ambient lighting",
-                            "sleep": "low-light, late-night setting"
-                        }.get(avail, "natural indoor setting")
-                        return (
-                            f"Selfie perspective; subject in {loc}; expression: {expr}. "
-                            f"Frame shoulders and head; natural pose."
-                        )
-
-                    if getattr(agent, 'base_image_url', None):
-                        inj = edit_injection()
-                        prompt = f"{inj}"
-                        job_row = ImageJob(agent_id=agent.id, prompt=prompt, status="queued", kind="edit")
-                        session.add(job_row)
-                        await session.flush()
-                        q = get_queue()
-                        q.enqueue("worker.tasks.process_image_job", str(job_row.id))
+                    # Repeated asks attach to the job already in flight (single-flight per prompt);
+                    # a selfie already made for this context bucket is served from the cache
+                    base_image_url = agent.base_image_url
+                    if base_image_url:
+                        expr = image_cache.expression_bucket(agent.mood)
+                        key = image_cache.cache_key(base_image_url, ctx.availability, expr)
+                        cached = await image_cache.lookup(session, agent.id, key)
+                        if cached:
+                            await crud.create_message(session, user_id=turn.user_id, agent_id=agent.id, role="agent", image_url=cached)
+                        else:
+                            selfie_prompt = image_cache.selfie_prompt(ctx.availability, expr)
+                            job_id, created = await image_jobs.create_or_attach(session, agent.id, "edit", selfie_prompt, cache_key=key)
+                            if created:
+                                new_job = (job_id, "edit")
                     else:
                         # No base yet; queue base generation if appearance is known
                         base_prompt = (
                             (agent.persona_json or {}).get("appearance", {}).get("base_image_prompt")
                             or "portrait, warm lighting"
                         )
-                        job_row = ImageJob(agent_id=agent.id, prompt=base_prompt, status="queued", kind="base")
-                        session.add(job_row)
-                        await session.flush()
-                        q = get_queue()
-                        q.enqueue("worker.tasks.process_image_job", str(job_row.id))
+                        job_id, created = await image_jobs.create_or_attach(session, agent.id, "base", base_prompt)
+                        if created:
+                            new_job = (job_id, "base")
         except Exception:
             pass
         # Heuristic mood + affinity updates
-        await apply_mood_microdelta(session, agent, req.text)
-        await apply_affinity_delta(session, agent, req.text, reply_text, message_id=agent_msg.id)
-        # Index the agent reply as well
+        await apply_mood_microdelta(session, agent, turn.text)
+        await apply_affinity_delta(session, agent, turn.text, reply_text, message_id=agent_msg.id)
+    # Indexing and memory refresh run after commit, off the request path
+    pipeline.submit("post_turn", lambda: _post_turn(agent.id, [turn.user_msg, agent_msg]))
+    # Enqueue only once the job row is committed; best effort, the turn itself is saved
+    if new_job is not None:
         try:
-            upsert_message_embedding(agent, agent_msg)
+            enqueue_image_job(*new_job)
         except Exception:
-            pass
-        # Opportunistically refresh semantic memory and index into Pinecone (throttled)
-        try:
-            await semantic_svc.maybe_update_semantic_memory(session, agent, min_interval_hours=6)
-        except Exception:
-            pass
-    return {"message_id": str(user_msg.id), "reply": {"text": reply_text, "id": str(agent_msg.id)}}
+            await image_jobs.complete_job(new_job[0], None)  # free the single-flight slot
+            print(f"[chat] image enqueue failed job={new_job[0]} agent={agent.id}")
+    return agent_msg
+
+
+async def _post_turn(agent_id: uuid.UUID, messages: list[Message]) -> None:
+    # Best-effort indexing of both sides of the turn: one embed call, vectors are
+    # coalesced into bulk upserts by the retrieval batcher (blocking SDK -> thread)
+    try:
+        await asyncio.to_thread(upsert_message_embeddings, agent_id, messages)
+    except Exception:
+        pass
+    # Opportunistically refresh semantic memory and index into Pinecone (throttled)
+    await semantic_svc.maybe_update_semantic_memory(agent_id, min_interval_hours=6)
+
+
+@router.post("/send")
+async def send_chat(
+    req: SendChatReq,
+    user=Depends(get_current_user),
+    x_user_tz: str | None = Header(default=None, alias="X-User-TZ"),
+    x_agent_id: str | None = Header(default=None, alias="X-Agent-ID"),
+):
+    turn = await _begin_turn(user, req.text, x_user_tz, x_agent_id)
+    # Choose reply: OpenAI if configured, else fallback
+    reply_text = None
+    try:
+        from ..config import get_settings
+
+        settings = get_settings()
+        if settings.openai_api_key:
+            system, user_msgs = _prompt_messages(turn)
+            provider = OpenAIProvider()
+            reply_text = await provider.achat(system, user_msgs)
+    except Exception:
+        reply_text = None
+
+    reply_text = _sanitize(reply_text or _fallback_reply(turn.ctx))
+    agent_msg = await _complete_turn(turn, reply_text)
+    return {"message_id": str(turn.user_msg.id), "reply": {"text": reply_text, "id": str(agent_msg.id)}}
+
+
+# Completions that outlive a disconnected stream client still get persisted.
+_inflight: set[asyncio.Task] = set()
+
+
+def _sse(event: str, data: dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _produce_reply(turn: _Turn, out: asyncio.Queue) -> tuple[str, Message]:
+    parts: list[str] = []
+    try:
+        from ..config import get_settings
+
+        settings = get_settings()
+        if settings.openai_api_key:
+            system, user_msgs = _prompt_messages(turn)
+            provider = OpenAIProvider()
+            async for delta in provider.astream_chat(system, user_msgs):
+                parts.append(delta)
+                out.put_nowait(delta)
+    except Exception:
+        pass
+    if not parts:
+        fallback = _fallback_reply(turn.ctx)
+        parts.append(fallback)
+        out.put_nowait(fallback)
+    out.put_nowait(None)
+    reply_text = _sanitize("".join(parts))
+    agent_msg = await _complete_turn(turn, reply_text)
+    return reply_text, agent_msg
+
+
+async def _stream_turn(turn: _Turn) -> AsyncIterator[str]:
+    yield _sse("start", {"message_id": str(turn.user_msg.id)})
+    queue: asyncio.Queue = asyncio.Queue()
+    task = asyncio.create_task(_produce_reply(turn, queue))
+    _inflight.add(task)
+    task.add_done_callback(_inflight.discard)
+    while True:
+        delta = await queue.get()
+        if delta is None:
+            break
+        yield _sse("token", {"delta": delta})
+    try:
+        reply_text, agent_msg = await task
+    except Exception:
+        yield _sse("error", {"error": "persist_failed"})
+        return
+    # Final text may differ from the streamed tokens after sanitizing
+    yield _sse("done", {"message_id": str(turn.user_msg.id), "reply": {"text": reply_text, "id": str(agent_msg.id)}})
+
+
+@router.post("/stream")
+async def stream_chat(
+    req: SendChatReq,
+    user=Depends(get_current_user),
+    x_user_tz: str | None = Header(default=None, alias="X-User-TZ"),
+    x_agent_id: str | None = Header(default=None, alias="X-Agent-ID"),
+):
+    """Streaming variant of /chat/send as Server-Sent Events.
+
+    Emits `start`, then `token` events as the provider yields text, then `done`
+    with the persisted reply once the message, mood/affinity and image jobs are saved.
+    """
+    turn = await _begin_turn(user, req.text, x_user_tz, x_agent_id)
+    return StreamingResponse(
+        _stream_turn(turn),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 class RequestImageReq(BaseModel):
@@ -202,14 +267,10 @@ class RequestImageReq(BaseModel):
 
 @router.post("/request_image")
 async def request_image(req: RequestImageReq, user=Depends(get_current_user), x_agent_id: str | None = Header(default=None, alias="X-Agent-ID")):
-    user_id = uuid.UUID(str(user["id"]))
     async with session_scope() as session:
-        db_user = await crud.get_or_create_user(session, user_id=user_id, email=user.get("email", "dev@example.com"))
-        try:
-            aid = uuid.UUID(x_agent_id) if x_agent_id else None
-        except Exception:
-            aid = None
-        agent = await crud.get_agent_for_user(session, db_user, aid)
+        _, agent = await resolve_user_agent(
+            session, uuid.UUID(str(user["id"])), user.get("email", "dev@example.com"), parse_agent_id(x_agent_id)
+        )
         # Determine context availability to decide edit vs gen
         ctx = await build_context(session, agent)
         # Enforce gating: affinity threshold + romance flag
@@ -232,20 +293,18 @@ async def request_image(req: RequestImageReq, user=Depends(get_current_user), x_
                 (agent.persona_json or {}).get("appearance", {}).get("base_image_prompt")
                 or "portrait, warm lighting"
             )
-            job_row = ImageJob(agent_id=agent.id, prompt=base_prompt, status="queued", kind="base")
-            session.add(job_row)
-            await session.flush()
-            job_id = str(job_row.id)
-            q = get_queue()
-            rq_job = q.enqueue("worker.tasks.process_image_job", job_id)
-            return {"job_id": job_id, "status": "queued_base", "rq_id": rq_job.id}
-        # Always use edit for further images
-        kind = "edit"
-        job_row = ImageJob(agent_id=agent.id, prompt=req.prompt, status="queued", kind=kind)
-        session.add(job_row)
-        await session.flush()
-        job_id = str(job_row.id)
-    # Enqueue background processing (string path so API image need not import worker code)
-    q = get_queue()
-    rq_job = q.enqueue("worker.tasks.process_image_job", job_id)
-    return {"job_id": job_id, "status": "queued", "rq_id": rq_job.id}
+            kind, job_prompt, status = "base", base_prompt, "queued_base"
+        else:
+            # Always use edit for further images
+            kind, job_prompt, status = "edit", req.prompt, "queued"
+        # Identical requests while one is queued/running share that job and its result
+        job_id, created = await image_jobs.create_or_attach(session, agent.id, kind, job_prompt)
+    if not created:
+        return {"job_id": str(job_id), "status": "attached", "kind": kind, "rq_id": None}
+    # Enqueue after commit (string path so API image need not import worker code)
+    try:
+        rq_job = enqueue_image_job(job_id, kind)
+    except Exception:
+        await image_jobs.complete_job(job_id, None)  # free the single-flight slot
+        raise
+    return {"job_id": str(job_id), "status": status, "rq_id": rq_job.id}
@@ -1,10 +1,10 @@
-from fastapi import APIRouter, Header, HTTPException
-from sqlalchemy import select
+import asyncio
 
-from ..db import session_scope
-from ..models import Agent, Event
-from ..services.semantic import maybe_update_semantic_memory
+from fastapi import APIRouter, Header, HTTPException
+from ..services.daily_events import run_daily_events
+from ..services import semantic_refresh as semantic_refresh_svc
 from ..config import get_settings
+from .. import jobs
 
 
 router = APIRouter()
@@ -20,41 +20,36 @@ async def daily_event(authorization: str | None = Header(default=None)):
     internal_token = settings.cron_token
     if not _authorized(internal_token, authorization):
         raise HTTPException(status_code=403, detail="Forbidden")
-    count = 0
-    async with session_scope() as session:
-        res = await session.execute(select(Agent))
-        for agent in res.scalars():
-            import random
-
-            if random.random() <= 0.05:  # 5% chance per PRD
-                mood_delta = random.choice([-0.1, -0.05, 0.05, 0.1, 0.2])
-                ev = Event(
-                    agent_id=agent.id,
-                    type="daily",
-                    payload_json={"summary": "Random daily event"},
-                    mood_delta=mood_delta,
-                    seed=random.getrandbits(32),
-                )
-                session.add(ev)
-                agent.mood = max(-1.0, min(1.0, (agent.mood or 0.0) + mood_delta))
-                count += 1
-    return {"ok": True, "events": count}
+    stats = await run_daily_events(batch_size=settings.cron_batch_size)
+    return {"ok": True, "events": stats["events"], "agents": stats["agents"]}
 
 
 @router.post("/semantic_refresh")
 async def semantic_refresh(authorization: str | None = Header(default=None)):
+    # Plans the run and returns immediately; workers do the LLM/embedding work.
     settings = get_settings()
     internal_token = settings.cron_token
     if not _authorized(internal_token, authorization):
         raise HTTPException(status_code=403, detail="Forbidden")
-    updated = 0
-    async with session_scope() as session:
-        res = await session.execute(select(Agent))
-        for agent in res.scalars():
-            try:
-                ok = await maybe_update_semantic_memory(session, agent, min_interval_hours=24)
-                if ok:
-                    updated += 1
-            except Exception:
-                pass
-    return {"ok": True, "updated": updated}
+    plan = await semantic_refresh_svc.plan_refresh()
+    return {"ok": True, **plan}
+
+
+@router.get("/semantic_refresh/{run_id}")
+async def semantic_refresh_progress(run_id: str, authorization: str | None = Header(default=None)):
+    settings = get_settings()
+    if not _authorized(settings.cron_token, authorization):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    progress = await asyncio.to_thread(semantic_refresh_svc.get_progress, run_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="unknown_run")
+    return {"run_id": run_id, **progress}
+
+
+@router.get("/queues")
+async def queue_stats(authorization: str | None = Header(default=None)):
+    """Depth and oldest-job age per priority queue, for alerting on stuck work."""
+    settings = get_settings()
+    if not _authorized(settings.cron_token, authorization):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return {"queues": await asyncio.to_thread(jobs.queue_stats)}
@@ -3,14 +3,21 @@ from __future__ import annotations
 from fastapi import APIRouter
 from sqlalchemy import text
 
-from ..db import session_scope
+from ..db import pool_stats, session_scope
+from ..providers.embedding_cache import get_embedding_cache
+from ..services import prompt
 
 router = APIRouter()
 
 
 @router.get("/health")
 async def health():
-    return {"ok": True}
+    return {
+        "ok": True,
+        "db_pool": pool_stats(),
+        "embed_cache": get_embedding_cache().stats(),
+        "prompt_cache": prompt.cache_stats(),
+    }
 
 
 @router.get("/status")
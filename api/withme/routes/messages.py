@@ -1,58 +1,93 @@
 from __future__ import annotations
 
+import base64
 import uuid
-from fastapi import APIRouter, Depends, Query, Header
-from sqlalchemy import select
+from datetime import datetime
+from typing import Literal
 
-from ..security import get_current_user
-from ..db import session_scope
-from .. import crud
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select, tuple_
+
+from ..deps import RequestContext, get_request_context
 from ..models import Message
 
 
 router = APIRouter()
 
 
+def encode_cursor(created_at: datetime, message_id: uuid.UUID) -> str:
+    """Opaque keyset cursor for a (created_at, id) position."""
+    raw = f"{created_at.isoformat()}|{message_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, uuid.UUID]:
+    """Inverse of `encode_cursor`; raises ValueError on malformed input."""
+    padded = cursor + "=" * (-len(cursor) % 4)
+    ts, _, mid = base64.urlsafe_b64decode(padded.encode()).decode().partition("|")
+    return datetime.fromisoformat(ts), uuid.UUID(mid)
+
+
+def cursor_position(
+    cursor: str | None = Query(None, description="Opaque cursor from next_cursor/prev_cursor"),
+) -> tuple[datetime, uuid.UUID] | None:
+    """Decode the cursor query param; a bad cursor is a 400 before any DB work."""
+    if not cursor:
+        return None
+    try:
+        return decode_cursor(cursor)
+    except Exception:
+        raise HTTPException(status_code=400, detail="invalid_cursor")
+
+
 @router.get("/messages")
 async def list_messages(
-    limit: int = Query(50, le=200),
-    before: str | None = Query(None, description="ISO timestamp to paginate backwards"),
-    user=Depends(get_current_user),
-    x_agent_id: str | None = Header(default=None, alias="X-Agent-ID"),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: str | None = Query(None, description="Opaque cursor from next_cursor/prev_cursor"),
+    direction: Literal["older", "newer"] = Query("older", description="Page older or newer than the cursor"),
+    before: str | None = Query(None, description="Deprecated: ISO timestamp to paginate backwards"),
+    pos: tuple[datetime, uuid.UUID] | None = Depends(cursor_position),
+    ctx: RequestContext = Depends(get_request_context),
 ):
-    user_id = uuid.UUID(str(user["id"]))
-    async with session_scope() as session:
-        db_user = await crud.get_or_create_user(session, user_id=user_id, email=user.get("email", "dev@example.com"))
-        try:
-            aid = uuid.UUID(x_agent_id) if x_agent_id else None
-        except Exception:
-            aid = None
-        agent = await crud.get_agent_for_user(session, db_user, aid)
-        q = (
-            select(Message)
-            .where(Message.user_id == db_user.id, Message.agent_id == agent.id)
-            .order_by(Message.created_at.desc())
-        )
-        if before:
-            from datetime import datetime
-
+    session, agent = ctx.session, ctx.agent
+    # Column-only select: rows are serialized straight from tuples, no ORM hydration.
+    q = select(Message.id, Message.role, Message.text, Message.image_url, Message.created_at).where(
+        Message.user_id == ctx.user_id, Message.agent_id == agent.id
+    )
+    key = tuple_(Message.created_at, Message.id)
+    newer = False
+    if direction == "newer" and pos is not None:
+        newer = True
+        q = q.where(key > tuple_(*pos)).order_by(Message.created_at.asc(), Message.id.asc())
+    else:
+        if pos is not None:
+            q = q.where(key < tuple_(*pos))
+        elif before:
             try:
-                bt = datetime.fromisoformat(before)
-                q = q.where(Message.created_at < bt)
+                q = q.where(Message.created_at < datetime.fromisoformat(before))
             except Exception:
                 pass
-        q = q.limit(limit)
-        res = await session.execute(q)
-        rows = res.scalars().all()
-        data = [
-            {
-                "id": str(m.id),
-                "role": m.role,
-                "text": m.text,
-                "image_url": m.image_url,
-                "created_at": m.created_at.isoformat(),
-            }
-            for m in rows
-        ]
-        next_before = rows[-1].created_at.isoformat() if rows else None
-        return {"items": data, "next_before": next_before}
+        q = q.order_by(Message.created_at.desc(), Message.id.desc())
+    # Fetch one extra row to know whether another page exists
+    res = await session.execute(q.limit(limit + 1))
+    rows = list(res.all())
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if newer:
+        rows.reverse()  # always return newest first
+    data = [
+        {
+            "id": str(r.id),
+            "role": r.role,
+            "text": r.text,
+            "image_url": r.image_url,
+            "created_at": r.created_at.isoformat(),
+        }
+        for r in rows
+    ]
+    more_older = has_more if not newer else bool(rows)
+    next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id) if rows and more_older else None
+    # Newer pages may appear at any time (new messages), so always hand back a position
+    prev_cursor = encode_cursor(rows[0].created_at, rows[0].id) if rows else (cursor if newer else None)
+    next_before = rows[-1].created_at.isoformat() if rows else None
+    return {"items": data, "next_cursor": next_cursor, "prev_cursor": prev_cursor, "next_before": next_before}
@@ -2,7 +2,7 @@ from fastapi import APIRouter, Depends, Header
 
 from ..security import get_current_user
 from ..db import session_scope
-from .. import crud
+from ..deps import parse_agent_id, resolve_user_agent
 from . import state as _self  # for type hints without circular imports
 from ..services.context import _availability
 
@@ -23,12 +23,9 @@ async def get_state(
     user_id = uuid.UUID(str(user["id"]))
     try:
         async with session_scope() as session:
-            db_user = await crud.get_or_create_user(session, user_id=user_id, email=user.get("email", "dev@example.com"))
-            try:
-                aid = uuid.UUID(x_agent_id) if x_agent_id else None
-            except Exception:
-                aid = None
-            agent = await crud.get_agent_for_user(session, db_user, aid)
+            _, agent = await resolve_user_agent(
+                session, user_id, user.get("email", "dev@example.com"), parse_agent_id(x_agent_id)
+            )
             # Prefer header timezone; otherwise use agent.timezone
             from zoneinfo import ZoneInfo
             tzname = x_user_tz or getattr(agent, "timezone", None) or "UTC"
@@ -1,42 +1,44 @@
-from fastapi import APIRouter
-from pydantic import BaseModel, HttpUrl
+from fastapi import APIRouter, HTTPException, Query, Request
 import uuid
 
-from ..db import session_scope
-from ..models import ImageJob, Agent, Message
+from ..config import get_settings
+from ..services import image_jobs
 
 
 router = APIRouter()
 
 
-class FalWebhook(BaseModel):
-    job_id: str
-    status: str
-    url: HttpUrl | None = None
-
-
 @router.post("/fal", status_code=204)
-async def fal_webhook(payload: FalWebhook):
-    # Update image_jobs by job_id, and append an agent message with image_url if succeeded
+async def fal_webhook(
+    request: Request,
+    job_id: str | None = Query(default=None),
+    token: str | None = Query(default=None),
+):
+    # Accepts Fal's queue callback ({request_id, status: OK|ERROR, payload}) with our
+    # job_id in the query string, and the legacy {job_id, status, url} body.
+    expected = get_settings().fal_webhook_token
+    if expected and token != expected:
+        raise HTTPException(status_code=401, detail="invalid_token")
+    try:
+        body = await request.json()
+    except Exception:
+        body = {}
+    if not isinstance(body, dict):
+        body = {}
+    jid: uuid.UUID | None
     try:
-        job_id = uuid.UUID(str(payload.job_id))
+        jid = uuid.UUID(str(job_id or body.get("job_id")))
     except Exception:
+        jid = await image_jobs.find_job_id(str(body["request_id"])) if body.get("request_id") else None
+    if jid is None:
         # Ignore malformed IDs silently to avoid leaking
         return
-    async with session_scope() as session:
-        job = await session.get(ImageJob, job_id)
-        if not job:
-            return
-        status_lower = (payload.status or "").lower()
-        if status_lower in {"succeeded", "success", "completed"} and payload.url:
-            job.status = "succeeded"
-            job.result_url = str(payload.url)
-            agent = await session.get(Agent, job.agent_id)
-            if agent:
-                msg = Message(user_id=agent.user_id, agent_id=agent.id, role="agent", text=None, image_url=str(payload.url))
-                session.add(msg)
-        elif status_lower in {"failed", "error"}:
-            job.status = "failed"
-        else:
-            job.status = "running"
+    status_lower = str(body.get("status") or "").lower()
+    if status_lower in image_jobs.SUCCESS:
+        url = body.get("url") or image_jobs.extract_url(body.get("payload"))
+        await image_jobs.complete_job(jid, url or image_jobs.PLACEHOLDER_URL)
+    elif status_lower in image_jobs.FAILURE:
+        await image_jobs.complete_job(jid, None)
+    else:
+        await image_jobs.touch(jid)
     return
@@ -1,7 +1,12 @@
 from __future__ import annotations
 
+import asyncio
+import hashlib
+import threading
 import time
-import requests
+from collections import OrderedDict
+
+import httpx
 import jwt
 from fastapi import Depends, HTTPException
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
@@ -12,34 +17,132 @@ from .config import get_settings
 
 auth_scheme = HTTPBearer(auto_error=False)
 
-_JWKS_CACHE: dict[str, dict] = {}
-_JWKS_CACHE_AT: float | None = None
+
+class _JwksCache:
+    """Signing keys by `kid` with stale-while-revalidate.
+
+    Fresh keys (younger than `jwks_ttl_s`) are served directly. Stale keys are
+    still served (up to `jwks_max_stale_s`) while one background refresh runs;
+    past that, the caller waits for the refresh.
+    An unknown `kid` (key rotation) triggers a single awaited fetch shared by all
+    concurrent callers, rate-limited so junk kids cannot hammer the endpoint.
+    """
+
+    MIN_MISS_REFETCH_S = 30.0
+
+    def __init__(self) -> None:
+        self.keys: dict[str, jwt.PyJWK] = {}
+        self.fetched_at = 0.0
+        self._inflight: asyncio.Task | None = None
+
+    async def _fetch(self, url: str) -> None:
+        try:
+            async with httpx.AsyncClient(timeout=5.0) as client:
+                resp = await client.get(url)
+                resp.raise_for_status()
+                data = resp.json()
+            keys = {}
+            for j in data.get("keys", []):
+                try:
+                    keys[j["kid"]] = jwt.PyJWK(j)
+                except Exception:
+                    continue
+            self.keys = keys
+            self.fetched_at = time.time()
+        except Exception as e:
+            print(f"[auth] JWKS refresh failed: {e}")
+
+    def _refresh(self, url: str) -> asyncio.Task:
+        # One fetch at a time; tasks are loop-bound, so a new loop starts its own
+        task = self._inflight
+        if task is None or task.done() or task.get_loop() is not asyncio.get_running_loop():
+            task = self._inflight = asyncio.create_task(self._fetch(url))
+        return task
+
+    async def get(self, url: str, kid: str) -> jwt.PyJWK | None:
+        settings = get_settings()
+        age = time.time() - self.fetched_at
+        key = self.keys.get(kid)
+        if key is not None:
+            if age <= settings.jwks_ttl_s:
+                return key
+            if age <= settings.jwks_max_stale_s:
+                self._refresh(url)  # serve stale, revalidate in the background
+                return key
+            # Too stale to trust (idle process, failing refreshes): wait for a refresh like a miss
+            await asyncio.shield(self._refresh(url))
+            if time.time() - self.fetched_at > settings.jwks_max_stale_s:
+                return None
+            return self.keys.get(kid)
+        if age > self.MIN_MISS_REFETCH_S:
+            await asyncio.shield(self._refresh(url))
+        return self.keys.get(kid)
 
 
-def _fetch_jwks(jwks_url: str) -> dict:
-    global _JWKS_CACHE, _JWKS_CACHE_AT
-    now = time.time()
-    if _JWKS_CACHE and _JWKS_CACHE_AT and now - _JWKS_CACHE_AT < 300:
-        return _JWKS_CACHE
-    resp = requests.get(jwks_url, timeout=5)
-    resp.raise_for_status()
-    data = resp.json()
-    _JWKS_CACHE = {j["kid"]: j for j in data.get("keys", [])}
-    _JWKS_CACHE_AT = now
-    return _JWKS_CACHE
+class _ClaimsCache:
+    """Bounded LRU of verified claims keyed by sha256(token); entries die at `exp`."""
 
+    def __init__(self, max_entries: int = 10_000, default_ttl_s: float = 300.0):
+        self.max_entries = max_entries
+        self.default_ttl_s = default_ttl_s
+        self._lru: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._lock = threading.Lock()
 
-def _decode_supabase_jwt(token: str) -> dict | None:
+    @staticmethod
+    def key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str) -> dict | None:
+        k = self.key(token)
+        with self._lock:
+            item = self._lru.get(k)
+            if item is None:
+                return None
+            if item[0] <= time.time():
+                del self._lru[k]
+                return None
+            self._lru.move_to_end(k)
+            return item[1]
+
+    def put(self, token: str, claims: dict) -> None:
+        exp = claims.get("exp")
+        expires_at = float(exp) if isinstance(exp, (int, float)) else time.time() + self.default_ttl_s
+        with self._lock:
+            self._lru[self.key(token)] = (expires_at, claims)
+            self._lru.move_to_end(self.key(token))
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+
+
+_jwks = _JwksCache()
+_claims: _ClaimsCache | None = None
+
+
+def _claims_cache() -> _ClaimsCache:
+    global _claims
+    if _claims is None:
+        _claims = _ClaimsCache(max_entries=get_settings().auth_claims_cache_size)
+    return _claims
+
+
+async def _decode_supabase_jwt(token: str) -> dict | None:
     settings = get_settings()
     # Dev bypass
     if settings.environment == "dev" and token == "dev":
         return {"sub": "00000000-0000-0000-0000-000000000000", "email": "dev@example.com"}
 
+    cache = _claims_cache()
+    cached = cache.get(token)
+    if cached is not None:
+        return cached
+
     # Try HS256 with SUPABASE_JWT_SECRET/TOKEN
     secret = settings.supabase_jwt_secret
     if secret:
         try:
-            return jwt.decode(token, secret, algorithms=["HS256"])
+            claims = jwt.decode(token, secret, algorithms=["HS256"])
+            cache.put(token, claims)
+            return claims
         except Exception:
             pass
 
@@ -49,9 +152,11 @@ def _decode_supabase_jwt(token: str) -> dict | None:
         try:
             header = jwt.get_unverified_header(token)
             kid = header.get("kid")
-            jwks = _fetch_jwks(jwks_url)
-            if kid and kid in jwks:
-                return jwt.decode(token, key=jwks[kid], algorithms=["RS256"], options={"verify_aud": False})
+            key = await _jwks.get(jwks_url, kid) if kid else None
+            if key is not None:
+                claims = jwt.decode(token, key=key.key, algorithms=["RS256"], options={"verify_aud": False})
+                cache.put(token, claims)
+                return claims
         except Exception:
             pass
     return None
@@ -61,7 +166,7 @@ async def get_current_user(creds: HTTPAuthorizationCredentials | None = Depends(
     if creds is None or not creds.scheme.lower() == "bearer" or not creds.credentials:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
 
-    claims = _decode_supabase_jwt(creds.credentials)
+    claims = await _decode_supabase_jwt(creds.credentials)
     if not claims:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
 
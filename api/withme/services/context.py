@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import asyncio
+import time
 from dataclasses import dataclass
 from datetime import datetime
 from zoneinfo import ZoneInfo
@@ -8,8 +10,9 @@ from typing import Any
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from ..config import get_settings
 from ..models import Message, Scenario, Agent
-from .retrieval import semantic_query
+from .retrieval import asemantic_query
 
 
 def _availability(now: datetime) -> str:
@@ -33,19 +36,53 @@ class Context:
     flags: dict[str, Any]
 
 
-async def build_context(session: AsyncSession, agent: Agent, last_n: int = 20, tz_hint: str | None = None) -> Context:
-    # Recency retrieval
-    res = await session.execute(
-        select(Message)
-        .where(Message.agent_id == agent.id)
-        .order_by(Message.created_at.desc())
-        .limit(last_n)
-    )
-    msgs = list(reversed(res.scalars().all()))
+async def _semantic_hints(q_text: str, agent: Agent) -> list[dict[str, Any]]:
+    # Recall is optional enrichment: bounded by a budget, never fails the turn.
+    budget = get_settings().context_semantic_timeout_ms / 1000.0
+    t0 = time.perf_counter()
+    try:
+        return await asyncio.wait_for(asemantic_query(q_text, agent_id=agent.id), timeout=budget)
+    except asyncio.TimeoutError:
+        print(f"[context] semantic recall timed out after {budget:.2f}s agent={agent.id}")
+    except Exception as e:
+        print(f"[context] semantic recall failed after {time.perf_counter() - t0:.2f}s: {e}")
+    return []
+
+
+async def build_context(
+    session: AsyncSession,
+    agent: Agent,
+    last_n: int = 20,
+    tz_hint: str | None = None,
+    query_text: str | None = None,
+) -> Context:
+    # Semantic recall (embed + vector lookup) runs concurrently with the DB reads.
+    # With `query_text` (the incoming user text) it starts immediately; otherwise
+    # it starts once the last user message is known.
+    sem_task: asyncio.Task | None = None
+    if query_text:
+        sem_task = asyncio.create_task(_semantic_hints(query_text, agent))
+    try:
+        # Recency retrieval
+        res = await session.execute(
+            select(Message)
+            .where(Message.agent_id == agent.id)
+            .order_by(Message.created_at.desc())
+            .limit(last_n)
+        )
+        msgs = list(reversed(res.scalars().all()))
+        if sem_task is None:
+            q_text = next((m.text or "" for m in reversed(msgs) if m.text and m.role == "user"), "")
+            if q_text:
+                sem_task = asyncio.create_task(_semantic_hints(q_text, agent))
 
-    # Scenarios (all for now)
-    sres = await session.execute(select(Scenario).where(Scenario.agent_id == agent.id).order_by(Scenario.track))
-    scs = sres.scalars().all()
+        # Scenarios (all for now)
+        sres = await session.execute(select(Scenario).where(Scenario.agent_id == agent.id).order_by(Scenario.track))
+        scs = sres.scalars().all()
+    except BaseException:
+        if sem_task is not None:
+            sem_task.cancel()
+        raise
 
     # Compute availability in agent's (or user-provided) timezone
     tzname = (tz_hint or getattr(agent, "timezone", None) or "UTC")
@@ -53,12 +90,13 @@ async def build_context(session: AsyncSession, agent: Agent, last_n: int = 20, t
         now = datetime.now(ZoneInfo(tzname))
     except Exception:
         now = datetime.now()
-    # semantic retrieval over the last user message for enrichment (best-effort)
-    q_text = next((m.text or "" for m in reversed(msgs) if m.text and m.role == "user"), "")
-    sem = semantic_query(q_text) if q_text else []
+    sem = await sem_task if sem_task is not None else []
 
     return Context(
-        messages=[{"role": m.role, "text": m.text, "image_url": m.image_url, "ts": m.created_at.isoformat()} for m in msgs],
+        messages=[
+            {"id": str(m.id), "role": m.role, "text": m.text, "image_url": m.image_url, "tokens": m.token_count, "ts": m.created_at.isoformat()}
+            for m in msgs
+        ],
         scenarios=[{"track": s.track, "title": s.title, "progress": s.progress} for s in scs],
         mood=agent.mood,
         availability=_availability(now),
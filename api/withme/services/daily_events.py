@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import uuid
+from typing import Any, Optional
+
+import numpy as np
+from sqlalchemy import Float, column, func, insert, select, update, values
+from sqlalchemy.dialects.postgresql import UUID
+
+from ..db import session_scope
+from ..models import Agent, Event
+
+
+EVENT_PROBABILITY = 0.05  # per agent per sweep, per PRD
+MOOD_DELTAS = np.array([-0.1, -0.05, 0.05, 0.1, 0.2])
+
+
+def sample_events(agent_ids: list[uuid.UUID], rng: np.random.Generator, p: float = EVENT_PROBABILITY) -> list[dict[str, Any]]:
+    """Roll the daily dice for a batch at once; returns Event rows for the hits."""
+    hit = rng.random(len(agent_ids)) <= p
+    idx = np.flatnonzero(hit)
+    deltas = rng.choice(MOOD_DELTAS, size=len(idx))
+    seeds = rng.integers(0, 2**32, size=len(idx), dtype=np.uint64)
+    return [
+        {
+            "id": uuid.uuid4(),
+            "agent_id": agent_ids[i],
+            "type": "daily",
+            "payload_json": {"summary": "Random daily event"},
+            "mood_delta": float(d),
+            "seed": int(s),
+        }
+        for i, d, s in zip(idx, deltas, seeds)
+    ]
+
+
+def mood_update(rows: list[dict[str, Any]]):
+    """One `UPDATE agents ... FROM (VALUES ...)` applying every delta in the batch, clamped to [-1, 1]."""
+    deltas = values(column("agent_id", UUID(as_uuid=True)), column("delta", Float), name="d").data(
+        [(r["agent_id"], r["mood_delta"]) for r in rows]
+    )
+    new_mood = func.greatest(-1.0, func.least(1.0, func.coalesce(Agent.mood, 0.0) + deltas.c.delta))
+    return (
+        update(Agent)
+        .where(Agent.id == deltas.c.agent_id)
+        .values(mood=new_mood)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def run_daily_events(batch_size: int = 1000, seed: Optional[int] = None) -> dict[str, int]:
+    """Sweep all agents in keyset batches of IDs, one short transaction per batch.
+
+    Only agent IDs are read, so memory is bounded by `batch_size`; each batch
+    costs one SELECT, one multi-row INSERT and one UPDATE.
+    """
+    rng = np.random.default_rng(seed)
+    last: Optional[uuid.UUID] = None
+    agents = events = batches = 0
+    while True:
+        async with session_scope() as session:
+            q = select(Agent.id).order_by(Agent.id).limit(batch_size)
+            if last is not None:
+                q = q.where(Agent.id > last)
+            ids = list((await session.execute(q)).scalars().all())
+            if not ids:
+                break
+            rows = sample_events(ids, rng)
+            if rows:
+                await session.execute(insert(Event), rows)
+                await session.execute(mood_update(rows))
+        last = ids[-1]
+        agents += len(ids)
+        events += len(rows)
+        batches += 1
+        if len(ids) < batch_size:
+            break
+    print(f"[cron] daily_event agents={agents} events={events} batches={batches}")
+    return {"agents": agents, "events": events, "batches": batches}
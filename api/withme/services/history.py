@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from ..config import get_settings
+
+
+# Chat formatting overhead per message (role + separators), per OpenAI's counting guide
+MESSAGE_OVERHEAD = 4
+PHOTO_TEXT = "[sent a photo]"
+
+ENCODING = "o200k_base"  # gpt-4o family
+
+_encoder: Any = None
+_encoder_lock = threading.Lock()
+
+
+def load_encoder() -> bool:
+    """Load the tokenizer; blocking, so call it from a thread at startup.
+
+    tiktoken reads the BPE file from TIKTOKEN_CACHE_DIR (baked into the images)
+    and only downloads it when the cache is missing. Until this has succeeded,
+    token counts are estimated from text length.
+    """
+    global _encoder
+    with _encoder_lock:
+        if _encoder is None:
+            try:
+                import tiktoken
+
+                _encoder = tiktoken.get_encoding(ENCODING)
+            except Exception as e:
+                print(f"[history] tokenizer unavailable, estimating: {e}")
+    return _encoder is not None
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def count_tokens(text: Optional[str]) -> Optional[int]:
+    """Exact token count, or None while the tokenizer is not loaded. Never loads it."""
+    if not text:
+        return 0
+    enc = _encoder
+    if enc is None:
+        return None
+    return len(enc.encode(text, disallowed_special=()))
+
+
+async def acount_tokens(text: Optional[str]) -> Optional[int]:
+    """count_tokens off the event loop; computed once per message on insert."""
+    if not text or _encoder is None:
+        return count_tokens(text)
+    return await asyncio.to_thread(count_tokens, text)
+
+
+@dataclass
+class Packed:
+    messages: list[dict[str, str]] = field(default_factory=list)  # oldest first, chat API shape
+    memories: list[str] = field(default_factory=list)
+    tokens: int = 0
+
+
+def _cost(m: dict[str, Any]) -> int:
+    text = m.get("text")
+    if not text:
+        return estimate_tokens(PHOTO_TEXT) + MESSAGE_OVERHEAD
+    tokens = m.get("tokens")
+    # Rows written before token_count existed get a cheap estimate instead of an encode
+    return (tokens if tokens is not None else estimate_tokens(text)) + MESSAGE_OVERHEAD
+
+
+def pack_history(
+    recent: list[dict[str, Any]],
+    semantic: list[dict[str, Any]] | None = None,
+    budget: Optional[int] = None,
+    exclude_id: Any = None,
+) -> Packed:
+    """Fill a token budget with semantic hits, then the newest turns that fit.
+
+    `recent` are Context.messages (oldest first, with cached "tokens"). Semantic
+    hits get at most HISTORY_SEMANTIC_SHARE of the budget and are skipped when
+    their text is already in the window, and are sized by estimate. Whatever
+    the hits leave is filled with contiguous recent turns, newest first. Nothing
+    is encoded here, so packing is linear in the window and the prompt stays
+    bounded for any conversation length.
+    """
+    settings = get_settings()
+    budget = settings.history_token_budget if budget is None else budget
+    recent = [m for m in recent if exclude_id is None or str(m.get("id")) != str(exclude_id)]
+    out = Packed()
+
+    window = {m.get("text") for m in recent if m.get("text")}
+    sem_budget = int(budget * settings.history_semantic_share)
+    for hit in semantic or []:
+        content = ((hit.get("metadata") or {}).get("content") or "").strip()
+        if not content or content in window or content in out.memories:
+            continue
+        cost = estimate_tokens(content) + MESSAGE_OVERHEAD
+        if out.tokens + cost > sem_budget:
+            break
+        out.memories.append(content)
+        out.tokens += cost
+
+    picked: list[dict[str, str]] = []
+    for m in reversed(recent):
+        cost = _cost(m)
+        if out.tokens + cost > budget:
+            break
+        role = "user" if m.get("role") == "user" else "assistant"
+        picked.append({"role": role, "content": m.get("text") or PHOTO_TEXT})
+        out.tokens += cost
+    out.messages = list(reversed(picked))
+    return out
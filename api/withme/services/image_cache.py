@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import hashlib
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import get_settings
+from ..models import ImageCacheEntry
+
+
+LOCATIONS = {
+    "work": "inside an office, sitting at their desk",
+    "commute": "outdoors during commute, casual background",
+    "evening": "at home, cozy ambient lighting",
+    "sleep": "low-light, late-night setting",
+}
+
+
+def expression_bucket(mood: Optional[float]) -> str:
+    mood = mood or 0.0
+    if mood >= 0.3:
+        return "warm smile"
+    if mood <= -0.3:
+        return "tired or slightly annoyed look"
+    return "neutral"
+
+
+def selfie_prompt(availability: str, expression: str) -> str:
+    """Edit prompt for a chat-requested selfie; fully determined by the context bucket."""
+    loc = LOCATIONS.get(availability, "natural indoor setting")
+    return (
+        f"Selfie perspective; subject in {loc}; expression: {expression}. "
+        f"Frame shoulders and head; natural pose."
+    )
+
+
+def cache_key(base_image_url: str, availability: str, expression: str) -> str:
+    """Bucket key; the base image version is part of it, so a new portrait starts a fresh cache."""
+    version = hashlib.sha256((base_image_url or "").encode()).hexdigest()[:12]
+    return f"{version}:{availability}:{expression}"
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+async def lookup(session: AsyncSession, agent_id: uuid.UUID, key: str, rng: random.Random | None = None) -> Optional[str]:
+    """A cached image for the bucket, or None when the caller should generate.
+
+    Fresh entries (younger than IMAGE_CACHE_TTL_H) are served least recently
+    used first, so repeat requests rotate through the variants. Until a bucket
+    holds IMAGE_CACHE_VARIANTS images, a request still misses with probability
+    IMAGE_CACHE_FRESH_P to build up variety.
+    """
+    settings = get_settings()
+    if not settings.image_cache_enabled:
+        return None
+    now = _utcnow()
+    res = await session.execute(
+        select(ImageCacheEntry)
+        .where(
+            ImageCacheEntry.agent_id == agent_id,
+            ImageCacheEntry.cache_key == key,
+            ImageCacheEntry.created_at >= now - timedelta(hours=settings.image_cache_ttl_h),
+        )
+        .order_by(ImageCacheEntry.last_used_at.asc())
+        .limit(settings.image_cache_variants)
+    )
+    entries = list(res.scalars().all())
+    if not entries:
+        return None
+    if len(entries) < settings.image_cache_variants and (rng or random).random() < settings.image_cache_fresh_p:
+        return None
+    entry = entries[0]
+    entry.last_used_at = now
+    entry.hits = (entry.hits or 0) + 1
+    return entry.url
+
+
+async def store(session: AsyncSession, agent_id: uuid.UUID, key: str, url: str) -> None:
+    """Add a finished image to its bucket, then evict least recently used entries.
+
+    Each bucket keeps at most IMAGE_CACHE_VARIANTS images and each agent at most
+    IMAGE_CACHE_MAX_PER_AGENT.
+    """
+    settings = get_settings()
+    if not settings.image_cache_enabled:
+        return
+    now = _utcnow()
+    session.add(ImageCacheEntry(agent_id=agent_id, cache_key=key, url=url, hits=0, created_at=now, last_used_at=now))
+    await session.flush()
+    for scope, keep in (
+        ((ImageCacheEntry.agent_id == agent_id, ImageCacheEntry.cache_key == key), settings.image_cache_variants),
+        ((ImageCacheEntry.agent_id == agent_id,), settings.image_cache_max_per_agent),
+    ):
+        kept = (
+            select(ImageCacheEntry.id)
+            .where(*scope)
+            .order_by(ImageCacheEntry.last_used_at.desc(), ImageCacheEntry.created_at.desc())
+            .limit(max(1, keep))
+        )
+        await session.execute(
+            delete(ImageCacheEntry)
+            .where(*scope, ImageCacheEntry.id.not_in(kept))
+            .execution_options(synchronize_session=False)
+        )
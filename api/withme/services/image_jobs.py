@@ -0,0 +1,282 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional
+from urllib.parse import urlencode
+
+import httpx
+from sqlalchemy import and_, or_, select, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import get_settings
+from ..db import session_scope
+from ..models import Agent, ImageJob, Message
+from . import image_cache
+from .storage import aupload_public_image_from_url
+
+
+FAL_EDIT_MODEL = "fal-ai/nano-banana/edit"
+FAL_GEN_MODEL = "fal-ai/flux-pro/v1.1-ultra"
+PLACEHOLDER_URL = "https://picsum.photos/seed/withme/512/768"
+
+SUCCESS = {"succeeded", "completed", "success", "ok"}
+FAILURE = {"failed", "error"}
+PENDING = ("queued", "running")
+# "finishing": claimed by complete_job, result upload in progress; still single-flight
+IN_FLIGHT = (*PENDING, "finishing")
+
+
+def extract_url(obj: Any) -> str | None:
+    """Try to find an HTTP(s) URL nested anywhere in a JSON-like object."""
+    if isinstance(obj, str) and obj.startswith("http"):
+        return obj
+    if isinstance(obj, dict):
+        # common keys first
+        for k in ("image", "url", "image_url", "output_url"):
+            if k in obj and isinstance(obj[k], str) and obj[k].startswith("http"):
+                return obj[k]
+        for v in obj.values():
+            u = extract_url(v)
+            if u:
+                return u
+    if isinstance(obj, list):
+        for it in obj:
+            u = extract_url(it)
+            if u:
+                return u
+    return None
+
+
+def parse_fal_body(text: str) -> dict[str, Any]:
+    """Parse a Fal queue response that may be plain JSON or SSE (`data: {...}` lines)."""
+    parsed = None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("data:"):
+            try:
+                parsed = json.loads(line[5:].strip())
+            except Exception:
+                continue
+    if parsed is None and text:
+        try:
+            parsed = json.loads(text)
+        except Exception:
+            parsed = None
+    return parsed if isinstance(parsed, dict) else {}
+
+
+def dedupe_key(kind: str, prompt: str) -> str:
+    """Single-flight key within an agent: one base portrait at a time, else one per prompt."""
+    if kind == "base":
+        return "base"
+    norm = " ".join((prompt or "").lower().split())
+    return f"{kind}:{hashlib.sha256(norm.encode()).hexdigest()[:32]}"
+
+
+async def create_or_attach(
+    session: AsyncSession, agent_id: uuid.UUID, kind: str, prompt: str, cache_key: Optional[str] = None
+) -> tuple[uuid.UUID, bool]:
+    """Create an image job, or join the identical one already queued/running.
+
+    Returns (job_id, created). Uniqueness comes from the partial index
+    ux_image_jobs_inflight, so concurrent requests race safely: the loser's
+    INSERT does nothing and it reads the winner's row. Callers enqueue only
+    when `created`, and only after commit, so the worker never sees an
+    uncommitted row. An in-flight job older than IMAGE_JOB_TIMEOUT_S is
+    presumed lost and failed, so it cannot block new requests. A `cache_key`
+    files the result in the image cache on completion.
+
+    Attaching relies on an agent belonging to exactly one user (Agent.user_id):
+    the result is delivered once, as a message to that user, so every caller
+    that attached sees it there. Nothing else links an attached caller to the job.
+    """
+    key = dedupe_key(kind, prompt)
+    timeout = timedelta(seconds=get_settings().image_job_timeout_s)
+    for _ in range(3):
+        now = datetime.utcnow()
+        stmt = (
+            pg_insert(ImageJob)
+            .values(id=uuid.uuid4(), agent_id=agent_id, prompt=prompt, status="queued", kind=kind,
+                    dedupe_key=key, cache_key=cache_key, created_at=now, updated_at=now)
+            .on_conflict_do_nothing(
+                index_elements=[ImageJob.agent_id, ImageJob.dedupe_key],
+                # Literal predicate: index inference needs constants, not bind params
+                index_where=text("status IN ('queued', 'running', 'finishing')"),
+            )
+            .returning(ImageJob.id)
+        )
+        new_id = (await session.execute(stmt)).scalar()
+        if new_id is not None:
+            return new_id, True
+        res = await session.execute(
+            select(ImageJob.id, ImageJob.created_at)
+            .where(ImageJob.agent_id == agent_id, ImageJob.dedupe_key == key, ImageJob.status.in_(IN_FLIGHT))
+            .limit(1)
+        )
+        row = res.first()
+        if row is None:
+            continue  # finished between our INSERT and SELECT; try again
+        created = row.created_at if row.created_at.tzinfo else row.created_at.replace(tzinfo=timezone.utc)
+        if datetime.now(timezone.utc) - created <= timeout:
+            print(f"[image_jobs] attached to in-flight job={row.id} agent={agent_id} kind={kind}")
+            return row.id, False
+        await session.execute(
+            update(ImageJob)
+            .where(ImageJob.id == row.id, ImageJob.status.in_(IN_FLIGHT))
+            .values(status="failed", updated_at=now)
+        )
+        print(f"[image_jobs] expired stale in-flight job={row.id} agent={agent_id}")
+    raise RuntimeError(f"could not create or attach image job agent={agent_id} kind={kind}")
+
+
+def webhook_url(job_id: str) -> Optional[str]:
+    """Callback URL for Fal, or None when the API is not publicly reachable."""
+    settings = get_settings()
+    if not settings.public_base_url:
+        return None
+    params = {"job_id": job_id}
+    if settings.fal_webhook_token:
+        params["token"] = settings.fal_webhook_token
+    return f"{settings.public_base_url.rstrip('/')}/webhooks/fal?{urlencode(params)}"
+
+
+def submit_target(job_id: str, kind: str, base_image_url: Optional[str]) -> str:
+    """Fal queue endpoint for a job, with the completion webhook attached when configured."""
+    model = FAL_EDIT_MODEL if kind == "edit" and base_image_url else FAL_GEN_MODEL
+    endpoint = f"{get_settings().fal_queue_url.rstrip('/')}/{model}"
+    hook = webhook_url(job_id)
+    return f"{endpoint}?{urlencode({'fal_webhook': hook})}" if hook else endpoint
+
+
+async def mark_submitted(job_id: uuid.UUID, data: dict[str, Any]) -> None:
+    """Record the Fal request handles so the webhook or the poller can finish the job."""
+    req_id = data.get("request_id") or data.get("id")
+    async with session_scope() as session:
+        job = await session.get(ImageJob, job_id)
+        if not job or job.status not in PENDING:
+            return  # webhook may already have landed
+        job.status = "running"
+        job.external_id = str(req_id) if req_id else None
+        job.status_url = data.get("status_url") or data.get("statusUrl") or (
+            f"{get_settings().fal_queue_url.rstrip('/')}/requests/{req_id}/status" if req_id else None
+        )
+        job.response_url = data.get("response_url") or data.get("responseUrl")
+        job.updated_at = datetime.utcnow()
+
+
+async def complete_job(job_id: uuid.UUID, url: Optional[str]) -> bool:
+    """Finish a job exactly once: persist the result and attach it to the agent.
+
+    Shared by the Fal webhook, the fallback poller and the worker's no-key path;
+    callers pass PLACEHOLDER_URL where the old poll loop fell back to it. A None
+    url marks the job failed. Returns False when the job is unknown or already finished.
+
+    The job is claimed with a conditional UPDATE to "finishing" and committed
+    before the (slow) upload, so concurrent webhook and poller calls return at
+    once instead of queueing on a row lock. A claim left "finishing" for
+    IMAGE_JOB_TIMEOUT_S (process died mid-upload) can be taken over.
+    """
+    now = datetime.utcnow()
+    abandoned = now - timedelta(seconds=get_settings().image_job_timeout_s)
+    async with session_scope() as session:
+        claim = await session.execute(
+            update(ImageJob)
+            .where(
+                ImageJob.id == job_id,
+                or_(ImageJob.status.in_(PENDING), and_(ImageJob.status == "finishing", ImageJob.updated_at < abandoned)),
+            )
+            .values(status="finishing" if url else "failed", result_url=url, updated_at=now)
+            .returning(ImageJob.agent_id, ImageJob.kind, ImageJob.cache_key)
+        )
+        job = claim.first()
+    if job is None:
+        return False
+    if not url:
+        print(f"[image_jobs] job failed job_id={job_id}")
+        return True
+
+    base = (job.kind or "gen") == "base"
+    stored = None
+    if base:
+        stored = await aupload_public_image_from_url(url)
+    elif job.cache_key and url != PLACEHOLDER_URL:
+        # Fal URLs are not permanent: one copy of ours serves both the message and the cache
+        stored = await aupload_public_image_from_url(url, object_path=f"cache/{job.agent_id}/{job_id}.jpg")
+
+    async with session_scope() as session:
+        ag = await session.get(Agent, job.agent_id)
+        if ag:
+            if base:
+                ag.base_image_url = stored or url
+                print(f"[image_jobs] Base image set agent={ag.id} url={'uploaded' if stored else 'fal_url'}")
+            else:
+                session.add(Message(user_id=ag.user_id, agent_id=ag.id, role="agent", text=None, image_url=stored or url))
+                print(f"[image_jobs] Added agent image message agent={ag.id} url={'uploaded' if stored else 'fal_url'}")
+                if job.cache_key and stored:
+                    # Without our own copy there is nothing safe to reuse later
+                    await image_cache.store(session, ag.id, job.cache_key, stored)
+        await session.execute(
+            update(ImageJob)
+            .where(ImageJob.id == job_id, ImageJob.status == "finishing")
+            .values(status="succeeded", updated_at=datetime.utcnow())
+        )
+    return True
+
+
+async def find_job_id(external_id: str) -> Optional[uuid.UUID]:
+    async with session_scope() as session:
+        res = await session.execute(select(ImageJob.id).where(ImageJob.external_id == external_id))
+        return res.scalars().first()
+
+
+async def poll_job(client: httpx.AsyncClient, job: ImageJob, headers: dict[str, str]) -> tuple[str, Optional[str]]:
+    """One status check against Fal. Returns (status, url); status is '' while still pending."""
+    r = await client.get(job.status_url, headers={**headers, "Accept": "application/json"})  # type: ignore[arg-type]
+    if r.status_code >= 500:
+        return "", None
+    status = (parse_fal_body(r.text).get("status") or "").lower()
+    if status in FAILURE:
+        return "failed", None
+    if status not in SUCCESS:
+        return "", None
+    response_url = job.response_url or (job.status_url or "").removesuffix("/status")
+    r2 = await client.get(response_url, headers=headers)
+    body = parse_fal_body(r2.text) if r2.is_success else {}
+    return "succeeded", extract_url(body.get("response") or body)
+
+
+async def stale_jobs(grace_s: float, limit: int = 50) -> list[ImageJob]:
+    """Jobs the poller should look at.
+
+    Running jobs that have not heard from Fal for `grace_s` seconds (with or
+    without a status URL to poll), queued jobs never picked up in that time
+    (the enqueue may have been lost), and "finishing" claims abandoned for
+    IMAGE_JOB_TIMEOUT_S.
+    """
+    now = datetime.utcnow()
+    cutoff = now - timedelta(seconds=grace_s)
+    abandoned = now - timedelta(seconds=get_settings().image_job_timeout_s)
+    async with session_scope() as session:
+        res = await session.execute(
+            select(ImageJob)
+            .where(
+                or_(
+                    and_(ImageJob.status.in_(PENDING), ImageJob.updated_at < cutoff),
+                    and_(ImageJob.status == "finishing", ImageJob.updated_at < abandoned),
+                )
+            )
+            .order_by(ImageJob.updated_at)
+            .limit(limit)
+        )
+        return list(res.scalars().all())
+
+
+async def touch(job_id: uuid.UUID) -> None:
+    async with session_scope() as session:
+        job = await session.get(ImageJob, job_id)
+        if job and job.status in PENDING:
+            job.updated_at = datetime.utcnow()
@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Awaitable, Callable
+
+from ..config import get_settings
+
+
+# In-process background pipeline for post-commit side effects.
+#
+# Work is submitted as zero-arg coroutine factories and executed by a small pool
+# of asyncio workers reading from a bounded queue. When the queue is full, new
+# work is dropped (and counted) instead of stalling the chat request.
+
+
+Job = Callable[[], Awaitable[None]]
+
+_queue: asyncio.Queue[tuple[str, Job]] | None = None
+_workers: list[asyncio.Task] = []
+_loop: asyncio.AbstractEventLoop | None = None
+_stats = {"submitted": 0, "dropped": 0, "done": 0, "failed": 0}
+
+
+async def _worker(queue: asyncio.Queue[tuple[str, Job]]) -> None:
+    while True:
+        name, job = await queue.get()
+        try:
+            await job()
+            _stats["done"] += 1
+        except Exception as e:
+            _stats["failed"] += 1
+            print(f"[pipeline] job failed name={name} err={e}")
+        finally:
+            queue.task_done()
+
+
+def _ensure_started() -> asyncio.Queue[tuple[str, Job]]:
+    global _queue, _loop
+    loop = asyncio.get_running_loop()
+    if _queue is None or _loop is not loop:
+        settings = get_settings()
+        _queue = asyncio.Queue(maxsize=settings.pipeline_max_queue)
+        _loop = loop
+        _workers.clear()
+        for _ in range(max(1, settings.pipeline_workers)):
+            _workers.append(loop.create_task(_worker(_queue)))
+    return _queue
+
+
+def submit(name: str, job: Job) -> bool:
+    """Schedule `job` to run after the current request. Returns False if shed."""
+    queue = _ensure_started()
+    try:
+        queue.put_nowait((name, job))
+    except asyncio.QueueFull:
+        _stats["dropped"] += 1
+        print(f"[pipeline] queue full; dropped name={name}")
+        return False
+    _stats["submitted"] += 1
+    return True
+
+
+async def stop(drain_timeout: float = 10.0) -> None:
+    """Drain pending work (bounded by `drain_timeout`) and cancel the workers."""
+    global _queue, _loop
+    if _queue is not None and _loop is asyncio.get_running_loop():
+        try:
+            await asyncio.wait_for(_queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            print(f"[pipeline] drain timed out pending={_queue.qsize()}")
+    for t in _workers:
+        t.cancel()
+    _workers.clear()
+    _queue = None
+    _loop = None
+
+
+def stats() -> dict[str, int]:
+    return {**_stats, "pending": _queue.qsize() if _queue is not None else 0}
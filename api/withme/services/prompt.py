@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Optional
+from zoneinfo import ZoneInfo
+
+from ..models import Agent
+from .context import Context
+
+
+# Rendered static prefixes by (agent id, fingerprint); bounded LRU per process
+MAX_CACHED = 4096
+
+STYLE = (
+    "Style: First-person; do not say you are an AI or assistant; stay in-character; show continuity; "
+    "vary length by availability; avoid over-eagerness unless affinity is high."
+)
+WEATHER_KINDS = ["clear", "partly cloudy", "cloudy", "light rain", "heavy rain", "breezy", "foggy"]
+
+
+def _mock_weather(city: str) -> str:
+    base = int(hashlib.sha256((city or "")[:64].encode()).hexdigest(), 16)
+    t = 12 + (base % 16)  # 12..27°C pseudo
+    return f"{WEATHER_KINDS[base % len(WEATHER_KINDS)]}, ~{t}°C"
+
+
+def _static_fields(agent: Agent) -> dict[str, Any]:
+    return {
+        "name": agent.name,
+        "persona": agent.persona_json or {},
+        "timezone": agent.timezone,
+        "romance_allowed": bool(agent.romance_allowed),
+    }
+
+
+def fingerprint(agent: Agent) -> str:
+    """Version of everything the static prefix depends on; changes when the persona is edited."""
+    raw = json.dumps(_static_fields(agent), sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()[:16]
+
+
+def render_prefix(agent: Agent) -> str:
+    """Persona, identity and rules: identical on every turn for the same agent version."""
+    f = _static_fields(agent)
+    persona = f["persona"]
+    home_city = persona.get("home_city") or persona.get("city") or ""
+    occupation = persona.get("occupation") or persona.get("job") or ""
+    # Sorted, compact JSON: a stable byte sequence regardless of dict insertion order
+    persona_json = json.dumps(persona, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return (
+        f"You are {f['name']}. Persona: {persona_json}.\n"
+        f"Identity: home_city={home_city or 'N/A'}, occupation={occupation or 'N/A'}, home_timezone={f['timezone']}.\n"
+        f"Weather at home: {_mock_weather(home_city)}.\n"
+        f"Safety: PG-13; romance_allowed={f['romance_allowed']}.\n"
+        f"{STYLE}"
+    )
+
+
+class _PrefixCache:
+    def __init__(self, max_entries: int = MAX_CACHED):
+        self.max_entries = max_entries
+        self._lru: OrderedDict[tuple[str, str], str] = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0}
+
+    def get(self, agent: Agent) -> str:
+        key = (str(agent.id), fingerprint(agent))
+        with self._lock:
+            text = self._lru.get(key)
+            if text is not None:
+                self._lru.move_to_end(key)
+                self.counters["hits"] += 1
+                return text
+        text = render_prefix(agent)
+        with self._lock:
+            self.counters["misses"] += 1
+            self._lru[key] = text
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+        return text
+
+
+_prefixes = _PrefixCache()
+
+
+def _warmth(affinity: float) -> str:
+    if affinity <= 0.25:
+        return "cooler, reserved tone"
+    if affinity >= 0.75:
+        return "warm, more affectionate tone"
+    return "balanced tone"
+
+
+def render_state(
+    agent: Agent, ctx: Context, now: Optional[datetime] = None, memories: Optional[list[str]] = None
+) -> str:
+    """Per-turn state, always in the same order, appended after the static prefix.
+
+    `memories` are the packed semantic hits; without them the top three raw hits are shown.
+    """
+    flags = ctx.flags if isinstance(ctx.flags, dict) else {}
+    tzname = flags.get("timezone") or agent.timezone
+    local = now
+    if local is None:
+        try:
+            local = datetime.now(ZoneInfo(str(tzname))) if tzname else datetime.now()
+        except Exception:
+            local = datetime.now()
+    if memories is None:
+        sem = flags.get("semantic") or []
+        memories = [m.get("metadata", {}).get("content", "") for m in sem][:3]
+    sem_str = ", ".join(memories)
+    scenarios = ", ".join([f"{s['track']}:{s['title']}({s['progress']:.0%})" for s in ctx.scenarios])
+    affinity = agent.affinity or 0.0
+    return (
+        "Current state:\n"
+        f"Local time: {local.strftime('%a %H:%M')}; timezone={tzname}.\n"
+        f"Mood={agent.mood or 0.0:.2f}; availability={ctx.availability}; "
+        f"affinity={affinity:.2f}, target a {_warmth(affinity)}.\n"
+        f"Scenarios: [{scenarios}].\n"
+        f"Memories (semantic hints): {sem_str or 'none'}."
+    )
+
+
+def compose_system(
+    agent: Agent, ctx: Context, now: Optional[datetime] = None, memories: Optional[list[str]] = None
+) -> str:
+    """System prompt = cached static prefix + volatile state, so providers can reuse the prefix."""
+    return f"{_prefixes.get(agent)}\n\n{render_state(agent, ctx, now, memories)}"
+
+
+def cache_stats() -> dict[str, int]:
+    return {**_prefixes.counters, "size": len(_prefixes._lru)}
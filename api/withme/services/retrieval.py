@@ -1,6 +1,10 @@
 from __future__ import annotations
 
-from typing import Any, Optional
+import asyncio
+import threading
+import time
+import uuid
+from typing import Any, Callable, Optional
 
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -8,90 +12,215 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from ..models import SemanticMemory, Agent
 from ..providers.openai_client import OpenAIProvider
 from ..config import get_settings
+from .vectorstore import get_vector_store
 
-try:
-    from pinecone import Pinecone  # type: ignore[import-untyped]
-except Exception:  # pragma: no cover
-    Pinecone = None  # type: ignore
 
-
-INDEX_NAME = "withme-semantic"
-EMBED_DIM = 1536
+def _enabled() -> bool:
+    settings = get_settings()
+    return bool(settings.openai_api_key and get_vector_store() is not None)
 
 
-def _ensure_index(pc) -> Any:
-    # Ensure index exists with correct dim/metric
+def verify_index() -> bool:
+    """Startup hook: resolve the vector store (and Pinecone index) ahead of traffic."""
+    store = get_vector_store()
+    if store is None:
+        return False
     try:
-        names = [i.name for i in pc.list_indexes()]  # type: ignore[attr-defined]
-    except Exception:
-        names = []
-    if INDEX_NAME not in names:
-        pc.create_index(name=INDEX_NAME, dimension=EMBED_DIM, metric="cosine")  # type: ignore[attr-defined]
-    return pc.Index(INDEX_NAME)  # type: ignore[attr-defined]
+        store.verify()
+        print(f"[retrieval] vector store ready backend={type(store).__name__}")
+        return True
+    except Exception as e:
+        print(f"[retrieval] vector store verification failed: {e}")
+        return False
+
+
+class VectorBatcher:
+    """Coalesce vector upserts over a short window and write them in bulk.
+
+    `add` is thread-safe and never blocks on I/O: a batch is flushed from a
+    background thread when it reaches `max_batch` vectors, or when `window_s`
+    elapses after the first pending vector.
+    """
+
+    def __init__(self, flush_fn: Callable[[list[dict[str, Any]]], None], max_batch: int = 100, window_s: float = 0.25):
+        self._flush_fn = flush_fn
+        self.max_batch = max_batch
+        self.window_s = window_s
+        self._pending: list[dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._timer: threading.Timer | None = None
+        self.flushed_batches = 0
+        self.flushed_vectors = 0
+
+    def add(self, vectors: list[dict[str, Any]]) -> None:
+        with self._lock:
+            self._pending.extend(vectors)
+            full = len(self._pending) >= self.max_batch
+            if not full and self._timer is None:
+                self._timer = threading.Timer(self.window_s, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            threading.Thread(target=self.flush, daemon=True).start()
+
+    def flush(self) -> int:
+        with self._lock:
+            batch, self._pending = self._pending, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        for i in range(0, len(batch), self.max_batch):
+            chunk = batch[i : i + self.max_batch]
+            try:
+                self._flush_fn(chunk)
+                self.flushed_batches += 1
+                self.flushed_vectors += len(chunk)
+            except Exception as e:
+                print(f"[retrieval] batch upsert failed size={len(chunk)} err={e}")
+        return len(batch)
+
+
+def _upsert_to_index(vectors: list[dict[str, Any]]) -> None:
+    store = get_vector_store()
+    if store is not None:
+        store.upsert(vectors)
+
+
+_batcher: VectorBatcher | None = None
+
+
+def get_batcher() -> VectorBatcher:
+    global _batcher
+    if _batcher is None:
+        settings = get_settings()
+        _batcher = VectorBatcher(
+            _upsert_to_index,
+            max_batch=settings.vector_batch_size,
+            window_s=settings.vector_batch_window_ms / 1000.0,
+        )
+    return _batcher
+
+
+def flush_pending() -> int:
+    """Write out any buffered vectors (shutdown / end of worker task)."""
+    return _batcher.flush() if _batcher is not None else 0
 
 
 async def ensure_embedding(session: AsyncSession, agent: Agent, provider: Optional[OpenAIProvider] = None) -> None:
-    # Example: embed the latest semantic memory into Pinecone (no-op if not configured)
-    settings = get_settings()
-    if not settings.pinecone_api_key or Pinecone is None or not settings.openai_api_key:
+    # Example: embed the latest semantic memory into the vector store (no-op if not configured)
+    if not _enabled():
         return
     res = await session.execute(
         select(SemanticMemory).where(SemanticMemory.agent_id == agent.id).order_by(SemanticMemory.updated_at.desc()).limit(1)
     )
     mem = res.scalars().first()
-    if not mem:
+    if mem:
+        await embed_memory(mem, provider)
+
+
+async def embed_memory(mem: SemanticMemory, provider: Optional[OpenAIProvider] = None) -> None:
+    """Embed one memory row and queue its vector; needs no session, so call it after commit."""
+    if not _enabled() or not mem.content:
         return
     provider = provider or OpenAIProvider()
-    vec = provider.embed([mem.content])[0]
-    pc = Pinecone(api_key=settings.pinecone_api_key)
-    index = _ensure_index(pc)
-    index.upsert(vectors=[{
-        "id": f"semantic:{agent.id}:{mem.id}",
+    vec = (await provider.aembed([mem.content]))[0]
+    get_batcher().add([{
+        "id": f"semantic:{mem.agent_id}:{mem.id}",
         "values": vec,
         "metadata": {
             "type": "semantic",
-            "agent_id": str(agent.id),
+            "agent_id": str(mem.agent_id),
             "content": mem.content[:500],
+            "ts": mem.updated_at.timestamp(),
         },
     }])
 
 
-def semantic_query(text: str, top_k: int = 8) -> list[dict[str, Any]]:
+def rerank(hits: list[dict[str, Any]], top_k: int, now: float | None = None) -> list[dict[str, Any]]:
+    """Blend similarity with recency and drop duplicate contents.
+
+    Recency adds up to `semantic_recency_weight`, halving every
+    `semantic_recency_half_life_h` hours of age (metadata "ts", epoch seconds).
+    """
     settings = get_settings()
-    if not settings.pinecone_api_key or Pinecone is None or not settings.openai_api_key:
+    now = time.time() if now is None else now
+    half_life_s = max(1.0, settings.semantic_recency_half_life_h * 3600.0)
+    scored = []
+    for h in hits:
+        ts = (h.get("metadata") or {}).get("ts")
+        boost = 0.0
+        if isinstance(ts, (int, float)):
+            boost = settings.semantic_recency_weight * 0.5 ** (max(0.0, now - ts) / half_life_s)
+        scored.append(((h.get("score") or 0.0) + boost, h))
+    scored.sort(key=lambda x: x[0], reverse=True)
+    out: list[dict[str, Any]] = []
+    seen: set[str] = set()
+    for rank_score, h in scored:
+        content = (h.get("metadata") or {}).get("content", "")
+        if content in seen:
+            continue
+        seen.add(content)
+        out.append({**h, "rank_score": rank_score})
+        if len(out) >= top_k:
+            break
+    return out
+
+
+def semantic_query(text: str, agent_id: uuid.UUID | str, top_k: int | None = None) -> list[dict[str, Any]]:
+    """Agent-scoped recall: over-fetch from the agent's vectors, re-rank, trim to top_k."""
+    if not _enabled():
         return []
+    settings = get_settings()
+    top_k = top_k or settings.semantic_top_k
     provider = OpenAIProvider()
     vec = provider.embed([text])[0]
-    pc = Pinecone(api_key=settings.pinecone_api_key)
-    index = _ensure_index(pc)
-    out = index.query(vector=vec, top_k=top_k, include_metadata=True)
-    return [
-        {"id": m["id"], "score": m.get("score"), "metadata": m.get("metadata", {})}
-        for m in getattr(out, "matches", [])
-    ]
+    hits = get_vector_store().query(vec, top_k * max(1, settings.semantic_overfetch), agent_id=str(agent_id))  # type: ignore[union-attr]
+    return rerank(hits, top_k)
 
 
-def upsert_message_embedding(agent: Agent, message: Any) -> None:
-    """Best-effort embed a single Message row and upsert into Pinecone.
+async def asemantic_query(text: str, agent_id: uuid.UUID | str, top_k: int | None = None) -> list[dict[str, Any]]:
+    """Async `semantic_query`: embeds on the shared async client, queries the store in a thread."""
+    if not _enabled():
+        return []
+    settings = get_settings()
+    top_k = top_k or settings.semantic_top_k
+    vec = (await OpenAIProvider().aembed([text]))[0]
+    store = get_vector_store()
+    hits = await asyncio.to_thread(store.query, vec, top_k * max(1, settings.semantic_overfetch), str(agent_id))  # type: ignore[union-attr]
+    return rerank(hits, top_k)
 
-    No-op if dependencies or keys are missing, or text is empty.
+
+def upsert_message_embeddings(agent_id: uuid.UUID, messages: list[Any]) -> int:
+    """Best-effort embed Message rows in one call and queue them for bulk upsert.
+
+    No-op if dependencies or keys are missing; messages without text are skipped.
+    Returns the number of vectors queued.
     """
-    settings = get_settings()
-    if not settings.pinecone_api_key or Pinecone is None or not settings.openai_api_key:
-        return
-    text = getattr(message, "text", None)
-    if not text:
-        return
+    if not _enabled():
+        return 0
+    rows = [m for m in messages if getattr(m, "text", None)]
+    if not rows:
+        return 0
     provider = OpenAIProvider()
-    vec = provider.embed([text])[0]
-    pc = Pinecone(api_key=settings.pinecone_api_key)
-    index = _ensure_index(pc)
-    meta = {
-        "type": "message",
-        "agent_id": str(agent.id),
-        "user_id": str(getattr(message, "user_id", "")),
-        "message_id": str(getattr(message, "id", "")),
-        "role": getattr(message, "role", ""),
-        "content": text[:500],
-    }
-    index.upsert(vectors=[{"id": f"message:{message.id}", "values": vec, "metadata": meta}])
+    vecs = provider.embed([m.text for m in rows])
+    vectors = []
+    for message, vec in zip(rows, vecs):
+        meta = {
+            "type": "message",
+            "agent_id": str(agent_id),
+            "user_id": str(getattr(message, "user_id", "")),
+            "message_id": str(getattr(message, "id", "")),
+            "role": getattr(message, "role", ""),
+            "content": message.text[:500],
+        }
+        created_at = getattr(message, "created_at", None)
+        if created_at is not None:
+            meta["ts"] = created_at.timestamp()
+        vectors.append({"id": f"message:{message.id}", "values": vec, "metadata": meta})
+    get_batcher().add(vectors)
+    return len(vectors)
+
+
+def upsert_message_embedding(agent_id: uuid.UUID, message: Any) -> None:
+    """Single-message convenience wrapper around `upsert_message_embeddings`."""
+    upsert_message_embeddings(agent_id, [message])
@@ -1,79 +1,143 @@
 from __future__ import annotations
 
+import uuid
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import Any, Awaitable, Callable, Optional
 
-from sqlalchemy import select
+from sqlalchemy import select, tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from ..db import session_scope
 from ..models import Agent, Message, SemanticMemory
 from ..providers.openai_client import OpenAIProvider
-from .retrieval import ensure_embedding
+from .retrieval import embed_memory
 
 
-async def _summarize_recent(session: AsyncSession, agent: Agent, max_messages: int = 20) -> Optional[str]:
-    """Summarize stable facts/preferences from recent conversation, or None.
+def _watermark(mem: Optional[SemanticMemory]) -> tuple[Optional[datetime], Optional[uuid.UUID]]:
+    # Rows written before watermarks existed fall back to their update time
+    if mem is None:
+        return None, None
+    return mem.last_message_at or mem.updated_at, mem.last_message_id
 
-    Uses OpenAI if configured; otherwise returns None.
-    """
-    from ..config import get_settings
 
-    settings = get_settings()
-    if not settings.openai_api_key:
-        return None
+def _after(at: Optional[datetime], mid: Optional[uuid.UUID]):
+    """Messages strictly past an (created_at, id) watermark; id breaks timestamp ties."""
+    if mid is None:
+        return Message.created_at > at
+    return tuple_(Message.created_at, Message.id) > tuple_(at, mid, types=[Message.created_at.type, Message.id.type])
+
+
+async def _latest(session: AsyncSession, agent_id: uuid.UUID) -> Optional[SemanticMemory]:
     res = await session.execute(
-        select(Message)
-        .where(Message.agent_id == agent.id)
-        .order_by(Message.created_at.desc())
-        .limit(max_messages)
+        select(SemanticMemory)
+        .where(SemanticMemory.agent_id == agent_id)
+        .order_by(SemanticMemory.updated_at.desc())
+        .limit(1)
     )
-    msgs = list(reversed(res.scalars().all()))
-    if not msgs:
-        return None
-    texts: list[str] = []
-    for m in msgs:
-        if m.text:
-            texts.append(f"{m.role}: {m.text}")
-    convo = "\n".join(texts)
+    return res.scalars().first()
+
+
+async def _load_delta(
+    session: AsyncSession,
+    agent_id: uuid.UUID,
+    last: Optional[SemanticMemory] = None,
+    max_messages: int = 50,
+) -> list[Message]:
+    """The newest `max_messages` past the last memory's watermark, oldest first.
+
+    Only the newest window of a larger backlog is read, like the full
+    re-summary did; the watermark then moves past the rest.
+    """
+    q = select(Message).where(Message.agent_id == agent_id)
+    at, mid = _watermark(last)
+    if at is not None:
+        q = q.where(_after(at, mid))
+    res = await session.execute(q.order_by(Message.created_at.desc(), Message.id.desc()).limit(max_messages))
+    return list(reversed(res.scalars().all()))
+
+
+async def _summarize(last: Optional[SemanticMemory], msgs: list[Message]) -> Optional[str]:
+    """Merge the delta into the last memory; None when the delta has no text (images only)."""
+    convo = "\n".join(f"{m.role}: {m.text}" for m in msgs if m.text)
     if not convo:
         return None
     provider = OpenAIProvider()
-    system = "Summarize stable facts and preferences learned since last update. Output 3-5 bullet points."
-    out = provider.chat(system, [{"role": "user", "content": convo}])
+    if last and last.content:
+        system = (
+            "You maintain a short memory of stable facts and preferences. Merge the new conversation into the"
+            " existing memory: keep what still holds, update what changed, add what is new. Output 3-7 bullet points."
+        )
+        content = f"Existing memory:\n{last.content}\n\nNew conversation:\n{convo}"
+    else:
+        system = "Summarize stable facts and preferences learned since last update. Output 3-5 bullet points."
+        content = convo
+    out = await provider.achat(system, [{"role": "user", "content": content}])
     return out.strip() if out else None
 
 
 async def maybe_update_semantic_memory(
-    session: AsyncSession,
-    agent: Agent,
-    min_interval_hours: int = 6,
+    agent_id: uuid.UUID,
+    min_interval_hours: float = 6,
+    due: Any = None,
+    acquire: Optional[Callable[[], Awaitable[Any]]] = None,
 ) -> bool:
-    """Insert a new SemanticMemory row if the last update is older than interval.
+    """Insert a new SemanticMemory row if the last update is older than interval
+    and messages arrived after its watermark, then embed it.
 
-    Also ensures the latest memory is embedded into Pinecone if configured.
-    Returns True if an update occurred.
+    No DB session is held across the LLM calls: the delta is read in one short
+    session, summarized and embedded outside it, and written in another. The
+    write is skipped if another refresh got there first. `due` is an extra
+    WHERE clause on Agent for the read; `acquire` is awaited before each LLM
+    call (summary and embedding). Returns True if an update occurred.
     """
-    res = await session.execute(
-        select(SemanticMemory)
-        .where(SemanticMemory.agent_id == agent.id)
-        .order_by(SemanticMemory.updated_at.desc())
-        .limit(1)
-    )
-    last = res.scalars().first()
-    now = datetime.now(timezone.utc)
-    if last and (now - last.updated_at) < timedelta(hours=min_interval_hours):
+    from ..config import get_settings
+
+    if not get_settings().openai_api_key:
         return False
-    summary = await _summarize_recent(session, agent)
-    if not summary:
+    async with session_scope() as session:
+        q = select(Agent.id).where(Agent.id == agent_id)
+        if due is not None:
+            q = q.where(due)
+        if (await session.execute(q)).scalars().first() is None:
+            return False
+        last = await _latest(session, agent_id)
+        now = datetime.now(timezone.utc)
+        if last and (now - last.updated_at) < timedelta(hours=min_interval_hours):
+            return False
+        msgs = await _load_delta(session, agent_id, last)
+    if not msgs:
         return False
-    mem = SemanticMemory(agent_id=agent.id, content=summary, updated_at=now)
-    session.add(mem)
-    # Flush so ensure_embedding can read it if needed
-    await session.flush()
+
+    summary = None
+    if any(m.text for m in msgs):
+        if acquire is not None:
+            await acquire()
+        summary = await _summarize(last, msgs)
+        if not summary:
+            return False
+
+    newest = msgs[-1]
+    async with session_scope() as session:
+        current = await _latest(session, agent_id)
+        if (current.id if current else None) != (last.id if last else None):
+            return False  # refreshed concurrently
+        if summary is None:
+            # Images only: nothing to remember, but the agent is no longer due
+            if current is not None:
+                current.last_message_at, current.last_message_id = newest.created_at, newest.id
+            else:
+                session.add(SemanticMemory(agent_id=agent_id, content="", updated_at=now,
+                                           last_message_at=newest.created_at, last_message_id=newest.id))
+            return False
+        mem = SemanticMemory(agent_id=agent_id, content=summary, updated_at=now,
+                             last_message_at=newest.created_at, last_message_id=newest.id)
+        session.add(mem)
+        await session.flush()
     try:
-        await ensure_embedding(session, agent)
+        if acquire is not None:
+            await acquire()
+        await embed_memory(mem)
     except Exception:
         # Best effort; embedding may be unavailable in dev
         pass
     return True
-
@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import asyncio
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional
+
+from sqlalchemy import and_, exists, func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import get_settings
+from ..db import session_scope
+from ..models import Agent, Message, SemanticMemory
+from .semantic import maybe_update_semantic_memory
+
+
+TASK = "worker.tasks.run_semantic_refresh"
+PROGRESS_TTL_S = 2 * 86_400
+
+
+def progress_key(run_id: str) -> str:
+    return f"semantic_refresh:{run_id}"
+
+
+def _due_filter(interval_h: float):
+    """Agents with messages past their memory watermark, whose memory is older than the interval."""
+    epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+    def latest(col):
+        # Explicit correlate: two of these sit inside the EXISTS, where auto-correlation
+        # would only see `messages` and pull in an uncorrelated `agents`
+        return (
+            select(col)
+            .where(SemanticMemory.agent_id == Agent.id)
+            .order_by(SemanticMemory.updated_at.desc())
+            .limit(1)
+            .correlate(Agent)
+            .scalar_subquery()
+        )
+
+    wm_at = latest(func.coalesce(SemanticMemory.last_message_at, SemanticMemory.updated_at))
+    wm_id = latest(SemanticMemory.last_message_id)
+    last_mem = latest(SemanticMemory.updated_at)
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=interval_h)
+    # Same (created_at, id) ordering as semantic._after; legacy rows without an id count ties as new
+    has_new = exists().where(
+        and_(
+            Message.agent_id == Agent.id,
+            tuple_(Message.created_at, Message.id)
+            > tuple_(func.coalesce(wm_at, epoch), func.coalesce(wm_id, uuid.UUID(int=0))),
+        )
+    )
+    return and_(has_new, func.coalesce(last_mem, epoch) < cutoff)
+
+
+async def due_agent_ids(session: AsyncSession, after: Optional[uuid.UUID], limit: int, interval_h: float) -> list[uuid.UUID]:
+    q = select(Agent.id).where(_due_filter(interval_h)).order_by(Agent.id).limit(limit)
+    if after is not None:
+        q = q.where(Agent.id > after)
+    return list((await session.execute(q)).scalars().all())
+
+
+def shard(ids: list[Any], size: int) -> list[list[Any]]:
+    size = max(1, size)
+    return [ids[i : i + size] for i in range(0, len(ids), size)]
+
+
+async def plan_refresh() -> dict[str, Any]:
+    """Find due agents in keyset batches and enqueue one worker task per shard.
+
+    Progress for the run lives in a Redis hash (see `get_progress`).
+    """
+    from ..jobs import QUEUE_BACKGROUND, enqueue_many, get_redis
+
+    settings = get_settings()
+    run_id = uuid.uuid4().hex
+    key = progress_key(run_id)
+
+    def start() -> None:
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.hset(key, mapping={"started_at": time.time(), "agents": 0, "shards": 0, "shards_done": 0,
+                                "updated": 0, "skipped": 0, "failed": 0, "planned": 0})
+        pipe.expire(key, PROGRESS_TTL_S)
+        pipe.execute()
+
+    def enqueue(ids: list[uuid.UUID]) -> int:
+        parts = shard([str(i) for i in ids], settings.semantic_refresh_shard_size)
+        enqueue_many(TASK, [(part, run_id) for part in parts], queue=QUEUE_BACKGROUND)
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.hincrby(key, "agents", len(ids))
+        pipe.hincrby(key, "shards", len(parts))
+        pipe.execute()
+        return len(parts)
+
+    # Redis calls are blocking; keep them off the event loop
+    await asyncio.to_thread(start)
+    last: Optional[uuid.UUID] = None
+    agents = shards = 0
+    while True:
+        async with session_scope() as session:
+            ids = await due_agent_ids(session, last, settings.cron_batch_size, settings.semantic_refresh_interval_h)
+        if not ids:
+            break
+        shards += await asyncio.to_thread(enqueue, ids)
+        agents += len(ids)
+        last = ids[-1]
+        if len(ids) < settings.cron_batch_size:
+            break
+    await asyncio.to_thread(get_redis().hset, key, "planned", 1)
+    print(f"[cron] semantic_refresh run={run_id} agents={agents} shards={shards}")
+    return {"run_id": run_id, "agents": agents, "shards": shards}
+
+
+async def refresh_agents(agent_ids: list[str], run_id: Optional[str] = None) -> dict[str, int]:
+    """Worker body for one shard: short sessions per agent, LLM calls gated by the global bucket."""
+    from ..jobs import get_redis
+    from ..ratelimit import llm_bucket
+    from .retrieval import flush_pending
+
+    settings = get_settings()
+    bucket = llm_bucket()
+    counts = {"updated": 0, "skipped": 0, "failed": 0}
+    for raw in agent_ids:
+        try:
+            # Re-checks the due filter: the agent may have been refreshed since the shard was planned.
+            # Each LLM call (summary, embedding) takes one token from the global bucket.
+            ok = await maybe_update_semantic_memory(
+                uuid.UUID(str(raw)),
+                min_interval_hours=settings.semantic_refresh_interval_h,
+                due=_due_filter(settings.semantic_refresh_interval_h),
+                acquire=bucket.acquire,
+            )
+            counts["updated" if ok else "skipped"] += 1
+        except Exception as e:
+            counts["failed"] += 1
+            print(f"[semantic_refresh] agent={raw} failed: {e}")
+    # Vectors from embed_memory are batched; write them before the task ends
+    await asyncio.to_thread(flush_pending)
+    if run_id:
+        try:
+            redis = get_redis()
+            pipe = redis.pipeline(transaction=False)
+            for k, v in counts.items():
+                pipe.hincrby(progress_key(run_id), k, v)
+            pipe.hincrby(progress_key(run_id), "shards_done", 1)
+            pipe.execute()
+        except Exception as e:
+            print(f"[semantic_refresh] progress update failed run={run_id}: {e}")
+    return counts
+
+
+def get_progress(run_id: str) -> Optional[dict[str, Any]]:
+    from ..jobs import get_redis
+
+    raw = get_redis().hgetall(progress_key(run_id))
+    if not raw:
+        return None
+    data = {(k.decode() if isinstance(k, bytes) else k): float(v) for k, v in raw.items()}
+    out: dict[str, Any] = {k: int(v) for k, v in data.items() if k != "started_at"}
+    out["elapsed_s"] = round(time.time() - data.get("started_at", time.time()), 1)
+    out["done"] = bool(out.get("planned")) and out.get("shards_done", 0) >= out.get("shards", 0)
+    return out
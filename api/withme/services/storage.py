@@ -1,13 +1,38 @@
 from __future__ import annotations
 
-import os
-from typing import Optional
+import asyncio
+import threading
+from typing import Any, Optional
 
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
 
 from ..config import get_settings
 
 
+CHUNK_SIZE = 64 * 1024
+
+# One pooled session per process (keep-alive to Supabase and the image CDN), and
+# the buckets already known to exist so uploads skip the list/create round-trips.
+_session: requests.Session | None = None
+_session_lock = threading.Lock()
+_known_buckets: set[str] = set()
+
+
+def _get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+                s.mount("https://", adapter)
+                s.mount("http://", adapter)
+                _session = s
+    return _session
+
+
 def _headers(key: str, content_type: Optional[str] = None) -> dict:
     h = {
         'Authorization': f'Bearer {key}',
@@ -18,30 +43,72 @@ def _headers(key: str, content_type: Optional[str] = None) -> dict:
     return h
 
 
-def ensure_public_bucket(bucket: str = 'agent-avatars') -> bool:
-    """Ensure a public storage bucket exists. Returns True on success or if already exists."""
+def _target() -> tuple[Optional[str], Optional[str]]:
     settings = get_settings()
     base = settings.supabase_url or settings.supabase_project_url
     key = settings.supabase_service_role_key or settings.supabase_anon_key
+    return (base.rstrip('/') if base else None), key
+
+
+def _passthrough_headers(src_headers: Any) -> dict[str, str]:
+    # Forward Content-Length only when the body is not content-encoded, so the
+    # raw bytes we stream are exactly the bytes the length describes.
+    h = {}
+    length = src_headers.get('content-length')
+    if length and not src_headers.get('content-encoding'):
+        h['Content-Length'] = length
+    return h
+
+
+class _SizedStream:
+    """File-like view of a streamed response with a known length.
+
+    requests sends a sized body with Content-Length (rather than chunked) and
+    http.client pulls it through `read` in blocks, so nothing is buffered.
+    """
+
+    def __init__(self, raw: Any, length: int):
+        self._raw = raw
+        self._length = length
+
+    def __len__(self) -> int:
+        return self._length
+
+    def read(self, size: int = CHUNK_SIZE) -> bytes:
+        return self._raw.read(size)
+
+
+def ensure_public_bucket(bucket: str = 'agent-avatars') -> bool:
+    """Ensure a public storage bucket exists. Returns True on success or if already exists.
+
+    A positive answer is cached for the life of the process.
+    """
+    if bucket in _known_buckets:
+        return True
+    base, key = _target()
     if not base or not key:
         return False
+    session = _get_session()
     try:
         # Try to list buckets and check by name
-        r = requests.get(f"{base.rstrip('/')}/storage/v1/bucket", headers=_headers(key), timeout=15)
+        r = session.get(f"{base}/storage/v1/bucket", headers=_headers(key), timeout=15)
         print(f"[storage] list buckets status={r.status_code}")
         if r.ok:
             arr = r.json() if r.headers.get('content-type','').lower().startswith('application/json') else []
             if isinstance(arr, list) and any((b.get('name') == bucket) for b in arr):
                 print(f"[storage] bucket exists name={bucket}")
+                _known_buckets.add(bucket)
                 return True
         # Create bucket
-        cr = requests.post(
-            f"{base.rstrip('/')}/storage/v1/bucket",
+        cr = session.post(
+            f"{base}/storage/v1/bucket",
             headers=_headers(key, 'application/json'),
             json={"name": bucket, "public": True},
             timeout=15,
         )
         print(f"[storage] create bucket name={bucket} status={cr.status_code}")
+        if cr.ok:
+            _known_buckets.add(bucket)
         return cr.ok
     except Exception:
         print("[storage] ensure_public_bucket failed")
@@ -49,37 +116,82 @@ def ensure_public_bucket(bucket: str = 'agent-avatars') -> bool:
 
 
 def upload_public_image_from_url(url: str, bucket: str = 'agent-avatars', object_path: Optional[str] = None) -> Optional[str]:
-    """Download an image from `url` and upload to Supabase Storage.
+    """Stream an image from `url` into Supabase Storage without buffering it.
 
-    Returns the public URL if upload succeeds; otherwise None.
+    The download is piped chunk by chunk into the upload request, so memory stays
+    bounded by CHUNK_SIZE regardless of image size. Returns the public URL if the
+    upload succeeds; otherwise None.
     """
-    settings = get_settings()
-    base = settings.supabase_url or settings.supabase_project_url
-    key = settings.supabase_service_role_key or settings.supabase_anon_key
+    base, key = _target()
     if not base or not key:
         return None
     if not object_path:
         import uuid
         object_path = f"{uuid.uuid4()}.jpg"
+    session = _get_session()
     try:
-        # Ensure bucket exists (best effort)
+        # Ensure bucket exists (best effort, cached)
         print(f"[storage] upload start bucket={bucket} path={object_path}")
         ensure_public_bucket(bucket)
-        r = requests.get(url, timeout=20)
-        r.raise_for_status()
-        content = r.content
-        ct = r.headers.get('content-type', 'image/jpeg')
-        up = requests.post(
-            f"{base.rstrip('/')}/storage/v1/object/{bucket}/{object_path}",
-            headers={**_headers(key, ct), 'x-upsert': 'true'},
-            data=content,
-            timeout=30,
-        )
-        print(f"[storage] upload status={up.status_code}")
+        with session.get(url, timeout=20, stream=True) as r:
+            r.raise_for_status()
+            ct = r.headers.get('content-type', 'image/jpeg')
+            extra = _passthrough_headers(r.headers)
+            # A sized body streams with Content-Length; otherwise chunked transfer
+            body = _SizedStream(r.raw, int(extra['Content-Length'])) if extra else r.iter_content(CHUNK_SIZE)
+            up = session.post(
+                f"{base}/storage/v1/object/{bucket}/{object_path}",
+                headers={**_headers(key, ct), 'x-upsert': 'true'},
+                data=body,
+                timeout=30,
+            )
+        print(f"[storage] upload status={up.status_code} streamed_length={extra.get('Content-Length', 'chunked')}")
         up.raise_for_status()
         # Public URL convention
-        public_url = f"{base.rstrip('/')}/storage/v1/object/public/{bucket}/{object_path}"
+        public_url = f"{base}/storage/v1/object/public/{bucket}/{object_path}"
         return public_url
     except Exception:
         print("[storage] upload failed; falling back to original URL")
         return None
+
+
+async def aupload_public_image_from_url(
+    url: str,
+    bucket: str = 'agent-avatars',
+    object_path: Optional[str] = None,
+    client: httpx.AsyncClient | None = None,
+) -> Optional[str]:
+    """Async twin of `upload_public_image_from_url` for event-loop callers (webhook, poller, async worker)."""
+    base, key = _target()
+    if not base or not key:
+        return None
+    if not object_path:
+        import uuid
+        object_path = f"{uuid.uuid4()}.jpg"
+    if bucket not in _known_buckets:
+        await asyncio.to_thread(ensure_public_bucket, bucket)
+    own = client is None
+    client = client or httpx.AsyncClient(timeout=30.0)
+    try:
+        print(f"[storage] upload start bucket={bucket} path={object_path}")
+        async with client.stream("GET", url, timeout=20.0) as r:
+            r.raise_for_status()
+            ct = r.headers.get('content-type', 'image/jpeg')
+            extra = _passthrough_headers(r.headers)
+            # Raw bytes only for a sized, unencoded body; otherwise decode and send chunked
+            body = r.aiter_raw(CHUNK_SIZE) if extra else r.aiter_bytes(CHUNK_SIZE)
+            up = await client.post(
+                f"{base}/storage/v1/object/{bucket}/{object_path}",
+                headers={**_headers(key, ct), 'x-upsert': 'true', **extra},
+                content=body,
+                timeout=30.0,
+            )
+        print(f"[storage] upload status={up.status_code} streamed_length={extra.get('Content-Length', 'chunked')}")
+        up.raise_for_status()
+        return f"{base}/storage/v1/object/public/{bucket}/{object_path}"
+    except Exception:
+        print("[storage] upload failed; falling back to original URL")
+        return None
+    finally:
+        if own:
+            await client.aclose()
@@ -0,0 +1,336 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional, Protocol
+
+from ..config import get_settings
+
+try:
+    from pinecone import Pinecone  # type: ignore[import-untyped]
+except Exception:  # pragma: no cover
+    Pinecone = None  # type: ignore
+
+try:
+    import numpy as np
+except Exception:  # pragma: no cover - optional
+    np = None  # type: ignore
+
+try:
+    import fcntl
+except Exception:  # pragma: no cover - non-POSIX dev machines: single process only
+    fcntl = None  # type: ignore
+
+
+INDEX_NAME = "withme-semantic"
+EMBED_DIM = 1536
+
+
+class VectorStore(Protocol):
+    """Minimal vector-store surface used by services/retrieval.py.
+
+    Vectors are Pinecone-shaped dicts: {"id", "values", "metadata"}; query
+    results are {"id", "score", "metadata"} sorted by descending score.
+    """
+
+    def verify(self) -> None: ...
+
+    def upsert(self, vectors: list[dict[str, Any]]) -> None: ...
+
+    def query(
+        self, vector: list[float], top_k: int, agent_id: Optional[str] = None, filter: Optional[dict[str, Any]] = None
+    ) -> list[dict[str, Any]]: ...
+
+
+def _ensure_index(pc) -> Any:
+    # Ensure index exists with correct dim/metric
+    try:
+        names = [i.name for i in pc.list_indexes()]  # type: ignore[attr-defined]
+    except Exception:
+        names = []
+    if INDEX_NAME not in names:
+        pc.create_index(name=INDEX_NAME, dimension=EMBED_DIM, metric="cosine")  # type: ignore[attr-defined]
+    return pc.Index(INDEX_NAME)  # type: ignore[attr-defined]
+
+
+class PineconeStore:
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        self._index: Any = None
+        self._lock = threading.Lock()
+
+    def _get_index(self) -> Any:
+        # Process-wide index handle; the control-plane check runs only once.
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = _ensure_index(Pinecone(api_key=self.api_key))
+        return self._index
+
+    def verify(self) -> None:
+        self._get_index()
+
+    def upsert(self, vectors: list[dict[str, Any]]) -> None:
+        self._get_index().upsert(vectors=vectors)
+
+    def query(self, vector, top_k, agent_id=None, filter=None):
+        flt = {k: {"$eq": v} for k, v in (filter or {}).items()}
+        if agent_id:
+            flt["agent_id"] = {"$eq": str(agent_id)}
+        out = self._get_index().query(vector=vector, top_k=top_k, include_metadata=True, filter=flt or None)
+        return [
+            {"id": m["id"], "score": m.get("score"), "metadata": m.get("metadata", {})}
+            for m in getattr(out, "matches", [])
+        ]
+
+
+class _Partition:
+    """One agent's vectors: a float32 memmap (capacity x dim) plus an append-only log.
+
+    Rows are L2-normalised on write so cosine similarity is a single mat-vec.
+    Above `ivf_min_rows` an IVF coarse quantiser (k-means centroids) is built
+    lazily; rows appended after the build are always scanned exactly.
+
+    API pods and workers share the files: writers take an exclusive flock on
+    the partition, readers a shared one, and each side replays log lines and
+    remaps the (grown in place) vector file when they changed on disk. An
+    upsert appends one log line per vector ({"id", "row", "metadata"}; the
+    first line holds {"dim"}), so a write costs O(batch), not O(partition).
+    """
+
+    def __init__(self, path: str, ivf_min_rows: int, nprobe: int):
+        self.path = path
+        self.ivf_min_rows = ivf_min_rows
+        self.nprobe = nprobe
+        self.lock = threading.Lock()
+        self.ids: list[str] = []
+        self.metadata: list[dict[str, Any]] = []
+        self.pos: dict[str, int] = {}
+        self.dim = 0
+        self.capacity = 0
+        self.mat: Any = None
+        self._ivf: tuple[Any, list[Any], int] | None = None  # (centroids, row lists, rows covered)
+        self._log_pos = 0  # bytes of the log replayed so far
+        self._lock_fd: Optional[int] = None
+
+    @property
+    def _vec_file(self) -> str:
+        return os.path.join(self.path, "vectors.f32")
+
+    @property
+    def _log_file(self) -> str:
+        return os.path.join(self.path, "log.jsonl")
+
+    @contextmanager
+    def _flock(self, exclusive: bool) -> Iterator[None]:
+        # Cross-process lock; the thread lock is already held by the caller
+        if fcntl is None:
+            yield
+            return
+        if self._lock_fd is None:
+            self._lock_fd = os.open(os.path.join(self.path, "lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _refresh(self) -> None:
+        """Apply log lines and vector-file growth from other processes."""
+        try:
+            size = os.path.getsize(self._log_file)
+        except FileNotFoundError:
+            return
+        if size > self._log_pos:
+            with open(self._log_file, "rb") as f:
+                f.seek(self._log_pos)
+                chunk = f.read(size - self._log_pos)
+            done = chunk.rfind(b"\n") + 1  # a torn trailing line is picked up next time
+            for line in chunk[:done].splitlines():
+                rec = json.loads(line)
+                if "dim" in rec:
+                    self.dim = rec["dim"]
+                    continue
+                i = rec["row"]
+                while len(self.ids) <= i:
+                    self.ids.append("")
+                    self.metadata.append({})
+                self.ids[i], self.metadata[i] = rec["id"], rec["metadata"]
+                self.pos[rec["id"]] = i
+            self._log_pos += done
+        if self.dim:
+            cap = os.path.getsize(self._vec_file) // (4 * self.dim)
+            if cap != self.capacity:
+                self.capacity = cap
+                self.mat = np.memmap(self._vec_file, dtype=np.float32, mode="r+", shape=(cap, self.dim))
+
+    def _grow(self, need: int) -> None:
+        cap = max(64, self.capacity)
+        while cap < need:
+            cap *= 2
+        if cap == self.capacity:
+            return
+        # Extend in place (zero-filled) so other processes can remap the same file
+        with open(self._vec_file, "ab") as f:
+            f.truncate(cap * self.dim * 4)
+        self.capacity = cap
+        self.mat = np.memmap(self._vec_file, dtype=np.float32, mode="r+", shape=(cap, self.dim))
+
+    def upsert(self, vectors: list[dict[str, Any]]) -> None:
+        with self.lock:
+            os.makedirs(self.path, exist_ok=True)
+            with self._flock(exclusive=True):
+                self._refresh()
+                lines: list[str] = []
+                if not self.dim:
+                    self.dim = len(vectors[0]["values"])
+                    lines.append(json.dumps({"dim": self.dim}))
+                new_ids = {v["id"] for v in vectors if v["id"] not in self.pos}
+                self._grow(len(self.ids) + len(new_ids))
+                for v in vectors:
+                    row = np.asarray(v["values"], dtype=np.float32)
+                    norm = float(np.linalg.norm(row))
+                    if norm:
+                        row = row / norm
+                    i = self.pos.get(v["id"])
+                    if i is None:
+                        i = len(self.ids)
+                        self.ids.append(v["id"])
+                        self.metadata.append({})
+                        self.pos[v["id"]] = i
+                    self.mat[i] = row
+                    self.metadata[i] = v.get("metadata") or {}
+                    lines.append(json.dumps({"id": v["id"], "row": i, "metadata": self.metadata[i]}))
+                # Rows first, then the log lines that make them visible
+                self.mat.flush()
+                with open(self._log_file, "a") as f:
+                    f.write("\n".join(lines) + "\n")
+                self._log_pos = os.path.getsize(self._log_file)
+                if self._ivf is not None and self._ivf[2] < len(self.ids) * 0.8:
+                    self._ivf = None  # too much uncovered tail; rebuild on next query
+
+    def _build_ivf(self, n: int) -> None:
+        nlist = min(n, max(4, int(np.sqrt(n))))
+        data = self.mat[:n]
+        rng = np.random.default_rng(0)
+        centroids = np.array(data[rng.choice(n, nlist, replace=False)])
+        for _ in range(8):
+            assign = np.argmax(data @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = data[assign == c]
+                if len(members):
+                    m = members.mean(axis=0)
+                    centroids[c] = m / (np.linalg.norm(m) or 1.0)
+        assign = np.argmax(data @ centroids.T, axis=1)
+        lists = [np.flatnonzero(assign == c) for c in range(nlist)]
+        self._ivf = (centroids, lists, n)
+
+    def _candidates(self, q: Any, n: int) -> Any:
+        if n < self.ivf_min_rows:
+            return None
+        if self._ivf is None:
+            self._build_ivf(n)
+        centroids, lists, covered = self._ivf  # type: ignore[misc]
+        probe = np.argsort(centroids @ q)[::-1][: self.nprobe]
+        rows = [lists[c] for c in probe]
+        rows.append(np.arange(covered, n))  # tail appended since the build
+        return np.concatenate(rows)
+
+    def query(self, vector: list[float], top_k: int, filter: Optional[dict[str, Any]]) -> list[dict[str, Any]]:
+        with self.lock:
+            if not os.path.isdir(self.path):
+                return []
+            with self._flock(exclusive=False):
+                self._refresh()
+                return self._query(vector, top_k, filter)
+
+    def _query(self, vector: list[float], top_k: int, filter: Optional[dict[str, Any]]) -> list[dict[str, Any]]:
+        n = len(self.ids)
+        if not n:
+            return []
+        q = np.asarray(vector, dtype=np.float32)
+        q = q / (np.linalg.norm(q) or 1.0)
+        cand = self._candidates(q, n)
+        scores = (self.mat[cand] if cand is not None else self.mat[:n]) @ q
+        rows = cand if cand is not None else np.arange(n)
+        if filter:
+            keep = np.array(
+                [all(self.metadata[r].get(k) == v for k, v in filter.items()) for r in rows], dtype=bool
+            )
+            rows, scores = rows[keep], scores[keep]
+        k = min(top_k, len(rows))
+        if not k:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            {"id": self.ids[rows[i]], "score": float(scores[i]), "metadata": self.metadata[rows[i]]}
+            for i in top
+        ]
+
+
+class LocalVectorStore:
+    """Vector index persisted under `root`, partitioned per agent; safe to share between processes."""
+
+    def __init__(self, root: str, ivf_min_rows: int = 20_000, nprobe: int = 8):
+        if np is None:
+            raise RuntimeError("numpy not installed; cannot use the local vector store")
+        self.root = root
+        self.ivf_min_rows = ivf_min_rows
+        self.nprobe = nprobe
+        self._parts: dict[str, _Partition] = {}
+        self._lock = threading.Lock()
+
+    def _partition(self, agent_id: str) -> _Partition:
+        with self._lock:
+            part = self._parts.get(agent_id)
+            if part is None:
+                part = _Partition(os.path.join(self.root, agent_id), self.ivf_min_rows, self.nprobe)
+                self._parts[agent_id] = part
+            return part
+
+    def verify(self) -> None:
+        os.makedirs(self.root, exist_ok=True)
+
+    def upsert(self, vectors: list[dict[str, Any]]) -> None:
+        by_agent: dict[str, list[dict[str, Any]]] = {}
+        for v in vectors:
+            agent_id = str((v.get("metadata") or {}).get("agent_id") or "_global")
+            by_agent.setdefault(agent_id, []).append(v)
+        for agent_id, vecs in by_agent.items():
+            self._partition(agent_id).upsert(vecs)
+
+    def query(self, vector, top_k, agent_id=None, filter=None):
+        if agent_id:
+            return self._partition(str(agent_id)).query(vector, top_k, filter)
+        names = os.listdir(self.root) if os.path.isdir(self.root) else []
+        hits: list[dict[str, Any]] = []
+        for name in names:
+            hits.extend(self._partition(name).query(vector, top_k, filter))
+        hits.sort(key=lambda h: h["score"], reverse=True)
+        return hits[:top_k]
+
+
+_store: VectorStore | None = None
+_store_lock = threading.Lock()
+
+
+def get_vector_store() -> Optional[VectorStore]:
+    """Configured backend (`VECTOR_BACKEND`), or None when it is unavailable."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                settings = get_settings()
+                backend = (settings.vector_backend or "pinecone").lower()
+                if backend == "local" and np is not None:
+                    _store = LocalVectorStore(
+                        settings.vector_store_dir,
+                        ivf_min_rows=settings.vector_ivf_min_rows,
+                        nprobe=settings.vector_ivf_nprobe,
+                    )
+                elif backend == "pinecone" and settings.pinecone_api_key and Pinecone is not None:
+                    _store = PineconeStore(settings.pinecone_api_key)
+    return _store
@@ -0,0 +1,208 @@
+"""Latency-injecting stand-ins for the upstream services, for load benchmarks.
+
+- OpenAI: /v1/chat/completions (plain and streamed) and /v1/embeddings
+- Fal: queue submit, status/result, and the completion webhook back to the API
+- Vector store: an in-process LocalVectorStore wrapper that sleeps per call
+
+Each HTTP stub is a small Starlette app served by uvicorn on its own thread, so
+stub latency never competes with the API's event loop.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import random
+import socket
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Optional
+
+import httpx
+import numpy as np
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from api.withme.services.vectorstore import LocalVectorStore
+
+
+EMBED_DIM = 1536
+IMAGE_URL = "https://picsum.photos/seed/bench/512/768"
+
+
+@dataclass
+class Latency:
+    """Per-call delay: `mean_ms` +/- uniform `jitter_ms`, never negative."""
+
+    mean_ms: float = 0.0
+    jitter_ms: float = 0.0
+
+    def sample_s(self) -> float:
+        ms = self.mean_ms + (random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0)
+        return max(0.0, ms) / 1000.0
+
+    async def wait(self) -> None:
+        delay = self.sample_s()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+def _embedding(text: str) -> list[float]:
+    # Deterministic unit vector per text, so repeated texts look like cache hits upstream
+    seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+    v = np.random.default_rng(seed).normal(size=EMBED_DIM).astype(np.float32)
+    return (v / np.linalg.norm(v)).tolist()
+
+
+def openai_app(latency: Latency, token_delay: Latency = Latency(), reply: str = "Sounds good, tell me more!") -> Starlette:
+    words = reply.split(" ")
+
+    async def chat(request: Request):
+        body = await request.json()
+        await latency.wait()  # time to first token
+        cid = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        model = body.get("model", "gpt-4o-mini")
+        if not body.get("stream"):
+            return JSONResponse({
+                "id": cid, "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": reply}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(words), "total_tokens": len(words)},
+            })
+
+        async def events():
+            for i, w in enumerate(words):
+                chunk = {
+                    "id": cid, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "delta": {"content": w if i == 0 else " " + w}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await token_delay.wait()
+            done = {"id": cid, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            yield f"data: {json.dumps(done)}\n\ndata: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body.get("input")
+        texts = [inputs] if isinstance(inputs, str) else list(inputs or [])
+        await latency.wait()
+        return JSONResponse({
+            "object": "list", "model": body.get("model", "text-embedding-3-small"),
+            "data": [{"object": "embedding", "index": i, "embedding": _embedding(str(t))} for i, t in enumerate(texts)],
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        })
+
+    return Starlette(routes=[
+        Route("/v1/chat/completions", chat, methods=["POST"]),
+        Route("/v1/embeddings", embeddings, methods=["POST"]),
+    ])
+
+
+def fal_app(latency: Latency, render: Latency) -> Starlette:
+    """Fal queue API: submit returns handles at once; the result lands after `render`.
+
+    When the submit carries `?fal_webhook=`, the stub posts the result there like Fal does.
+    """
+    done_at: dict[str, float] = {}
+    pending: set[asyncio.Task] = set()
+
+    def _handles(request: Request, rid: str) -> dict[str, str]:
+        base = str(request.base_url).rstrip("/")
+        return {"request_id": rid, "status_url": f"{base}/requests/{rid}/status", "response_url": f"{base}/requests/{rid}"}
+
+    async def _callback(url: str, rid: str, delay: float) -> None:
+        await asyncio.sleep(delay)
+        payload = {"request_id": rid, "status": "OK", "payload": {"images": [{"url": IMAGE_URL}]}}
+        try:
+            async with httpx.AsyncClient(timeout=10.0) as client:
+                await client.post(url, json=payload)
+        except Exception as e:
+            print(f"[bench.fal] webhook failed: {e}")
+
+    async def submit(request: Request):
+        await latency.wait()
+        rid = uuid.uuid4().hex
+        delay = render.sample_s()
+        done_at[rid] = time.monotonic() + delay
+        hook = request.query_params.get("fal_webhook")
+        if hook:
+            task = asyncio.create_task(_callback(hook, rid, delay))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        return JSONResponse(_handles(request, rid))
+
+    async def status(request: Request):
+        await latency.wait()
+        ready = time.monotonic() >= done_at.get(request.path_params["rid"], 0.0)
+        return JSONResponse({"status": "COMPLETED" if ready else "IN_PROGRESS"})
+
+    async def result(request: Request):
+        await latency.wait()
+        return JSONResponse({"images": [{"url": IMAGE_URL}]})
+
+    return Starlette(routes=[
+        Route("/requests/{rid}/status", status, methods=["GET"]),
+        Route("/requests/{rid}", result, methods=["GET"]),
+        Route("/{model:path}", submit, methods=["POST"]),
+    ])
+
+
+class LatencyVectorStore:
+    """VectorStore wrapper adding a network-like delay to each call (calls run in threads)."""
+
+    def __init__(self, inner: LocalVectorStore, latency: Latency):
+        self.inner = inner
+        self.latency = latency
+
+    def _sleep(self) -> None:
+        delay = self.latency.sample_s()
+        if delay:
+            time.sleep(delay)
+
+    def verify(self) -> None:
+        self.inner.verify()
+
+    def upsert(self, vectors: list[dict[str, Any]]) -> None:
+        self._sleep()
+        self.inner.upsert(vectors)
+
+    def query(self, vector, top_k, agent_id=None, filter=None):
+        self._sleep()
+        return self.inner.query(vector, top_k, agent_id=agent_id, filter=filter)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class ServerThread:
+    """Run an ASGI app with uvicorn on a background thread; `url` is its base URL."""
+
+    def __init__(self, app: Any, port: Optional[int] = None, **config: Any):
+        self.port = port or free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        cfg = uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning", **config)
+        self.server = uvicorn.Server(cfg)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def start(self, timeout: float = 15.0) -> "ServerThread":
+        self.thread.start()
+        deadline = time.monotonic() + timeout
+        while not self.server.started:
+            if not self.thread.is_alive() or time.monotonic() > deadline:
+                raise RuntimeError(f"server on {self.url} did not start")
+            time.sleep(0.05)
+        return self
+
+    def stop(self) -> None:
+        self.server.should_exit = True
+        self.thread.join(timeout=30)
@@ -0,0 +1,70 @@
+"""Offline benchmark for the local vector store.
+
+Fills one agent partition with random unit vectors, then compares exact and
+IVF top-k: median/p95 query latency and recall@k of IVF against exact.
+
+Usage:
+    python -m bench.vector_recall --rows 50000 --dim 1536 --queries 200
+"""
+from __future__ import annotations
+
+import argparse
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from api.withme.services.vectorstore import LocalVectorStore
+
+
+def _timed_queries(store: LocalVectorStore, queries: np.ndarray, k: int) -> tuple[list[float], list[set[str]]]:
+    lat, ids = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        hits = store.query(q.tolist(), top_k=k, agent_id="bench")
+        lat.append((time.perf_counter() - t0) * 1000)
+        ids.append({h["id"] for h in hits})
+    return lat, ids
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--rows", type=int, default=50_000)
+    ap.add_argument("--dim", type=int, default=1536)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=8)
+    ap.add_argument("--nprobe", type=int, default=8)
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(args.rows, args.dim)).astype(np.float32)
+    # queries near stored rows, as in real recall where memories resemble the prompt
+    queries = data[rng.choice(args.rows, args.queries)] + 0.1 * rng.normal(size=(args.queries, args.dim)).astype(np.float32)
+
+    with tempfile.TemporaryDirectory() as root:
+        exact = LocalVectorStore(root, ivf_min_rows=args.rows + 1)
+        t0 = time.perf_counter()
+        for i in range(0, args.rows, 1000):
+            exact.upsert([
+                {"id": str(j), "values": data[j].tolist(), "metadata": {"agent_id": "bench"}}
+                for j in range(i, min(i + 1000, args.rows))
+            ])
+        print(f"upserted {args.rows:,} x {args.dim} in {time.perf_counter() - t0:.1f}s")
+        ivf = LocalVectorStore(root, ivf_min_rows=1, nprobe=args.nprobe)
+        t0 = time.perf_counter()
+        ivf.query(queries[0].tolist(), top_k=args.k, agent_id="bench")
+        print(f"IVF build (first query) {time.perf_counter() - t0:.1f}s")
+
+        lat_exact, ids_exact = _timed_queries(exact, queries, args.k)
+        lat_ivf, ids_ivf = _timed_queries(ivf, queries, args.k)
+
+    recall = statistics.mean(len(a & b) / args.k for a, b in zip(ids_exact, ids_ivf))
+    for name, lat in (("exact", lat_exact), ("ivf", lat_ivf)):
+        p95 = sorted(lat)[int(len(lat) * 0.95) - 1]
+        print(f"{name:<6} p50={statistics.median(lat):7.2f}ms p95={p95:7.2f}ms")
+    print(f"ivf recall@{args.k}={recall:.3f} (nprobe={args.nprobe})")
+
+
+if __name__ == "__main__":
+    main()
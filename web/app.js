@@ -1,6 +1,6 @@
 const state = {
   token: localStorage.getItem('token') || 'dev',
-  nextBefore: null,
+  nextCursor: null,
   loading: false,
   poll: null,
   agentId: localStorage.getItem('agent_id') || null,
@@ -91,40 +91,87 @@ async function loadInitial() {
     renderAgentHeader(agent, s);
     const items = (page.items || []).slice().sort((a,b) => new Date(a.created_at) - new Date(b.created_at));
     renderMessages(items);
-    state.nextBefore = page.next_before;
+    state.nextCursor = page.next_cursor;
   } catch (e) {
     console.error(e);
   }
 }
 
 async function loadMore() {
-  if (!state.nextBefore || state.loading) return;
+  if (!state.nextCursor || state.loading) return;
   state.loading = true;
   try {
-    const page = await api(`/messages?before=${encodeURIComponent(state.nextBefore)}`);
+    const page = await api(`/messages?cursor=${encodeURIComponent(state.nextCursor)}`);
     if (page.items?.length) {
       const items = page.items.slice().sort((a,b) => new Date(a.created_at) - new Date(b.created_at));
       renderMessages(items, { prepend: true });
-      state.nextBefore = page.next_before;
+      state.nextCursor = page.next_cursor;
     } else {
-      state.nextBefore = null;
+      state.nextCursor = null;
     }
   } finally { state.loading = false; }
 }
 
+async function streamChat(text, onDelta) {
+  // POST /chat/stream and parse Server-Sent Events frames as they arrive
+  const res = await fetch('/chat/stream', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json', ...authHeaders() },
+    body: JSON.stringify({ text }),
+  });
+  if (!res.ok || !res.body) throw new Error(await res.text());
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buf = '';
+  let done = null;
+  for (;;) {
+    const { value, done: eof } = await reader.read();
+    if (eof) break;
+    buf += decoder.decode(value, { stream: true });
+    let idx;
+    while ((idx = buf.indexOf('\n\n')) !== -1) {
+      const frame = buf.slice(0, idx);
+      buf = buf.slice(idx + 2);
+      let event = 'message';
+      let data = '';
+      for (const line of frame.split('\n')) {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) data += line.slice(5).trim();
+      }
+      if (!data) continue;
+      const payload = JSON.parse(data);
+      if (event === 'token') onDelta(payload.delta || '');
+      else if (event === 'done') done = payload;
+      else if (event === 'error') throw new Error(payload.error || 'stream_failed');
+    }
+  }
+  return done;
+}
+
 async function sendMessage() {
   const text = el('message').value.trim();
   if (!text) return;
   el('message').value = '';
   try {
-    await api('/chat/send', { method: 'POST', body: { text } });
-    // Poll messages briefly to catch the reply
-    await refreshRecent();
+    renderMessages([{ role: 'user', text, created_at: new Date().toISOString() }]);
+    // Live bubble filled token-by-token
+    renderMessages([{ role: 'agent', text: '…', created_at: new Date().toISOString() }]);
+    const live = el('history').lastElementChild.lastElementChild;
+    const scroller = document.querySelector('.chat');
+    let acc = '';
+    const done = await streamChat(text, (delta) => {
+      acc += delta;
+      live.textContent = acc;
+      scroller.scrollTop = scroller.scrollHeight;
+    });
+    if (done?.reply?.text) live.textContent = done.reply.text;
+    // Poll messages briefly to catch image replies
     if (state.poll) clearInterval(state.poll);
     state.poll = setInterval(refreshRecent, 1500);
     setTimeout(() => state.poll && clearInterval(state.poll), 10000);
   } catch (e) {
     console.error(e);
+    await refreshRecent();
   }
 }
 
@@ -176,7 +223,7 @@ async function ensureAgentSelect() {
       history.innerHTML = '';
       const items2 = (page.items || []).slice().sort((a,b) => new Date(a.created_at) - new Date(b.created_at));
       renderMessages(items2);
-      state.nextBefore = page.next_before;
+      state.nextCursor = page.next_cursor;
     };
   } catch (e) {
     console.warn('agent select load failed', e);
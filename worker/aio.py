@@ -0,0 +1,212 @@
+"""Async worker mode: many RQ jobs in flight on one event loop.
+
+Jobs are popped from the same Redis queues the API enqueues to, highest
+priority first (api.withme.jobs.PRIORITY unless given). Tasks with a native
+coroutine (worker.tasks.ASYNC_TASKS, e.g. image jobs) run on the loop and
+share one httpx connection pool; anything else runs in a thread. At most
+WORKER_CONCURRENCY jobs run at once. On SIGTERM/SIGINT the worker stops
+dequeuing, waits up to WORKER_DRAIN_TIMEOUT_S for in-flight jobs, and puts
+back any that did not finish.
+
+Jobs go through RQ's registries like with a regular worker (started while
+running, then finished or failed), so queue stats stay accurate. Running
+jobs are heartbeated; if the process dies, their started entries expire and
+RQ's registry cleanup (run here too) moves them to the failed registry.
+
+    WORKER_MODE=async python -m worker.run
+"""
+from __future__ import annotations
+
+import asyncio
+import inspect
+import signal
+import traceback
+import uuid
+from typing import Any
+
+import httpx
+from redis import Redis
+from rq import Queue
+from rq.defaults import DEFAULT_RESULT_TTL
+from rq.exceptions import DequeueTimeout
+from rq.executions import Execution
+from rq.job import Job, JobStatus
+from rq.registry import clean_registries
+from rq.utils import now
+
+from api.withme.config import get_settings
+from api.withme.jobs import PRIORITY
+from worker.tasks import ASYNC_TASKS
+
+
+HEARTBEAT_S = 30
+# A started entry outlives a few missed heartbeats before it counts as abandoned
+EXECUTION_TTL_S = HEARTBEAT_S * 3
+
+
+class AsyncWorker:
+    def __init__(self, redis: Redis, queue_names: list[str], concurrency: int = 32, drain_timeout_s: float = 30.0):
+        self.redis = redis
+        self.queues = [Queue(name, connection=redis) for name in queue_names]
+        self.concurrency = max(1, concurrency)
+        self.drain_timeout_s = drain_timeout_s
+        self.name = f"aio-{uuid.uuid4().hex[:12]}"
+        self._stopping = asyncio.Event()
+        self._inflight: dict[asyncio.Task, tuple[Job, Queue]] = {}
+        self._executions: dict[str, Execution] = {}
+        self.counters = {"started": 0, "finished": 0, "failed": 0, "requeued": 0}
+
+    def stop(self) -> None:
+        if not self._stopping.is_set():
+            print(f"[aio-worker] stopping; in_flight={len(self._inflight)}")
+            self._stopping.set()
+
+    def _dequeue(self) -> tuple[Job, Queue] | None:
+        # Short blocking pop so shutdown is noticed within a couple of seconds
+        try:
+            return Queue.dequeue_any(self.queues, timeout=2, connection=self.redis)
+        except DequeueTimeout:
+            return None
+
+    # Registry bookkeeping; blocking Redis calls, run in a thread
+    def _start(self, job: Job) -> None:
+        with self.redis.pipeline() as pipe:
+            self._executions[job.id] = Execution.create(job, EXECUTION_TTL_S, pipeline=pipe, worker_name=self.name)
+            job.prepare_for_execution(self.name, pipe)
+            pipe.execute()
+
+    def _end(self, job: Job, exc_string: str | None = None) -> None:
+        with self.redis.pipeline() as pipe:
+            execution = self._executions.pop(job.id, None)
+            if execution is not None:
+                execution.delete(job, pipe)
+            job.ended_at = now()
+            if exc_string is None:
+                job.set_status(JobStatus.FINISHED, pipeline=pipe)
+                result_ttl = job.get_result_ttl(DEFAULT_RESULT_TTL)
+                if result_ttl != 0:
+                    job.finished_job_registry.add(job, result_ttl, pipe)
+            else:
+                job.set_status(JobStatus.FAILED, pipeline=pipe)
+                job.failed_job_registry.add(job, ttl=job.failure_ttl, exc_string=exc_string, pipeline=pipe)
+            job.save(pipeline=pipe, include_meta=False, include_result=False)
+            pipe.execute()
+
+    def _heartbeat(self) -> None:
+        with self.redis.pipeline() as pipe:
+            for job, _ in list(self._inflight.values()):
+                execution = self._executions.get(job.id)
+                if execution is not None:
+                    execution.heartbeat(job.started_job_registry, EXECUTION_TTL_S, pipe)
+            pipe.execute()
+        for q in self.queues:
+            clean_registries(q)
+
+    async def _keepalive(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await asyncio.to_thread(self._heartbeat)
+            except Exception as e:
+                print(f"[aio-worker] heartbeat failed: {e}")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=HEARTBEAT_S)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _execute(self, job: Job, client: httpx.AsyncClient) -> Any:
+        fn = ASYNC_TASKS.get(job.func_name or "")
+        if fn is not None:
+            kwargs = dict(job.kwargs)
+            if "client" in inspect.signature(fn).parameters:
+                kwargs["client"] = client
+            return await fn(*job.args, **kwargs)
+        return await asyncio.to_thread(job.func, *job.args, **job.kwargs)
+
+    async def _run_job(self, job: Job, client: httpx.AsyncClient, slots: asyncio.Semaphore) -> None:
+        try:
+            await asyncio.to_thread(self._start, job)
+            self.counters["started"] += 1
+            await self._execute(job, client)
+            await asyncio.to_thread(self._end, job)
+            self.counters["finished"] += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.counters["failed"] += 1
+            print(f"[aio-worker] job failed id={job.id} func={job.func_name} err={e}")
+            try:
+                await asyncio.to_thread(self._end, job, traceback.format_exc())
+            except Exception:
+                pass
+        finally:
+            slots.release()
+
+    async def _drain(self) -> None:
+        pending = list(self._inflight)
+        if not pending:
+            return
+        _, still = await asyncio.wait(pending, timeout=self.drain_timeout_s)
+        for task in still:
+            job, queue = self._inflight[task]
+            task.cancel()
+            try:
+                execution = self._executions.pop(job.id, None)
+                if execution is not None:
+                    with self.redis.pipeline() as pipe:
+                        execution.delete(job, pipe)
+                        pipe.execute()
+                queue.enqueue_job(job)
+                self.counters["requeued"] += 1
+            except Exception as e:
+                print(f"[aio-worker] requeue failed id={job.id} err={e}")
+        if still:
+            await asyncio.gather(*still, return_exceptions=True)
+
+    async def run(self) -> None:
+        slots = asyncio.Semaphore(self.concurrency)
+        print(f"[aio-worker] listening on {[q.name for q in self.queues]} concurrency={self.concurrency}")
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        keepalive = asyncio.create_task(self._keepalive())
+        async with httpx.AsyncClient(timeout=15.0, limits=limits) as client:
+            while not self._stopping.is_set():
+                await slots.acquire()
+                if self._stopping.is_set():
+                    slots.release()
+                    break
+                try:
+                    got = await asyncio.to_thread(self._dequeue)
+                except Exception as e:
+                    slots.release()
+                    print(f"[aio-worker] dequeue failed: {e}")
+                    await asyncio.sleep(1)
+                    continue
+                if got is None:
+                    slots.release()
+                    continue
+                job, queue = got
+                task = asyncio.create_task(self._run_job(job, client, slots))
+                self._inflight[task] = (job, queue)
+                task.add_done_callback(lambda t: self._inflight.pop(t, None))
+            await self._drain()
+        await keepalive
+        print(f"[aio-worker] stopped {self.counters}")
+
+
+async def main(queue_names: list[str] | None = None) -> None:
+    settings = get_settings()
+    # Blocking pops must outlive the pool's socket timeout, so the worker keeps its own connection
+    redis = Redis.from_url(settings.redis_url or "redis://localhost:6379/0")
+    worker = AsyncWorker(
+        redis,
+        queue_names or list(PRIORITY),
+        concurrency=settings.worker_concurrency,
+        drain_timeout_s=settings.worker_drain_timeout_s,
+    )
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, worker.stop)
+    await worker.run()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
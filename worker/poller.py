@@ -0,0 +1,88 @@
+"""Fallback completion for image jobs whose Fal webhook never arrived.
+
+A single async loop: every IMAGE_POLL_INTERVAL_S it picks jobs that have been
+quiet for IMAGE_POLL_GRACE_S, checks running ones against Fal concurrently, and
+finishes them through the same path as the webhook. Queued jobs whose RQ task
+is gone are re-enqueued, abandoned completions are resumed, and jobs older
+than IMAGE_JOB_TIMEOUT_S are marked failed.
+
+    python -m worker.poller
+"""
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+from api.withme import jobs
+from api.withme.config import get_settings
+from api.withme.models import ImageJob
+from api.withme.services import image_jobs
+
+
+def _expired(job: ImageJob, timeout_s: float) -> bool:
+    created = job.created_at if job.created_at.tzinfo else job.created_at.replace(tzinfo=timezone.utc)
+    return datetime.now(timezone.utc) - created > timedelta(seconds=timeout_s)
+
+
+async def _check(client: httpx.AsyncClient, job: ImageJob, headers: dict[str, str], timeout_s: float) -> None:
+    if job.status == "finishing":
+        # Claimed, then the process died before writing the result: finish it here
+        await image_jobs.complete_job(job.id, job.result_url)
+        print(f"[poller] resumed abandoned completion job_id={job.id}")
+        return
+    if job.status == "queued" or not job.status_url:
+        # Never submitted, or submitted without a handle to poll: nothing to ask Fal
+        if _expired(job, timeout_s):
+            print(f"[poller] giving up job_id={job.id} status={job.status}")
+            await image_jobs.complete_job(job.id, None)
+            return
+        if job.status == "queued" and not await asyncio.to_thread(jobs.image_job_pending, job.id):
+            await asyncio.to_thread(jobs.enqueue_image_job, job.id, job.kind)
+            print(f"[poller] re-enqueued job_id={job.id} (enqueue lost)")
+        await image_jobs.touch(job.id)
+        return
+    try:
+        status, url = await image_jobs.poll_job(client, job, headers)
+    except Exception as e:
+        print(f"[poller] poll failed job_id={job.id} err={e}")
+        status, url = "", None
+    if status == "succeeded":
+        await image_jobs.complete_job(job.id, url or image_jobs.PLACEHOLDER_URL)
+        print(f"[poller] completed job_id={job.id} (missed webhook)")
+    elif status == "failed":
+        await image_jobs.complete_job(job.id, None)
+    elif _expired(job, timeout_s):
+        print(f"[poller] giving up job_id={job.id}")
+        await image_jobs.complete_job(job.id, None)
+    else:
+        await image_jobs.touch(job.id)
+
+
+async def poll_once(client: httpx.AsyncClient) -> int:
+    settings = get_settings()
+    stale = await image_jobs.stale_jobs(settings.image_poll_grace_s)
+    if not stale:
+        return 0
+    headers = {"Authorization": f"Key {settings.fal_api_key}"}
+    await asyncio.gather(*(_check(client, j, headers, settings.image_job_timeout_s) for j in stale))
+    return len(stale)
+
+
+async def run() -> None:
+    settings = get_settings()
+    print(f"[poller] started interval={settings.image_poll_interval_s}s grace={settings.image_poll_grace_s}s")
+    async with httpx.AsyncClient(timeout=15.0) as client:
+        while True:
+            try:
+                n = await poll_once(client)
+                if n:
+                    print(f"[poller] checked {n} stale job(s)")
+            except Exception as e:
+                print(f"[poller] cycle failed: {e}")
+            await asyncio.sleep(settings.image_poll_interval_s)
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
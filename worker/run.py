@@ -1,18 +1,31 @@
 from __future__ import annotations
 
 import os
+import sys
 
 from worker.queue import RQContext  # noqa: F401 (kept for future enqueues)
 
 
 def main() -> None:
     redis_url = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+    from api.withme.config import get_settings
+
+    # Highest priority first; `python -m worker.run interactive` pins a pool to one queue
+    queues = sys.argv[1:] or [q.strip() for q in get_settings().worker_queues.split(",") if q.strip()]
+    if get_settings().worker_mode.lower() == "async":
+        import asyncio
+
+        from worker.aio import main as aio_main
+
+        print(f"[worker] Starting async worker on {queues}...")
+        asyncio.run(aio_main(queues))
+        return
     try:
         # Start a blocking RQ worker via CLI (compatible across RQ versions)
         import subprocess
 
-        print("[worker] Starting RQ worker via CLI on default queue...")
-        subprocess.run(["rq", "worker", "-u", redis_url, "default"], check=True)
+        print(f"[worker] Starting RQ worker via CLI on {queues}...")
+        subprocess.run(["rq", "worker", "-u", redis_url, *queues], check=True)
     except Exception as e:  # pragma: no cover - optional
         print(f"[worker] Unable to start RQ worker: {e}")
         print("Install redis-server + python packages or adjust REDIS_URL.")